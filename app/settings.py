@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,6 +48,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    # before anything that reads or changes the response body
+    "core.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -100,6 +103,28 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# https://docs.djangoproject.com/en/4.2/topics/auth/passwords/
+# the first hasher is used for new passwords; hashes made by the others (or with
+# other cost parameters) are upgraded on the user's next successful login
+
+PASSWORD_HASHERS = [
+    'core.hashers.TunedScryptPasswordHasher',
+    'core.hashers.TunedArgon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+PASSWORD_SCRYPT_WORK_FACTOR = 2**14
+PASSWORD_SCRYPT_BLOCK_SIZE = 8
+PASSWORD_SCRYPT_PARALLELISM = 1
+
+# failed logins allowed per email / client address within the window (seconds)
+LOGIN_FAILURE_LIMIT = 5
+LOGIN_FAILURE_IP_LIMIT = 50
+LOGIN_FAILURE_WINDOW = 15 * 60
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -118,9 +143,20 @@ USE_TZ = True
 STATIC_URL = "/static/"
 STATIC_ROOT = BASE_DIR / 'static'
 
-MEDIR_URL = '/media/'
+MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# media is served by core.views.serve_media. set to 'x-sendfile' or
+# 'x-accel-redirect' to let the front end server send the file body; with
+# nginx, MEDIA_ACCEL_REDIRECT_PREFIX must be an internal location aliasing MEDIA_ROOT
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+# max-age for media without a content addressed name, those are cached for a year
+MEDIA_CACHE_MAX_AGE = 60 * 60
+# an unreferenced image modified this recently is left for gc_media rather than
+# deleted at once, since an upload that reuses it may not have committed yet
+MEDIA_RELEASE_GRACE_SECONDS = 60 * 60
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -128,10 +164,111 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = 'core.User'
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'throttle',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# the token buckets of core.throttling, which must stay in process memory: the
+# rates in DEFAULT_THROTTLE_RATES are enforced by each worker process separately
+THROTTLE_CACHE = 'throttle'
+
+# seconds a materialized /api/recipe/snapshot/ payload lives in the default
+# cache; the cache needn't be shared, each worker's copy catches up from the change log
+RECIPE_SNAPSHOT_TIMEOUT = 24 * 60 * 60
+
+# change log entries read per /api/recipe/sync/ call, and the most a client may ask for
+SYNC_BATCH_SIZE = 500
+SYNC_MAX_BATCH_SIZE = 1000
+# change log entries younger than this are left for the next sync (and applied
+# again by the next snapshot read), in case an older transaction is still
+# committing; keep it above the longest write transaction
+SYNC_SETTLE_SECONDS = 5
+
+# seconds before a worker rebuilds a user's related recipes index from scratch
+RECIPE_SIMILARITY_MAX_AGE = 10 * 60
+# seconds before a worker rebuilds a user's tag/ingredient autocomplete index
+# even though the change log shows no newer write
+RECIPE_AUTOCOMPLETE_MAX_AGE = 10 * 60
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.UserTokenBucketThrottle',
+        'core.throttling.IPTokenBucketThrottle',
+    ],
+    # per view `throttle_scope` and per worker process (see THROTTLE_CACHE); the
+    # `_ip` rates apply per client address
+    'DEFAULT_THROTTLE_RATES': {
+        'recipe': '300/min',
+        'recipe_ip': '1200/min',
+        'recipe_attr': '300/min',
+        'recipe_attr_ip': '1200/min',
+        'user': '60/min',
+        'user_ip': '300/min',
+        'login': '20/min',
+        'login_ip': '100/min',
+    },
 }
 
 SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST': True,
 }
+
+# where manage.py dispatch_outbox delivers change events (see recipe.outbox), e.g.
+# {'search': {'BACKEND': 'recipe.outbox.WebhookSink', 'OPTIONS': {'url': '...'}}}
+OUTBOX_SINKS = {}
+OUTBOX_BATCH_SIZE = 500
+# events younger than this are left for the next pass, in case an older
+# transaction is still committing; keep it above the longest write transaction
+OUTBOX_SETTLE_SECONDS = 5
+
+# background jobs, see core.jobs and manage.py run_worker
+JOB_CONCURRENCY = 4
+JOB_POOL = 'thread'
+JOB_POLL_INTERVAL = 1.0
+JOB_MAX_ATTEMPTS = 5
+# seconds before the first retry of a failed job, doubling with each attempt
+JOB_RETRY_BACKOFF = 10
+# a job running longer than this is assumed lost with its worker and queued again
+JOB_TIMEOUT = 15 * 60
+
+# rows per transaction when user.deletion deletes an account in the background
+ACCOUNT_DELETE_BATCH_SIZE = 1000
+
+# admin changelists of tables estimated above this many rows show the
+# PostgreSQL planner estimate instead of running COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# response compression, see core.middleware. encodings in order of preference;
+# br and zstd are used only when the brotli / zstandard packages are installed
+COMPRESSION_ENCODINGS = ['br', 'zstd', 'gzip']
+COMPRESSION_LEVELS = {'br': 4, 'zstd': 3, 'gzip': 6}
+COMPRESSION_MIN_SIZE = 1024
+# compressed bodies at least this large are cached by content digest
+COMPRESSION_CACHE = 'default'
+COMPRESSION_CACHE_MIN_SIZE = 16 * 1024
+COMPRESSION_CACHE_TIMEOUT = 60 * 60
+
+# where manage.py build_schema writes openapi-<code version>.json
+SCHEMA_ARTEFACT_DIR = os.environ.get('SCHEMA_ARTEFACT_DIR', BASE_DIR / '.schema')
+# identifies the deployed code (e.g. a git sha); hashed from the sources when unset
+CODE_VERSION = os.environ.get('CODE_VERSION')
+
+# warm URLs, serializers and the database connection in each worker before it
+# serves traffic (see app.startup). this connects, so don't combine it with a
+# server that loads the app before forking (e.g. gunicorn --preload)
+PRELOAD = os.environ.get('DJANGO_PRELOAD') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {'app.startup': {'handlers': ['console'], 'level': 'INFO'}},
+}
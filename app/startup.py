@@ -0,0 +1,78 @@
+'''
+worker startup timing and preload
+
+with PRELOAD on (DJANGO_PRELOAD=1), app.wsgi/app.asgi call warmup() before
+handing the application to the server, so the first requests don't pay for
+importing every view and serializer, populating the URL resolver, building
+serializer fields or connecting to the database. either way the time from
+interpreter start to ready is logged, and `manage.py startup_report` breaks
+it down per imported module.
+'''
+import logging
+import time
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver, URLPattern, URLResolver
+
+logger = logging.getLogger(__name__)
+
+
+def _callbacks(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _callbacks(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern):
+            yield pattern.callback
+
+
+def warm_urls():
+    '''import every view module and build the reverse lookup tables'''
+    resolver = get_resolver()
+    resolver.reverse_dict  # populates the resolver and all included URLconfs
+    return list(_callbacks(resolver.url_patterns))
+
+
+def warm_serializers(callbacks):
+    '''build the fields of every view's serializer, importing field mappings and validators'''
+    serializer_classes = set()
+    for callback in callbacks:
+        view = getattr(callback, 'cls', None)
+        serializer_class = getattr(view, 'serializer_class', None)
+        if serializer_class is not None:
+            serializer_classes.add(serializer_class)
+    for serializer_class in serializer_classes:
+        serializer_class(context={}).fields
+    return len(serializer_classes)
+
+
+def warm_database():
+    '''open this worker's connections, so the first request doesn't wait for the handshake'''
+    for alias in settings.DATABASES:
+        connections[alias].ensure_connection()
+
+
+def warmup():
+    '''preload everything the first request would otherwise load; returns timings in ms'''
+    timings = {}
+    start = time.perf_counter()
+    callbacks = warm_urls()
+    timings['urls'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    warm_serializers(callbacks)
+    timings['serializers'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    warm_database()
+    timings['database'] = (time.perf_counter() - start) * 1000
+    return timings
+
+
+def ready(started, application_loaded):
+    '''run the preload if enabled and log how long startup took'''
+    timings = {'setup': (application_loaded - started) * 1000}
+    if settings.PRELOAD:
+        timings.update(warmup())
+    total = (time.perf_counter() - started) * 1000
+    logger.info('worker ready in %.0fms (%s)', total, ', '.join(f'{k} {v:.0f}ms' for k, v in timings.items()))
+    return total, timings
@@ -16,16 +16,29 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
+from django.utils.functional import cached_property
 from django.conf import settings
-from django.conf.urls.static import static
+from core.views import api_docs, serve_media, serve_schema
+
+
+class LazyURLConf:
+    '''urlconf whose patterns are built when a URL under it is first resolved or reversed'''
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    @cached_property
+    def urlpatterns(self):
+        return self.factory()
+
 
 urlpatterns = [
-    path("admin/", admin.site.urls),
-    path('api/schema/', SpectacularAPIView.as_view(), name='api_schema'),
-    path('api/docs/', SpectacularSwaggerView.as_view(url_name='api_schema'), name='api_docs'),
+    # (urlconf, app_name, namespace) like admin.site.urls, without building every admin view up front
+    path("admin/", (LazyURLConf(lambda: admin.site.urls[0]), "admin", admin.site.name)),
+    # prebuilt per code version, see core.schema
+    path('api/schema/', serve_schema, name='api_schema'),
+    path('api/docs/', api_docs, name='api_docs'),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
-
-
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path(f'{settings.MEDIA_URL.lstrip("/")}<path:path>', serve_media, name='media'),
+]
@@ -0,0 +1,137 @@
+'''
+compare WSGI vs ASGI throughput for the recipe list under simulated latency
+
+every request waits `--latency` seconds inside its view (a slow upstream call,
+say) before building the list, so the wait holds whatever runs the view. three
+setups serve the same number of concurrent clients:
+
+- WSGI: the sync viewset on a pool of worker threads, one per client
+- ASGI, sync view: the same viewset under the ASGI handler, which runs sync
+  views on its thread, the control for the handler's own overhead
+- ASGI, async view: the async views on the event loop
+
+usage: python benchmarks/bench_async.py [--requests 200] [--latency 0.05] [--concurrency 16]
+'''
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from functools import wraps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import AsyncClient, Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import path  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+from core.models import User, Recipe, Tag, Ingredient  # noqa: E402
+from recipe.async_views import recipe_list  # noqa: E402
+from recipe.views import RecipeViewSet  # noqa: E402
+
+LATENCY = 0.05
+
+
+def slow(view):
+    '''wait LATENCY seconds in the view, blocking its thread'''
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        time.sleep(LATENCY)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def aslow(view):
+    '''wait LATENCY seconds in the view, yielding the event loop'''
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        await asyncio.sleep(LATENCY)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+# this module is the URLconf while benchmarking
+urlpatterns = [
+    path('sync/', slow(RecipeViewSet.as_view({'get': 'list'}))),
+    path('async/', aslow(recipe_list)),
+]
+
+
+def seed(recipes):
+    '''create a user with some recipes and return its token'''
+    user = User.objects.create_user(email='bench@example.com', name='bench', password='benchpass123')
+    tags = [Tag.objects.create(user=user, name=f'tag{i}') for i in range(5)]
+    ingredients = [Ingredient.objects.create(user=user, name=f'ingredient{i}') for i in range(10)]
+    for i in range(recipes):
+        recipe = Recipe.objects.create(user=user, title=f'recipe {i}', time_minutes=i, price=Decimal('5.50'))
+        recipe.tags.add(*tags[:i % 5 + 1])
+        recipe.ingredients.add(*ingredients[:i % 10 + 1])
+    return Token.objects.create(user=user).key
+
+
+def bench_wsgi(url, headers, requests, concurrency):
+    def one(_):
+        res = Client().get(url, headers=headers)
+        assert res.status_code == 200, res.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    return time.perf_counter() - start
+
+
+def bench_asgi(url, headers, requests, concurrency):
+    async def one(client, semaphore):
+        async with semaphore:
+            res = await client.get(url, headers=headers)
+            assert res.status_code == 200, res.status_code
+
+    async def run():
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(one(client, semaphore) for _ in range(requests)))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    return time.perf_counter() - start
+
+
+def main():
+    global LATENCY
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=LATENCY, help='seconds each view waits')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients, and WSGI threads')
+    parser.add_argument('--recipes', type=int, default=20)
+    args = parser.parse_args()
+    LATENCY = args.latency
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    headers = {'Authorization': f'Token {seed(args.recipes)}'}
+
+    # measure serving, not the request throttle
+    rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}
+    with override_settings(ROOT_URLCONF=__name__, REST_FRAMEWORK=rest_framework):
+        results = [
+            ('WSGI, sync view', bench_wsgi('/sync/', headers, args.requests, args.concurrency)),
+            ('ASGI, sync view', bench_asgi('/sync/', headers, args.requests, args.concurrency)),
+            ('ASGI, async view', bench_asgi('/async/', headers, args.requests, args.concurrency)),
+        ]
+
+    print(f'{args.requests} requests, {args.concurrency} concurrent, {args.latency * 1000:.0f}ms in each view')
+    for name, elapsed in results:
+        print(f'{name:>16}: {elapsed:.2f}s, {args.requests / elapsed:.1f} req/s')
+
+
+if __name__ == '__main__':
+    main()
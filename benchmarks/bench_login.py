@@ -0,0 +1,79 @@
+'''
+measure login throughput per core for each configured password hasher
+
+logins run sequentially in one thread through POST /api/user/token/, so the
+result is logins per second for a single core.
+
+usage: python benchmarks/bench_login.py [--logins 50]
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import cache, caches  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from core.models import User  # noqa: E402
+
+HASHERS = {
+    'pbkdf2_sha256': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'scrypt (tuned)': 'core.hashers.TunedScryptPasswordHasher',
+}
+
+
+def bench(hasher, logins):
+    User.objects.all().delete()
+    # measure hashing cost, not the request throttle
+    rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}
+    with override_settings(PASSWORD_HASHERS=[hasher], REST_FRAMEWORK=rest_framework):
+        User.objects.create_user(email='bench@example.com', name='bench', password='benchpass123')
+        client = Client()
+        payload = {'email': 'bench@example.com', 'password': 'benchpass123'}
+        start = time.perf_counter()
+        for _ in range(logins):
+            res = client.post(reverse('user:token'), payload)
+            assert res.status_code == 200, res.status_code
+        return time.perf_counter() - start
+
+
+def bench_throttled(logins):
+    '''failed logins once the per-email limit is hit never reach the hasher'''
+    cache.clear()
+    caches['throttle'].clear()
+    client = Client()
+    payload = {'email': 'bench@example.com', 'password': 'wrongpass'}
+    start = time.perf_counter()
+    for _ in range(logins):
+        client.post(reverse('user:token'), payload)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+    for name, hasher in HASHERS.items():
+        elapsed = bench(hasher, args.logins)
+        print(f'{name:>16}: {args.logins / elapsed:8.1f} logins/s/core ({elapsed / args.logins * 1000:.1f}ms each)')
+
+    elapsed = bench_throttled(args.logins)
+    print(f'{"failed+throttled":>16}: {args.logins / elapsed:8.1f} attempts/s/core')
+
+
+if __name__ == '__main__':
+    main()
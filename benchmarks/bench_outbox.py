@@ -0,0 +1,86 @@
+'''
+measure the cost of the recipe outbox on writes and the dispatcher's throughput
+
+first times recipe creates through the API with the outbox insert and without
+it (recipe.outbox.publish replaced by a no-op), then fills the outbox and
+times dispatching it to a file sink at a few batch sizes.
+
+usage: python benchmarks/bench_outbox.py [--writes 300] [--events 20000] [--batch-sizes 100,500,2000]
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment, override_settings  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+from core.models import User, OutboxEvent, OutboxCursor  # noqa: E402
+from recipe import outbox  # noqa: E402
+
+
+def bench_writes(headers, writes):
+    client = Client()
+    url = reverse('recipe:recipe-list')
+    payload = {'title': 'recipe', 'time_minutes': 5, 'price': '5.50', 'tags': [{'name': 'quick'}]}
+    start = time.perf_counter()
+    for _ in range(writes):
+        res = client.post(url, payload, content_type='application/json', headers=headers)
+        assert res.status_code == 201, res.status_code
+    return time.perf_counter() - start
+
+
+def bench_dispatch(user_id, events, batch_size, directory):
+    OutboxEvent.objects.all().delete()
+    OutboxCursor.objects.all().delete()
+    OutboxEvent.objects.bulk_create(
+        [OutboxEvent(entity_type='recipe', entity_id=i, user_id=user_id) for i in range(events)],
+        batch_size=1000,
+    )
+    sink = outbox.FileSink('bench', os.path.join(directory, f'events-{batch_size}.jsonl'))
+    start = time.perf_counter()
+    while outbox.dispatch(sink, batch_size):
+        pass
+    sink.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writes', type=int, default=300)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--batch-sizes', default='100,500,2000')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    user = User.objects.create_user(email='bench@example.com', name='bench', password='benchpass123')
+    headers = {'Authorization': f'Token {Token.objects.create(user=user).key}'}
+
+    with_outbox = bench_writes(headers, args.writes)
+    with patch('recipe.outbox.publish'):
+        without_outbox = bench_writes(headers, args.writes)
+    print(f'{args.writes} recipe creates')
+    print(f'with outbox: {with_outbox / args.writes * 1000:.2f}ms per write')
+    print(f'without outbox: {without_outbox / args.writes * 1000:.2f}ms per write')
+
+    print(f'dispatching {args.events} events to a file sink')
+    with tempfile.TemporaryDirectory() as directory, override_settings(OUTBOX_SETTLE_SECONDS=0):
+        for batch_size in (int(size) for size in args.batch_sizes.split(',')):
+            elapsed = bench_dispatch(user.id, args.events, batch_size, directory)
+            print(f'batch size {batch_size}: {elapsed:.2f}s, {args.events / elapsed:.0f} events/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,94 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
-from .models import User, Recipe, Tag, Ingredient
+from django.contrib.admin.widgets import AutocompleteSelect, AutocompleteSelectMultiple
+from django.core.paginator import Paginator
+from django.db import connections
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .models import User, Recipe, Tag, Ingredient, RecipeIngredient, normalize_name
 from django.contrib.auth.models import Group
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from recipe.signals import entities_changed, names_changed
+from user.deletion import request_deletion
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    on PostgreSQL, count unfiltered changelists of large tables from the
+    planner statistics instead of a full COUNT(*) scan
+    '''
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql" and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            # -1 until the table was first analyzed, and small tables are counted exactly
+            if row and row[0] >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    '''changelist settings for tables too large to count or scan'''
+    paginator = EstimatedCountPaginator
+    # skips the second, unfiltered COUNT(*) next to the search results
+    show_full_result_count = False
+
+
+class UserScopedMixin:
+    '''autocomplete that only offers the rows of user_id, when set (see NameAdmin.get_search_results)'''
+    user_id = None
+
+    def get_url(self):
+        url = super().get_url()
+        return f"{url}?user={self.user_id}" if self.user_id else url
+
+
+class UserScopedSelect(UserScopedMixin, AutocompleteSelect):
+    pass
+
+
+class UserScopedSelectMultiple(UserScopedMixin, AutocompleteSelectMultiple):
+    pass
+
+
+def scope_to_user(field, user_id):
+    '''restrict a tag/ingredient form field to the rows of user_id'''
+    field.queryset = field.queryset.filter(user_id=user_id)
+    # admin wraps the widget to add the "+" link
+    getattr(field.widget, "widget", field.widget).user_id = user_id
+
+
+class NameAdmin(LargeTableAdmin):
+    '''tags/ingredients: searched by normalized name prefix, which the (user, normalized_name) index serves'''
+    list_display = ["name", "user"]
+    list_select_related = ["user"]
+    ordering = ["user", "normalized_name"]
+    search_fields = ["normalized_name"]
+    search_help_text = "Names starting with the search term"
+    autocomplete_fields = ["user"]
+
+    def get_search_results(self, request, queryset, search_term):
+        # set by UserScopedAutocomplete on a recipe's form
+        user_id = request.GET.get("user", "")
+        if user_id.isdigit():
+            queryset = queryset.filter(user_id=user_id)
+        if search_term.strip():
+            queryset = queryset.filter(normalized_name__startswith=normalize_name(search_term))
+        return queryset, False
 
 
 class UserAdmin(BaseUserAdmin):
-    list_display = ["email", "name", "is_superuser"]
+    list_display = ["email", "name", "is_superuser", "recipes"]
     list_filter = ["is_superuser"]
     fieldsets = [
         (None, {"fields": ["email", "password"]}),
@@ -26,10 +109,126 @@ class UserAdmin(BaseUserAdmin):
     search_fields = ["email"]
     ordering = ["email"]
     filter_horizontal = []
+    actions = ["delete_accounts"]
+
+    @admin.display(description="Recipes")
+    def recipes(self, obj):
+        # filters on the leading column of the recipe indexes
+        url = reverse("admin:core_recipe_changelist")
+        return format_html('<a href="{}?user={}">View</a>', url, obj.pk)
+
+    def get_actions(self, request):
+        # the collector behind delete_selected loads every row of the accounts
+        actions = super().get_actions(request)
+        actions.pop("delete_selected", None)
+        return actions
+
+    @admin.action(description="Delete selected accounts in the background", permissions=["delete"])
+    def delete_accounts(self, request, queryset):
+        users = list(queryset)
+        for user in users:
+            request_deletion(user)
+        self.message_user(request, f"Deactivated {len(users)} accounts, their data is being deleted.")
+
+
+class RecipeUserFilter(admin.SimpleListFilter):
+    '''a user's recipes, linked from the user list rather than offering every user as a choice'''
+    title = "user"
+    parameter_name = "user"
+
+    def lookups(self, request, model_admin):
+        value = self.value()
+        if value and value.isdigit():
+            return [(value, str(User.objects.filter(pk=value).first() or value))]
+        return []
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value and value.isdigit():
+            return queryset.filter(user_id=value)
+        return queryset
+
+
+class HasImageFilter(admin.SimpleListFilter):
+    title = "image"
+    parameter_name = "has_image"
+
+    def lookups(self, request, model_admin):
+        return [("1", "With image"), ("0", "Without image")]
+
+    def queryset(self, request, queryset):
+        # Recipe.image is indexed
+        if self.value() == "1":
+            return queryset.exclude(image=None).exclude(image="")
+        if self.value() == "0":
+            return queryset.filter(image=None) | queryset.filter(image="")
+        return queryset
+
+
+class RecipeAdminForm(forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # null in the database, but not marked blank
+        self.fields["image"].required = False
+        # only the recipe owner's tags can be picked, and are offered
+        if self.instance.user_id is not None:
+            scope_to_user(self.fields["tags"], self.instance.user_id)
+
+
+class RecipeIngredientInline(admin.TabularInline):
+    '''ingredients have a custom through model, which the admin edits as an inline'''
+    model = RecipeIngredient
+    extra = 0
+    autocomplete_fields = ["ingredient"]
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == "ingredient":
+            kwargs["widget"] = UserScopedSelect(db_field, self.admin_site, using=kwargs.get("using"))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        # a new form class per call, so the scope doesn't leak between requests
+        if obj is not None:
+            scope_to_user(formset.form.base_fields["ingredient"], obj.user_id)
+        return formset
+
+
+class RecipeAdmin(LargeTableAdmin):
+    form = RecipeAdminForm
+    list_display = ["title", "user", "time_minutes", "price", "tag_count", "ingredient_count"]
+    list_select_related = ["user"]
+    list_filter = [RecipeUserFilter, HasImageFilter]
+    # the primary key, so the newest rows come from an index walk
+    ordering = ["-id"]
+    search_fields = ["=user__email"]
+    search_help_text = "Recipe id or exact owner email"
+    autocomplete_fields = ["user", "tags"]
+    inlines = [RecipeIngredientInline]
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if db_field.name == "tags":
+            kwargs["widget"] = UserScopedSelectMultiple(db_field, self.admin_site, using=kwargs.get("using"))
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # inline edits of the through model send no m2m_changed
+        recipe = form.instance
+        Recipe.objects.refresh_summaries([recipe.pk])
+        # the admin saves whole rows, so move API clients off the version they read
+        Recipe.objects.bump_versions([recipe.pk])
+        entities_changed(Recipe, recipe.user_id, [recipe.pk])
+        names_changed(Ingredient, recipe.user_id)
 
-class RecipeAdmin(admin.ModelAdmin):
-    list_display = ['title', 'user']
+    def get_search_results(self, request, queryset, search_term):
+        # exact lookups only: the primary key, or the unique email index
+        term = search_term.strip()
+        if term.isdigit():
+            return queryset.filter(pk=term), False
+        if term:
+            return queryset.filter(user__email=term), False
+        return queryset, False
 
 
 # Now register the new UserAdmin...
@@ -38,5 +237,5 @@ admin.site.register(User, UserAdmin)
 # unregister the Group model from admin.
 admin.site.unregister(Group)
 admin.site.register(Recipe, RecipeAdmin)
-admin.site.register(Tag)
-admin.site.register(Ingredient)
+admin.site.register(Tag, NameAdmin)
+admin.site.register(Ingredient, NameAdmin)
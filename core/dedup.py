@@ -0,0 +1,122 @@
+'''
+merge tags/ingredients whose names only differ by case or whitespace
+
+rows sharing (user, normalized_name) are folded into the one with the lowest
+id: the recipe through rows of the duplicates are pointed at the kept row
+(skipping recipes that already have it), the duplicates are deleted and the
+summary columns of the touched recipes refreshed. work is done a batch of
+duplicate groups at a time, walking the groups in (user, normalized_name)
+order, so memory use and transaction size stay bounded however large the
+tables are.
+
+the functions take the models as arguments, so the schema migration adding
+the unique constraint can run them on its historical models.
+'''
+from django.db import transaction
+from django.db.models import Count, Min, Q
+
+# recipe many to many field for each mergeable model
+RELATIONS = {'tag': 'tags', 'ingredient': 'ingredients'}
+
+
+def duplicate_groups(model, batch_size=1000):
+    '''yield lists of up to batch_size (user_id, normalized_name, keep_id) with more than one row'''
+    last = None
+    while True:
+        rows = model.objects.all()
+        if last is not None:
+            user_id, name = last
+            rows = rows.filter(Q(user_id__gt=user_id) | Q(user_id=user_id, normalized_name__gt=name))
+        groups = list(
+            rows.values('user_id', 'normalized_name')
+            .annotate(keep_id=Min('id'), copies=Count('id'))
+            .filter(copies__gt=1)
+            .order_by('user_id', 'normalized_name')
+            .values_list('user_id', 'normalized_name', 'keep_id')[:batch_size]
+        )
+        if not groups:
+            return
+        yield groups
+        last = groups[-1][:2]
+
+
+def merge_groups(model, recipe_model, groups, batch_size=1000):
+    '''
+    merge each (user_id, normalized_name, keep_id) group into keep_id
+    return (number of rows merged away, {user_id: set of touched recipe ids})
+    '''
+    keep = {(user_id, name): keep_id for user_id, name, keep_id in groups}
+    candidates = model.objects.filter(
+        user_id__in={user_id for user_id, name in keep},
+        normalized_name__in={name for user_id, name in keep},
+    ).values_list('id', 'user_id', 'normalized_name')
+    # duplicate id -> (kept id, user id)
+    remap = {}
+    for pk, user_id, name in candidates:
+        keep_id = keep.get((user_id, name))
+        if keep_id is not None and pk != keep_id:
+            remap[pk] = (keep_id, user_id)
+
+    touched = repoint(model, recipe_model, remap, batch_size)
+    duplicate_ids = sorted(remap)
+    for start in range(0, len(duplicate_ids), batch_size):
+        model.objects.filter(id__in=duplicate_ids[start:start + batch_size]).delete()
+    return len(remap), touched
+
+
+def repoint(model, recipe_model, remap, batch_size=1000):
+    '''
+    point the recipe links of every row in remap {id: (kept id, user id)} at
+    the kept row, batch_size links per step, skipping recipes that already
+    have it. return {user_id: set of touched recipe ids}
+    '''
+    field = model._meta.model_name
+    through = getattr(recipe_model, RELATIONS[field]).through
+    column = f'{field}_id'
+    # e.g. the quantity and unit of a recipe ingredient move along with the link
+    extra = [f.attname for f in through._meta.concrete_fields if not f.primary_key and f.attname not in ('recipe_id', column)]
+    touched = {}
+    last = 0
+    while True:
+        # moved links are deleted, so paging by id never sees one twice
+        links = list(
+            through.objects.filter(**{f'{column}__in': list(remap)}, id__gt=last)
+            .order_by('id').values('id', 'recipe_id', column, *extra)[:batch_size]
+        )
+        if not links:
+            return touched
+        last = links[-1]['id']
+        wanted = {}
+        for link in links:
+            wanted.setdefault((link['recipe_id'], remap[link[column]][0]), {name: link[name] for name in extra})
+        # where the recipe already has the kept row, its link wins
+        existing = set(through.objects.filter(
+            recipe_id__in={recipe_id for recipe_id, keep_id in wanted},
+            **{f'{column}__in': {keep_id for recipe_id, keep_id in wanted}},
+        ).values_list('recipe_id', column))
+        through.objects.bulk_create(
+            [through(recipe_id=recipe_id, **{column: keep_id}, **values)
+             for (recipe_id, keep_id), values in wanted.items() if (recipe_id, keep_id) not in existing],
+            batch_size=batch_size,
+        )
+        through.objects.filter(id__in=[link['id'] for link in links]).delete()
+
+        for link in links:
+            touched.setdefault(remap[link[column]][1], set()).add(link['recipe_id'])
+        recipe_model.objects.refresh_summaries([link['recipe_id'] for link in links], batch_size)
+
+
+def merge_duplicates(model, recipe_model, batch_size=1000, on_batch=None):
+    '''
+    merge every duplicate group of model, one transaction per batch of groups
+    on_batch(touched) is called inside each transaction with {user_id: recipe ids}
+    return the number of rows merged away
+    '''
+    merged = 0
+    for groups in duplicate_groups(model, batch_size):
+        with transaction.atomic():
+            count, touched = merge_groups(model, recipe_model, groups, batch_size)
+            if on_batch is not None:
+                on_batch(touched)
+        merged += count
+    return merged
@@ -0,0 +1,46 @@
+'''
+password hashers with cost parameters taken from settings
+
+stored hashes keep the standard algorithm prefix, so changing a parameter (or
+moving another hasher to the front of PASSWORD_HASHERS) makes Django rehash the
+password transparently on the user's next successful login
+'''
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, ScryptPasswordHasher
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    '''scrypt with n/r/p from PASSWORD_SCRYPT_* settings'''
+
+    @property
+    def work_factor(self):
+        return getattr(settings, 'PASSWORD_SCRYPT_WORK_FACTOR', 2**14)
+
+    @property
+    def block_size(self):
+        return getattr(settings, 'PASSWORD_SCRYPT_BLOCK_SIZE', 8)
+
+    @property
+    def parallelism(self):
+        return getattr(settings, 'PASSWORD_SCRYPT_PARALLELISM', 1)
+
+    @property
+    def maxmem(self):
+        # scrypt needs 128 * n * r bytes; leave headroom above OpenSSL's 32MB default
+        return max(256 * self.work_factor * self.block_size, 32 * 1024 * 1024)
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    '''argon2id with costs from PASSWORD_ARGON2_* settings, requires argon2-cffi'''
+
+    @property
+    def time_cost(self):
+        return getattr(settings, 'PASSWORD_ARGON2_TIME_COST', 2)
+
+    @property
+    def memory_cost(self):
+        return getattr(settings, 'PASSWORD_ARGON2_MEMORY_COST', 102400)
+
+    @property
+    def parallelism(self):
+        return getattr(settings, 'PASSWORD_ARGON2_PARALLELISM', 8)
@@ -0,0 +1,174 @@
+'''
+database backed job queue
+
+enqueue() stores a call to a module level function as a core.Job row in the
+caller's transaction, so a job only becomes visible to workers once the write
+it belongs to commits, and disappears with it on rollback. `manage.py
+run_worker` claims due jobs and runs them on a thread or process pool.
+
+on PostgreSQL claiming is a SELECT ... FOR UPDATE SKIP LOCKED of due jobs
+followed by an UPDATE of them, so concurrent workers pick disjoint jobs
+instead of contending for the same rows. SQLite serializes writers, and
+upgrading a read transaction to a write one fails at once while another
+connection writes, so there it is a single UPDATE of the due jobs selected in
+a subquery.
+
+a failing job is retried after JOB_RETRY_BACKOFF seconds, doubling with each
+attempt, until max_attempts. a job left running longer than JOB_TIMEOUT (its
+worker died) is queued again, so jobs run at least once and should be safe
+to repeat; that counts as an attempt too, so a job that keeps killing its
+worker or outliving JOB_TIMEOUT ends up failed.
+'''
+import logging
+import multiprocessing
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Avg, Count, F, Max, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF = 60 * 60
+
+_current = threading.local()
+# connections a forked pool process inherited, kept so they are never finalized
+_inherited = []
+
+
+def _task_name(func):
+    if isinstance(func, str):
+        return func
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, *args, key='', delay=0, max_attempts=None, **kwargs):
+    '''
+    queue func(*args, **kwargs), arguments must be JSON serializable. with a
+    key, nothing is added while a job with that key is still queued
+    '''
+    if key and Job.objects.filter(key=key, status=Job.QUEUED).exists():
+        return None
+    return Job.objects.create(
+        name=_task_name(func), args=list(args), kwargs=kwargs, key=key,
+        run_after=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+
+
+def requeue_stale():
+    '''queue again the jobs whose worker stopped while running them, returning how many'''
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, started_at__lt=now - timedelta(seconds=settings.JOB_TIMEOUT))
+    # clearing claimed_by also keeps a worker still running one from recording an outcome
+    given_up = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, claimed_by='', finished_at=now,
+        last_error=f'still running after JOB_TIMEOUT ({settings.JOB_TIMEOUT}s), its worker likely died')
+    if given_up:
+        logger.warning('%s stale jobs out of attempts marked failed', given_up)
+    return stale.update(status=Job.QUEUED, claimed_by='', run_after=now)
+
+
+def claim(worker, limit):
+    '''take up to limit due jobs for worker, returning their ids'''
+    token = f'{worker}:{uuid.uuid4().hex[:8]}'
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).order_by('run_after', 'id')
+    changes = {'status': Job.RUNNING, 'claimed_by': token, 'started_at': now, 'attempts': F('attempts') + 1}
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            if not ids:
+                return []
+            Job.objects.filter(id__in=ids).update(**changes)
+    elif not Job.objects.filter(id__in=due.values('id')[:limit], status=Job.QUEUED).update(**changes):
+        return []
+    return list(Job.objects.filter(claimed_by=token).values_list('id', flat=True))
+
+
+def run_job(job_id):
+    '''run a claimed job and record the outcome, returning (name, status, seconds)'''
+    job = Job.objects.get(id=job_id)
+    start = time.perf_counter()
+    _current.job = job
+    try:
+        import_string(job.name)(*job.args, **job.kwargs)
+    except Exception:
+        return _failed(job, time.perf_counter() - start, traceback.format_exc())
+    finally:
+        _current.job = None
+    duration = time.perf_counter() - start
+    Job.objects.filter(id=job.id, claimed_by=job.claimed_by).update(
+        status=Job.DONE, finished_at=timezone.now(), duration=duration, last_error='')
+    logger.info('job %s %s done in %.1fms', job.id, job.name, duration * 1000)
+    return job.name, Job.DONE, duration
+
+
+def set_progress(**progress):
+    '''record how far the running job got, a no-op when not called from a job'''
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        job.progress = progress
+        Job.objects.filter(id=job.id).update(progress=progress)
+
+
+def run_pooled(job_id):
+    '''run_job on a pool thread or process, which each hold their own connection'''
+    try:
+        return run_job(job_id)
+    finally:
+        connection.close()
+
+
+def _forget_connections():
+    # closing an inherited connection would end the parent's session on the
+    # socket both processes share, so only drop it and open a new one
+    for conn in connections.all(initialized_only=True):
+        if conn.connection is not None:
+            _inherited.append(conn.connection)
+            conn.connection = None
+
+
+def process_pool(max_workers):
+    '''
+    a pool of forked processes for run_pooled. they are forked on the first
+    submit, when the parent holds open connections again after claiming, so
+    each process starts by dropping the connections it inherited
+    '''
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context('fork'), initializer=_forget_connections)
+
+
+def _failed(job, duration, error):
+    if job.attempts < job.max_attempts:
+        backoff = min(settings.JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1), MAX_BACKOFF)
+        changes = {'status': Job.QUEUED, 'run_after': timezone.now() + timedelta(seconds=backoff)}
+    else:
+        changes = {'status': Job.FAILED, 'finished_at': timezone.now()}
+    # only if this worker still owns the job, it may have been requeued as stale
+    Job.objects.filter(id=job.id, claimed_by=job.claimed_by).update(
+        duration=duration, last_error=error, **changes)
+    logger.warning('job %s %s failed (attempt %s of %s)', job.id, job.name, job.attempts, job.max_attempts)
+    return job.name, changes['status'], duration
+
+
+def metrics(since=None):
+    '''per task counts and durations of finished attempts: {name: {...}}'''
+    jobs = Job.objects.exclude(duration=None)
+    if since is not None:
+        jobs = jobs.filter(started_at__gte=since)
+    rows = jobs.values('name').annotate(
+        done=Count('id', filter=Q(status=Job.DONE)),
+        failed=Count('id', filter=Q(status=Job.FAILED)),
+        retrying=Count('id', filter=Q(status=Job.QUEUED)),
+        avg_duration=Avg('duration'),
+        max_duration=Max('duration'),
+    ).order_by('name')
+    return {row.pop('name'): row for row in rows}
@@ -0,0 +1,29 @@
+'''
+django command to backfill the denormalized recipe summary columns
+'''
+
+from django.core.management.base import BaseCommand
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    '''recompute tag/ingredient counts and id lists for all recipes'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+        while True:
+            # keyset over the primary key, so each batch is an index range scan
+            ids = list(Recipe.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            Recipe.objects.refresh_summaries(ids)
+            last_id = ids[-1]
+            total += len(ids)
+            self.stdout.write(f'{total} recipes updated...')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {total} recipes'))
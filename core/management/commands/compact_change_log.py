@@ -0,0 +1,17 @@
+'''
+django command to delete change log entries that later entries supersede
+'''
+from django.core.management.base import BaseCommand
+from recipe import sync
+
+
+class Command(BaseCommand):
+    '''compact the change log read by delta sync, the snapshots and the similarity index'''
+    help = 'Delete change log entries of entities that have a later settled entry'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = sync.compact(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} superseded change log entries'))
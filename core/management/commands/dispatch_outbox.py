@@ -0,0 +1,62 @@
+'''
+django command to deliver outbox events to the configured sinks
+'''
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from recipe import outbox
+
+
+class Command(BaseCommand):
+    '''deliver recipe change events, at least once, in id order'''
+    help = 'Deliver outbox events to the sinks in OUTBOX_SINKS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sink', action='append', dest='sinks', help='only this sink (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='seconds to wait when idle, and after a failed delivery')
+        parser.add_argument('--once', action='store_true', help='make one pass and exit')
+        parser.add_argument('--prune', action='store_true',
+                            help='delete events all configured sinks have received')
+
+    def handle(self, *args, **options):
+        sinks = outbox.load_sinks(options['sinks'])
+        if not sinks:
+            raise CommandError('No sinks to deliver to, configure OUTBOX_SINKS')
+        try:
+            while True:
+                delivered, failed = self._pass(sinks, options['batch_size'])
+                if delivered:
+                    self.stdout.write(f'delivered {delivered} events')
+                if options['prune'] and not failed:
+                    pruned = outbox.prune(list(settings.OUTBOX_SINKS), options['batch_size'])
+                    if pruned:
+                        self.stdout.write(f'pruned {pruned} events')
+                if options['once']:
+                    if failed:
+                        raise CommandError('Delivery failed, the events will be retried')
+                    return
+                if not delivered or failed:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for sink in sinks.values():
+                sink.close()
+
+    def _pass(self, sinks, batch_size):
+        '''deliver to every sink until it is caught up or fails'''
+        delivered, failed = 0, False
+        for sink in sinks.values():
+            try:
+                while True:
+                    count = outbox.dispatch(sink, batch_size)
+                    delivered += count
+                    if count < batch_size:
+                        break
+            except Exception as exc:
+                # the mark didn't move, the batch is retried on the next pass
+                self.stderr.write(f'{sink.name}: delivery failed: {exc!r}')
+                failed = True
+        return delivered, failed
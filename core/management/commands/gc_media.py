@@ -0,0 +1,111 @@
+'''
+django command to delete media files that no recipe references
+'''
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.models import Recipe
+
+
+def scan_files(directory):
+    '''yield DirEntry for every file below directory, without listing whole directories'''
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+class Command(BaseCommand):
+    '''garbage collect orphaned recipe images'''
+    help = 'Delete files under MEDIA_ROOT/<directory> that no Recipe.image references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report what would be deleted')
+        parser.add_argument('--min-age', type=int, default=settings.MEDIA_RELEASE_GRACE_SECONDS,
+                            help='skip files modified in the last N seconds (uploads in flight)')
+        parser.add_argument('--workers', type=int, default=4, help='parallel deletions')
+        parser.add_argument('--directory', default='recipe', help='directory below MEDIA_ROOT to collect')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        root = os.path.join(settings.MEDIA_ROOT, options['directory'])
+        if not os.path.isdir(root):
+            self.stdout.write(f'{root} does not exist, nothing to do')
+            return
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # the referenced names live in an on-disk set, so memory use doesn't
+            # grow with the number of recipes or files
+            refs = sqlite3.connect(os.path.join(tmp, 'refs.sqlite3'))
+            refs.execute('CREATE TABLE refs (name TEXT PRIMARY KEY) WITHOUT ROWID')
+            self._load_references(refs)
+
+            stats = {'scanned': 0, 'referenced': 0, 'too_new': 0, 'deleted': 0, 'bytes': 0}
+            cutoff = time.time() - options['min_age']
+            batch = []
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                for entry in scan_files(root):
+                    stats['scanned'] += 1
+                    name = os.path.relpath(entry.path, settings.MEDIA_ROOT).replace(os.sep, '/')
+                    if refs.execute('SELECT 1 FROM refs WHERE name = ?', (name,)).fetchone():
+                        stats['referenced'] += 1
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                    if st.st_mtime > cutoff:
+                        stats['too_new'] += 1
+                        continue
+                    batch.append((name, entry.path, st.st_size))
+                    if len(batch) >= self.batch_size:
+                        self._collect(batch, pool, options['dry_run'], stats)
+                        batch = []
+                self._collect(batch, pool, options['dry_run'], stats)
+            refs.close()
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(
+            f'Scanned {stats["scanned"]} files: {stats["referenced"]} referenced, '
+            f'{stats["too_new"]} newer than {options["min_age"]}s'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {stats["deleted"]} orphaned files, reclaiming {stats["bytes"]} bytes'
+        ))
+
+    def _load_references(self, refs):
+        '''stream Recipe.image into the on-disk set'''
+        names = Recipe.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True)
+        batch = []
+        for name in names.iterator(chunk_size=self.batch_size):
+            batch.append((name,))
+            if len(batch) >= self.batch_size:
+                refs.executemany('INSERT OR IGNORE INTO refs VALUES (?)', batch)
+                batch = []
+        refs.executemany('INSERT OR IGNORE INTO refs VALUES (?)', batch)
+        refs.commit()
+
+    def _collect(self, batch, pool, dry_run, stats):
+        '''delete a batch of candidates, re-checking references made since the scan started'''
+        if not batch:
+            return
+        live = set(Recipe.objects.filter(image__in=[name for name, path, size in batch]).values_list('image', flat=True))
+        orphans = [(path, size) for name, path, size in batch if name not in live]
+        if dry_run:
+            results = [size for path, size in orphans]
+        else:
+            results = [size for size in pool.map(self._delete, orphans) if size is not None]
+        stats['deleted'] += len(results)
+        stats['bytes'] += sum(results)
+
+    def _delete(self, orphan):
+        path, size = orphan
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return None
+        return size
@@ -0,0 +1,31 @@
+'''
+django command to merge tags/ingredients whose names differ only by case or whitespace
+'''
+from django.core.management.base import BaseCommand
+from core.dedup import merge_duplicates
+from core.models import Recipe, Tag, Ingredient
+from recipe.signals import relations_changed
+
+MODELS = {'tag': Tag, 'ingredient': Ingredient}
+
+
+class Command(BaseCommand):
+    '''merge duplicate tags/ingredients per user into the oldest row'''
+    help = ('Merge tags/ingredients sharing (user, normalized_name), rewriting recipe references in batches. '
+            'Safe to run online; run it before migrating large databases to the unique constraint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(MODELS), action='append',
+                            help='only merge this model (repeatable, default all)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='duplicate groups per transaction')
+
+    def handle(self, *args, **options):
+        for name in options['model'] or sorted(MODELS):
+            model = MODELS[name]
+            merged = merge_duplicates(model, Recipe, options['batch_size'], on_batch=self._record)
+            self.stdout.write(self.style.SUCCESS(f'Merged {merged} duplicate {model._meta.verbose_name_plural}'))
+
+    def _record(self, touched):
+        '''the through rows are rewritten without signals, so version and log the recipe changes'''
+        for user_id, recipe_ids in touched.items():
+            relations_changed(user_id, recipe_ids)
@@ -0,0 +1,80 @@
+'''
+django command to run queued jobs, see core.jobs
+'''
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core import jobs
+
+
+class Command(BaseCommand):
+    '''claim due jobs and run them concurrently'''
+    help = 'Run jobs from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.JOB_CONCURRENCY,
+                            help='jobs run at once; 1 runs them in this process, one by one')
+        parser.add_argument('--pool', choices=['thread', 'process'], default=settings.JOB_POOL,
+                            help='threads suit I/O bound jobs, processes CPU bound ones')
+        parser.add_argument('--interval', type=float, default=settings.JOB_POLL_INTERVAL,
+                            help='seconds to wait when no job is due')
+        parser.add_argument('--burst', action='store_true', help='exit once no job is due')
+
+    def handle(self, *args, **options):
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.started = timezone.now()
+        concurrency = max(options['concurrency'], 1)
+        try:
+            if concurrency == 1:
+                self._run_inline(options)
+            else:
+                self._run_pool(options, concurrency)
+        except KeyboardInterrupt:
+            pass
+        self._report()
+
+    def _run_inline(self, options):
+        while True:
+            jobs.requeue_stale()
+            claimed = jobs.claim(self.worker, 1)
+            for job_id in claimed:
+                jobs.run_job(job_id)
+            if not claimed:
+                if options['burst']:
+                    return
+                time.sleep(options['interval'])
+
+    def _run_pool(self, options, concurrency):
+        if options['pool'] == 'process':
+            pool = jobs.process_pool(concurrency)
+        else:
+            pool = ThreadPoolExecutor(max_workers=concurrency)
+        running = set()
+        with pool:
+            while True:
+                jobs.requeue_stale()
+                # claim only what there are free slots for, leaving the rest to other workers
+                free = concurrency - len(running)
+                claimed = jobs.claim(self.worker, free) if free else []
+                running.update(pool.submit(jobs.run_pooled, job_id) for job_id in claimed)
+                if running:
+                    done, running = wait(running, timeout=options['interval'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception() is not None:
+                            # the job itself failing is recorded by run_job, this is the worker side
+                            self.stderr.write(f'job runner error: {future.exception()!r}')
+                elif options['burst']:
+                    return
+                else:
+                    time.sleep(options['interval'])
+
+    def _report(self):
+        for name, row in jobs.metrics(since=self.started).items():
+            self.stdout.write(
+                f'{name}: {row["done"]} done, {row["failed"]} failed, {row["retrying"]} retrying, '
+                f'avg {row["avg_duration"] * 1000:.1f}ms, max {row["max_duration"] * 1000:.1f}ms'
+            )
@@ -0,0 +1,57 @@
+'''
+django command to report where worker startup time goes
+'''
+import os
+import re
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# "import time:      self [us] |   cumulative | imported package"
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def parse_importtime(output):
+    '''return [(module, self_us, cumulative_us, depth)] from python -X importtime stderr'''
+    rows = []
+    for line in output.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+class Command(BaseCommand):
+    '''load the WSGI application in a fresh interpreter with import timing'''
+    help = 'Start a worker the way the server would (with preload) and report per module import times'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15, help='number of modules to list')
+        parser.add_argument('--no-preload', action='store_true', help='time startup without the warmup')
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'app.settings'),
+               'DJANGO_PRELOAD': '0' if options['no_preload'] else '1'}
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import app.wsgi'],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if proc.returncode:
+            raise CommandError(proc.stderr[-2000:])
+
+        rows = parse_importtime(proc.stderr)
+        top = options['top']
+        self.stdout.write(f'{len(rows)} modules imported, {sum(r[1] for r in rows) / 1000:.0f}ms in imports')
+        # depth 1: what app.wsgi pulls in directly or through django.setup()
+        self.stdout.write('\nSlowest imports made by app.wsgi (cumulative):')
+        for module, self_us, cumulative_us, depth in sorted((r for r in rows if r[3] == 1), key=lambda r: -r[2])[:top]:
+            self.stdout.write(f'{cumulative_us / 1000:8.1f}ms  {module}')
+        self.stdout.write('\nSlowest modules (self):')
+        for module, self_us, cumulative_us, depth in sorted(rows, key=lambda r: -r[1])[:top]:
+            self.stdout.write(f'{self_us / 1000:8.1f}ms  {module}')
+
+        for line in proc.stderr.splitlines():
+            if line.startswith('worker ready'):
+                self.stdout.write(self.style.SUCCESS(f'\n{line}'))
@@ -0,0 +1,198 @@
+'''
+response compression
+
+negotiates gzip, and brotli/zstd when the `brotli`/`zstandard` packages are
+installed, from Accept-Encoding (q values honoured, ties broken by the order of
+COMPRESSION_ENCODINGS). only textual content types at least
+COMPRESSION_MIN_SIZE bytes long are compressed. streaming responses are
+compressed chunk by chunk, flushing after each so clients still receive data
+as it is produced.
+
+large bodies (COMPRESSION_CACHE_MIN_SIZE and up) are often served repeatedly
+unchanged, e.g. materialized snapshots. their compressed form is kept in the
+COMPRESSION_CACHE cache under a digest of the body, so each distinct body is
+compressed once per encoding rather than on every request. hashing is far
+cheaper than compressing.
+'''
+import gzip
+import hashlib
+import re
+import zlib
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+COMPRESSIBLE_TYPES = re.compile(r'^(text/|application/(json|.*\+json|xml|.*\+xml|javascript|vnd\.oai\.openapi)|image/svg)')
+ACCEPT_ENCODING_ITEM = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$')
+
+
+class GzipCodec:
+    name = 'gzip'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        # mtime=0 so the same body always compresses to the same bytes
+        return gzip.compress(data, self.level, mtime=0)
+
+    def stream(self):
+        '''return (compress chunk and flush, finish) for a streamed body'''
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+class BrotliCodec:
+    name = 'br'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.level)
+
+    def stream(self):
+        compressor = brotli.Compressor(quality=self.level)
+        return lambda chunk: compressor.process(chunk) + compressor.flush(), compressor.finish
+
+
+class ZstdCodec:
+    name = 'zstd'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def stream(self):
+        compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+        return lambda chunk: compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), compressor.flush
+
+
+CODECS = {'gzip': (GzipCodec, True), 'br': (BrotliCodec, brotli is not None), 'zstd': (ZstdCodec, zstandard is not None)}
+
+
+def available_codecs():
+    '''configured codecs whose library is installed, in preference order'''
+    codecs = []
+    for name in settings.COMPRESSION_ENCODINGS:
+        codec_class, installed = CODECS[name]
+        if installed:
+            codecs.append(codec_class(settings.COMPRESSION_LEVELS[name]))
+    return codecs
+
+
+def parse_accept_encoding(header):
+    '''return {coding: q} from an Accept-Encoding header'''
+    accepted = {}
+    for item in header.split(','):
+        match = ACCEPT_ENCODING_ITEM.match(item)
+        if match:
+            coding, q = match.groups()
+            try:
+                accepted[coding.lower()] = float(q) if q else 1.0
+            except ValueError:
+                continue
+    return accepted
+
+
+def negotiate(header, codecs):
+    '''the codec the client accepts with the highest q, or None'''
+    accepted = parse_accept_encoding(header)
+    best, best_q = None, 0
+    for codec in codecs:
+        q = accepted.get(codec.name, accepted.get('*', 0))
+        if q > best_q:
+            best, best_q = codec, q
+    return best
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    '''compress textual responses with the best encoding the client accepts'''
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.codecs = available_codecs()
+
+    def _should_compress(self, response):
+        if response.has_header('Content-Encoding') or response.status_code in (204, 206, 304):
+            return False
+        # byte ranges (media files) refer to the identity encoding
+        if response.has_header('Accept-Ranges'):
+            return False
+        if 'no-transform' in response.get('Cache-Control', ''):
+            return False
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if not COMPRESSIBLE_TYPES.match(content_type):
+            return False
+        return response.streaming or len(response.content) >= settings.COMPRESSION_MIN_SIZE
+
+    def process_response(self, request, response):
+        if not self._should_compress(response):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        codec = negotiate(request.headers.get('Accept-Encoding', ''), self.codecs)
+        if codec is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self._compress_stream(codec, response)
+            del response.headers['Content-Length']
+        else:
+            compressed = self._compress(codec, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # the compressed representation differs byte for byte, so a strong
+        # ETag becomes weak (RFC 9110 8.8.1); If-None-Match still matches it
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = codec.name
+        return response
+
+    def _compress(self, codec, content):
+        alias = settings.COMPRESSION_CACHE
+        if alias is None or len(content) < settings.COMPRESSION_CACHE_MIN_SIZE:
+            return codec.compress(content)
+        cache = caches[alias]
+        key = f'compressed:{codec.name}:{codec.level}:{hashlib.sha256(content).hexdigest()}'
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = codec.compress(content)
+            cache.set(key, compressed, settings.COMPRESSION_CACHE_TIMEOUT)
+        return compressed
+
+    def _compress_stream(self, codec, response):
+        process, finish = codec.stream()
+        # keep a reference: streaming_content is about to be replaced
+        chunks = response.streaming_content
+        if response.is_async:
+            async def compressed():
+                async for chunk in chunks:
+                    data = process(chunk)
+                    if data:
+                        yield data
+                yield finish()
+        else:
+            def compressed():
+                for chunk in chunks:
+                    data = process(chunk)
+                    if data:
+                        yield data
+                yield finish()
+        return compressed()
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:07
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_alter_recipe_ingredients_alter_recipe_tags"),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name="recipe",
+            managers=[
+                ("objects", core.models.RecipeManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="ingredient_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="ingredient_ids",
+            field=models.JSONField(default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="tag_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="tag_ids",
+            field=models.JSONField(default=list, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(
+                fields=["user", "tag_count"], name="recipe_user_tag_count_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(
+                fields=["user", "ingredient_count"], name="recipe_user_ingr_count_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:09
+
+import core.models
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0010_recipe_time_price_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="recipe",
+            name="image",
+            field=models.ImageField(
+                db_index=True,
+                null=True,
+                storage=core.storage.ContentAddressedStorage(),
+                upload_to=core.models.recipe_image_file_path,
+            ),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0011_recipe_image_content_addressed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeLogEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "entity_type",
+                    models.CharField(
+                        choices=[
+                            ("recipe", "Recipe"),
+                            ("tag", "Tag"),
+                            ("ingredient", "Ingredient"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("entity_id", models.BigIntegerField()),
+                ("deleted", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "id"], name="changelog_user_cursor_idx"
+                    )
+                ],
+            },
+        ),
+    ]
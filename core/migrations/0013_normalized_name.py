@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:14
+
+from django.db import migrations, models
+
+
+def normalize_names(apps, schema_editor):
+    for model_name in ["Tag", "Ingredient"]:
+        model = apps.get_model("core", model_name)
+        batch = []
+        for obj in model.objects.only("id", "name").iterator(chunk_size=2000):
+            obj.normalized_name = " ".join(obj.name.split()).casefold()
+            batch.append(obj)
+            if len(batch) >= 2000:
+                model.objects.bulk_update(batch, ["normalized_name"])
+                batch = []
+        model.objects.bulk_update(batch, ["normalized_name"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0012_changelogentry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ingredient",
+            name="normalized_name",
+            field=models.CharField(default="", editable=False, max_length=100),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="tag",
+            name="normalized_name",
+            field=models.CharField(default="", editable=False, max_length=50),
+            preserve_default=False,
+        ),
+        migrations.RunPython(normalize_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="ingredient",
+            index=models.Index(
+                fields=["user", "normalized_name"], name="ingr_user_normalized_name_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tag",
+            index=models.Index(
+                fields=["user", "normalized_name"], name="tag_user_normalized_name_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,124 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:17
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Q
+
+BATCH_SIZE = 1000
+
+
+# a frozen copy of core.dedup.merge_duplicates for the models as they are at
+# this migration: it must not change when that module or RecipeManager does.
+# the through tables have no columns of their own yet
+def _refresh_summaries(recipe_model, recipe_ids):
+    recipe_ids = sorted(recipe_ids)
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+        summary = {pk: {"tag_ids": [], "ingredient_ids": []} for pk in batch}
+        for field, column in (("tags", "tag_id"), ("ingredients", "ingredient_id")):
+            through = getattr(recipe_model, field).through
+            rows = through.objects.filter(recipe_id__in=batch).order_by(column).values_list("recipe_id", column)
+            for recipe_id, pk in rows:
+                summary[recipe_id][f"{column}s"].append(pk)
+        recipes = []
+        for pk, fields in summary.items():
+            fields["tag_count"] = len(fields["tag_ids"])
+            fields["ingredient_count"] = len(fields["ingredient_ids"])
+            recipes.append(recipe_model(pk=pk, **fields))
+        recipe_model.objects.bulk_update(recipes, ["tag_count", "ingredient_count", "tag_ids", "ingredient_ids"])
+
+
+def _merge_groups(model, recipe_model, groups):
+    """fold each (user_id, normalized_name, keep_id) group into keep_id"""
+    keep = {(user_id, name): keep_id for user_id, name, keep_id in groups}
+    candidates = model.objects.filter(
+        user_id__in={user_id for user_id, name in keep},
+        normalized_name__in={name for user_id, name in keep},
+    ).values_list("id", "user_id", "normalized_name")
+    remap = {}
+    for pk, user_id, name in candidates:
+        keep_id = keep.get((user_id, name))
+        if keep_id is not None and pk != keep_id:
+            remap[pk] = keep_id
+
+    column = f"{model._meta.model_name}_id"
+    through = getattr(recipe_model, f"{model._meta.model_name}s").through
+    last = 0
+    while True:
+        # moved links are deleted, so paging by id never sees one twice
+        links = list(
+            through.objects.filter(**{f"{column}__in": list(remap)}, id__gt=last)
+            .order_by("id").values_list("id", "recipe_id", column)[:BATCH_SIZE]
+        )
+        if not links:
+            break
+        last = links[-1][0]
+        wanted = {(recipe_id, remap[pk]) for link_id, recipe_id, pk in links}
+        existing = set(through.objects.filter(
+            recipe_id__in={recipe_id for recipe_id, keep_id in wanted},
+            **{f"{column}__in": {keep_id for recipe_id, keep_id in wanted}},
+        ).values_list("recipe_id", column))
+        through.objects.bulk_create(
+            [through(recipe_id=recipe_id, **{column: keep_id}) for recipe_id, keep_id in wanted - existing])
+        through.objects.filter(id__in=[link_id for link_id, recipe_id, pk in links]).delete()
+        _refresh_summaries(recipe_model, {recipe_id for link_id, recipe_id, pk in links})
+    model.objects.filter(id__in=list(remap)).delete()
+
+
+def _merge_duplicates(model, recipe_model):
+    last = None
+    while True:
+        rows = model.objects.all()
+        if last is not None:
+            user_id, name = last
+            rows = rows.filter(Q(user_id__gt=user_id) | Q(user_id=user_id, normalized_name__gt=name))
+        groups = list(
+            rows.values("user_id", "normalized_name")
+            .annotate(keep_id=Min("id"), copies=Count("id"))
+            .filter(copies__gt=1)
+            .order_by("user_id", "normalized_name")
+            .values_list("user_id", "normalized_name", "keep_id")[:BATCH_SIZE]
+        )
+        if not groups:
+            return
+        _merge_groups(model, recipe_model, groups)
+        last = groups[-1][:2]
+
+
+def merge_duplicate_names(apps, schema_editor):
+    # a no-op when manage.py merge_duplicate_names already ran
+    recipe = apps.get_model("core", "Recipe")
+    for model_name in ["Tag", "Ingredient"]:
+        _merge_duplicates(apps.get_model("core", model_name), recipe)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0013_normalized_name"),
+    ]
+
+    operations = [
+        # while the (user, normalized_name) index still exists
+        migrations.RunPython(merge_duplicate_names, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="ingredient",
+            name="ingr_user_normalized_name_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="tag",
+            name="tag_user_normalized_name_idx",
+        ),
+        migrations.AddConstraint(
+            model_name="ingredient",
+            constraint=models.UniqueConstraint(
+                fields=("user", "normalized_name"),
+                name="ingr_user_normalized_name_uniq",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="tag",
+            constraint=models.UniqueConstraint(
+                fields=("user", "normalized_name"), name="tag_user_normalized_name_uniq"
+            ),
+        ),
+    ]
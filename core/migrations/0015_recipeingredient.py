@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0014_normalized_name_unique"),
+    ]
+
+    operations = [
+        # adopt the existing auto-created through table as RecipeIngredient
+        # without touching it, then add the new columns
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="RecipeIngredient",
+                    fields=[
+                        ("id", models.AutoField(primary_key=True, serialize=False)),
+                        (
+                            "ingredient",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="recipe_links",
+                                to="core.ingredient",
+                            ),
+                        ),
+                        (
+                            "recipe",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="ingredient_links",
+                                to="core.recipe",
+                            ),
+                        ),
+                    ],
+                    options={
+                        "db_table": "core_recipe_ingredients",
+                        "unique_together": {("recipe", "ingredient")},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name="recipe",
+                    name="ingredients",
+                    field=models.ManyToManyField(
+                        blank=True,
+                        through="core.RecipeIngredient",
+                        to="core.ingredient",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="recipeingredient",
+            name="quantity",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=8, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="recipeingredient",
+            name="unit",
+            field=models.CharField(blank=True, max_length=20),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0015_recipeingredient"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecipeStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="recipe_stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("version", models.PositiveBigIntegerField(default=0)),
+                ("computed_version", models.PositiveBigIntegerField(null=True)),
+                ("data", models.JSONField(default=dict)),
+            ],
+        ),
+    ]
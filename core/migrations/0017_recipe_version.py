@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0016_recipestats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="version",
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0017_recipe_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxCursor",
+            fields=[
+                (
+                    "sink",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("position", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="OutboxEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "entity_type",
+                    models.CharField(
+                        choices=[
+                            ("recipe", "Recipe"),
+                            ("tag", "Tag"),
+                            ("ingredient", "Ingredient"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("entity_id", models.BigIntegerField()),
+                ("user_id", models.BigIntegerField()),
+                ("deleted", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0019_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="progress",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
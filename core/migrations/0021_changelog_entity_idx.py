@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0020_job_progress"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="changelogentry",
+            index=models.Index(
+                fields=["user", "entity_type", "entity_id", "id"],
+                name="changelog_entity_idx",
+            ),
+        ),
+    ]
@@ -2,21 +2,30 @@ from typing import Any
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.conf import settings
-import uuid
+from django.utils import timezone
+from .storage import ContentAddressedStorage
 import os
 
 # Create your models here.
 
 
 def recipe_image_file_path(instance, filename):
-    '''generate path for new recipe image'''
-    ext = os.path.splitext(filename)[1]
-    filename = f'{uuid.uuid4()}{ext}'
-    return os.path.join('recipe', filename)
+    '''generate path for new recipe image, the storage renames it to its content digest'''
+    ext = os.path.splitext(filename)[1].lower()
+    return os.path.join('recipe', f'image{ext}')
+
+
+def normalize_name(name):
+    '''case and whitespace insensitive form of a tag/ingredient name'''
+    return ' '.join(name.split()).casefold()
 
 
 class UserManager(BaseUserManager):
 
+    def get_by_natural_key(self, username):
+        '''used by authenticate(); fetch the auth token in the same query'''
+        return self.select_related('auth_token').get(**{self.model.USERNAME_FIELD: username})
+
     def create_user(self, email, name, password=None):
         if not email:
             raise ValueError("Users must have an email address")
@@ -54,22 +63,82 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.email
 
 
-class Tag(models.Model):
+class NormalizedNameMixin:
+    '''keep normalized_name in step with name on save'''
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'normalized_name'}
+        super().save(*args, **kwargs)
+
+
+class Tag(NormalizedNameMixin, models.Model):
     name = models.CharField(max_length=50)
+    normalized_name = models.CharField(max_length=50, editable=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'normalized_name'], name='tag_user_normalized_name_uniq')]
+
     def __str__(self) -> str:
         return self.name
 
 
-class Ingredient(models.Model):
+class Ingredient(NormalizedNameMixin, models.Model):
     name = models.CharField(max_length=100)
+    normalized_name = models.CharField(max_length=100, editable=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'normalized_name'], name='ingr_user_normalized_name_uniq')]
+
     def __str__(self) -> str:
         return self.name
 
 
+# module level so historical models in migrations can use refresh_summaries()
+SUMMARY_FIELDS = ['tag_count', 'ingredient_count', 'tag_ids', 'ingredient_ids']
+
+
+class RecipeManager(models.Manager):
+    use_in_migrations = True
+
+    def refresh_summaries(self, recipe_ids, batch_size=500):
+        '''
+        recompute the denormalized tag/ingredient columns of the given recipes
+        return {recipe_id: {field: value}} for the recipes that were updated
+        '''
+        recipe_ids = sorted(set(recipe_ids))
+        summaries = {}
+        for start in range(0, len(recipe_ids), batch_size):
+            batch = recipe_ids[start:start + batch_size]
+            summary = {pk: {'tag_ids': [], 'ingredient_ids': []} for pk in batch}
+            tag_rows = self.model.tags.through.objects.filter(recipe_id__in=batch).values_list('recipe_id', 'tag_id')
+            for recipe_id, tag_id in tag_rows.order_by('tag_id'):
+                summary[recipe_id]['tag_ids'].append(tag_id)
+            ingredient_rows = self.model.ingredients.through.objects.filter(
+                recipe_id__in=batch).values_list('recipe_id', 'ingredient_id')
+            for recipe_id, ingredient_id in ingredient_rows.order_by('ingredient_id'):
+                summary[recipe_id]['ingredient_ids'].append(ingredient_id)
+
+            recipes = []
+            for pk, fields in summary.items():
+                fields['tag_count'] = len(fields['tag_ids'])
+                fields['ingredient_count'] = len(fields['ingredient_ids'])
+                recipes.append(self.model(pk=pk, **fields))
+            self.bulk_update(recipes, SUMMARY_FIELDS)
+            summaries.update(summary)
+        return summaries
+
+    def bump_versions(self, recipe_ids, batch_size=500):
+        '''move recipes changed outside the recipe write path (their image, tags or ingredients) to a new version'''
+        recipe_ids = sorted(set(recipe_ids))
+        for start in range(0, len(recipe_ids), batch_size):
+            self.filter(id__in=recipe_ids[start:start + batch_size]).update(version=models.F('version') + 1)
+
+
 class Recipe(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     title = models.CharField(max_length=150)
@@ -78,8 +147,153 @@ class Recipe(models.Model):
     price = models.DecimalField(max_digits=5, decimal_places=2)
     link = models.CharField(max_length=255, blank=True)
     tags = models.ManyToManyField(Tag, blank=True)
-    ingredients = models.ManyToManyField(Ingredient, blank=True)
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    ingredients = models.ManyToManyField(Ingredient, blank=True, through='RecipeIngredient')
+    # indexed because the files are shared: a file is deleted once no recipe references it
+    image = models.ImageField(null=True, upload_to=recipe_image_file_path,
+                              storage=ContentAddressedStorage(), db_index=True)
+
+    # denormalized from tags/ingredients, kept current by core.signals
+    tag_count = models.PositiveIntegerField(default=0, editable=False)
+    ingredient_count = models.PositiveIntegerField(default=0, editable=False)
+    tag_ids = models.JSONField(default=list, editable=False)
+    ingredient_ids = models.JSONField(default=list, editable=False)
+
+    SUMMARY_FIELDS = SUMMARY_FIELDS
+
+    # bumped by every update through the API, which only applies if it is unchanged since read
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = RecipeManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'tag_count'], name='recipe_user_tag_count_idx'),
+            models.Index(fields=['user', 'ingredient_count'], name='recipe_user_ingr_count_idx'),
+            models.Index(fields=['user', 'time_minutes'], name='recipe_user_time_idx'),
+            models.Index(fields=['user', 'price'], name='recipe_user_price_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.title
+
+
+class RecipeIngredient(models.Model):
+    '''an ingredient of a recipe, with an optional amount for shopping lists'''
+    # the auto-created through table this replaces had an integer primary key
+    id = models.AutoField(primary_key=True)
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='ingredient_links')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name='recipe_links')
+    quantity = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    unit = models.CharField(max_length=20, blank=True)
+
+    class Meta:
+        # the table Django created for the former auto-created through model
+        db_table = 'core_recipe_ingredients'
+        unique_together = [('recipe', 'ingredient')]
+
+    def __str__(self) -> str:
+        return f'{self.quantity or ""} {self.unit} {self.ingredient_id}'.strip()
+
+
+class RecipeStats(models.Model):
+    '''
+    per user rollup of recipe statistics, recomputed lazily:
+    every recipe/tag/ingredient change bumps version, and a read whose
+    computed_version lags behind recomputes data
+    '''
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
+                                related_name='recipe_stats')
+    version = models.PositiveBigIntegerField(default=0)
+    computed_version = models.PositiveBigIntegerField(null=True)
+    data = models.JSONField(default=dict)
+
+    def __str__(self) -> str:
+        return f'stats for user {self.user_id} (v{self.version})'
+
+
+class ChangeLogEntry(models.Model):
+    '''
+    per user feed of recipe/tag/ingredient changes for delta sync
+    the auto incrementing id is the sync cursor
+    '''
+    ENTITY_TYPES = [('recipe', 'Recipe'), ('tag', 'Tag'), ('ingredient', 'Ingredient')]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    entity_type = models.CharField(max_length=20, choices=ENTITY_TYPES)
+    entity_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='changelog_user_cursor_idx'),
+            # finds the later entries of an entity when compacting
+            models.Index(fields=['user', 'entity_type', 'entity_id', 'id'], name='changelog_entity_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.entity_type} {self.entity_id}'
+
+
+class OutboxEvent(models.Model):
+    '''
+    recipe/tag/ingredient change for downstream consumers, written in the
+    transaction making the change and delivered by manage.py dispatch_outbox
+    '''
+    entity_type = models.CharField(max_length=20, choices=ChangeLogEntry.ENTITY_TYPES)
+    entity_id = models.BigIntegerField()
+    # not a foreign key: events outlive the account they describe
+    user_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f'{self.entity_type} {self.entity_id}'
+
+
+class OutboxCursor(models.Model):
+    '''the last outbox event delivered to a sink'''
+    sink = models.CharField(max_length=100, primary_key=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f'{self.sink} at {self.position}'
+
+
+class Job(models.Model):
+    '''deferred call run by manage.py run_worker, see core.jobs'''
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    # dotted path of the function to call
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    # queued jobs with the same key are coalesced into one
+    key = models.CharField(max_length=200, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    # seconds the last attempt took
+    duration = models.FloatField(null=True)
+    # reported by the running job through core.jobs.set_progress
+    progress = models.JSONField(default=dict, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+            models.Index(fields=['key', 'status'], name='job_key_status_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.name} ({self.status})'
@@ -0,0 +1,122 @@
+'''
+prebuilt OpenAPI schema
+
+generating the schema introspects every view and serializer, which takes
+hundreds of milliseconds, so it is done once per code version: by
+`manage.py build_schema` during deploys, or by the first request otherwise.
+the result is written to SCHEMA_ARTEFACT_DIR as openapi-<version>.json, and
+each process keeps the rendered YAML/JSON bodies, their gzip encodings and
+ETags in memory.
+
+the code version is the CODE_VERSION setting when the deploy provides one
+(e.g. the git sha), otherwise a digest of the project's Python sources and
+the Django/DRF/drf-spectacular versions, so a stale artefact is never served.
+'''
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import namedtuple
+import django
+import drf_spectacular
+import rest_framework
+from django.conf import settings
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+
+SKIP_DIRS = {'__pycache__', 'tests', 'media', 'benchmarks'}
+
+Body = namedtuple('Body', ['content_type', 'content', 'gzipped', 'etag'])
+
+_lock = threading.Lock()
+_versions = {}
+_bodies = {}  # (artefact path, format) -> Body
+
+
+def code_version():
+    '''identify the code the schema is generated from'''
+    base_dir = str(settings.BASE_DIR)
+    if getattr(settings, 'CODE_VERSION', None):
+        return settings.CODE_VERSION
+    if base_dir not in _versions:
+        digest = hashlib.sha256()
+        for dep in (django.get_version(), rest_framework.VERSION, drf_spectacular.__version__):
+            digest.update(dep.encode())
+        digest.update(repr(sorted(settings.SPECTACULAR_SETTINGS.items())).encode())
+        for root, dirs, files in os.walk(base_dir):
+            dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS and not d.startswith('.'))
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    path = os.path.join(root, name)
+                    digest.update(os.path.relpath(path, base_dir).encode())
+                    with open(path, 'rb') as f:
+                        digest.update(f.read())
+        _versions[base_dir] = digest.hexdigest()[:16]
+    return _versions[base_dir]
+
+
+def artefact_path():
+    '''where the schema of the current code version is stored'''
+    return os.path.join(settings.SCHEMA_ARTEFACT_DIR, f'openapi-{code_version()}.json')
+
+
+def generate_schema():
+    '''introspect the API, the slow part'''
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    return generator.get_schema(request=None, public=True)
+
+
+def build_artefact():
+    '''generate the schema and write it for the current code version, returning the path'''
+    path = artefact_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    content = OpenApiJsonRenderer().render(generate_schema(), renderer_context={})
+    # readers never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.openapi-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+    return path
+
+
+def load_schema():
+    '''the schema for the current code version, building the artefact if missing'''
+    path = artefact_path()
+    if not os.path.exists(path):
+        build_artefact()
+    with open(path, 'rb') as f:
+        return json.load(f)
+
+
+def _render(schema, fmt):
+    if fmt == 'json':
+        content = OpenApiJsonRenderer().render(schema, renderer_context={})
+        content_type = 'application/vnd.oai.openapi+json'
+    else:
+        content = OpenApiYamlRenderer().render(schema, renderer_context={})
+        content_type = 'application/vnd.oai.openapi; charset=utf-8'
+    etag = f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+    # mtime=0 keeps the gzip bytes, and so caches keyed on them, stable
+    return Body(content_type, content, gzip.compress(content, mtime=0), etag)
+
+
+def get_body(fmt):
+    '''the rendered schema in fmt ('yaml' or 'json'), from memory after the first call'''
+    key = (artefact_path(), fmt)
+    body = _bodies.get(key)
+    if body is None:
+        with _lock:
+            body = _bodies.get(key)
+            if body is None:
+                body = _bodies[key] = _render(load_schema(), fmt)
+    return body
+
+
+def clear():
+    '''forget the in-memory bodies and code version'''
+    with _lock:
+        _bodies.clear()
+        _versions.clear()
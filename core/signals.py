@@ -0,0 +1,92 @@
+'''
+keep the denormalized recipe summary columns in sync with M2M changes, and
+delete recipe image files once they are no longer referenced
+'''
+import time
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, pre_delete, post_delete, post_init, post_save
+from django.dispatch import receiver
+from .models import Recipe, Tag, Ingredient
+
+
+def _refresh(recipe_ids, instance=None):
+    '''refresh the summaries and mirror them onto an in-memory recipe'''
+    summaries = Recipe.objects.refresh_summaries(recipe_ids)
+    if isinstance(instance, Recipe) and instance.pk in summaries:
+        for field, value in summaries[instance.pk].items():
+            setattr(instance, field, value)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    '''recipe.tags / tag.recipe_set (and ingredients) add, remove and clear'''
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _refresh([instance.pk], instance)
+        return
+
+    # reverse side: instance is a Tag/Ingredient and pk_set holds recipe ids
+    if action == 'pre_clear':
+        instance._cleared_recipe_ids = list(instance.recipe_set.values_list('id', flat=True))
+    elif action == 'post_clear':
+        _refresh(getattr(instance, '_cleared_recipe_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        _refresh(pk_set)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def remember_recipes_of_deleted(sender, instance, **kwargs):
+    '''through rows are cascaded without m2m_changed, so note the recipes first'''
+    instance._deleted_recipe_ids = list(instance.recipe_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def refresh_recipes_of_deleted(sender, instance, **kwargs):
+    _refresh(getattr(instance, '_deleted_recipe_ids', []))
+
+
+def release_image(name):
+    '''
+    delete a recipe image file if no recipe references it any more
+
+    an upload of the same content reuses the file and touches it, but its
+    reference isn't visible here until that upload commits. so a file modified
+    within MEDIA_RELEASE_GRACE_SECONDS is kept, and gc_media collects it later
+    '''
+    if not name or Recipe.objects.filter(image=name).exists():
+        return
+    storage = Recipe._meta.get_field('image').storage
+    try:
+        modified = storage.get_modified_time(name).timestamp()
+    except FileNotFoundError:
+        return
+    if modified <= time.time() - settings.MEDIA_RELEASE_GRACE_SECONDS:
+        storage.delete(name)
+
+
+@receiver(post_init, sender=Recipe)
+def remember_loaded_image(sender, instance, **kwargs):
+    # the name as loaded from the database; read __dict__ directly so a
+    # deferred image field isn't fetched, and ignore uncommitted uploads
+    image = instance.__dict__.get('image')
+    instance._loaded_image = image if isinstance(image, str) and image else None
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(sender, instance, **kwargs):
+    old_name = getattr(instance, '_loaded_image', None)
+    new_name = instance.image.name or None
+    if old_name and old_name != new_name:
+        transaction.on_commit(lambda: release_image(old_name))
+    instance._loaded_image = new_name
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_image(sender, instance, **kwargs):
+    name = instance.image.name
+    if name:
+        transaction.on_commit(lambda: release_image(name))
@@ -0,0 +1,59 @@
+'''
+content addressed file storage
+
+files are named by the SHA-256 digest of their content, computed while the
+upload is streamed to a temporary file next to its final location. storing the
+same bytes twice therefore yields the same name and a single file on disk, and
+since a name never changes content, URLs can be cached forever.
+'''
+import hashlib
+import os
+import tempfile
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+TEMP_PREFIX = '.upload-'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    '''file system storage that stores each distinct content once'''
+
+    def save(self, name, content, max_length=None):
+        '''store content as <directory of name>/<sha256><extension of name>'''
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        dirname, filename = os.path.split(name)
+        directory = self.path(dirname)
+        os.makedirs(directory, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+
+            name = os.path.join(dirname, digest.hexdigest() + os.path.splitext(filename)[1].lower())
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                # refresh the mtime so gc_media's age threshold covers the new reference
+                os.utime(full_path)
+            else:
+                # mkstemp creates 0600 files. file_permissions_mode is
+                # FILE_UPLOAD_PERMISSIONS, 0o644 unless configured; reading the
+                # umask instead would mean setting it, which is process wide
+                mode = self.file_permissions_mode
+                os.chmod(temp_path, 0o644 if mode is None else mode)
+                # atomic, and identical bytes if another upload got there first
+                os.replace(temp_path, full_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        return name.replace('\\', '/')
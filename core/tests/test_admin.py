@@ -1,11 +1,15 @@
 '''
 tests for admin modification
 '''
-
+from decimal import Decimal
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import Client
+from core.admin import EstimatedCountPaginator
+from core.models import Job, Recipe, Tag, Ingredient
 
 
 class AdminSiteTests(TestCase):
@@ -28,3 +32,96 @@ class AdminSiteTests(TestCase):
 
         self.assertContains(res, self.user.name)
         self.assertContains(res, self.user.email)
+
+    def test_delete_accounts_action(self):
+        '''test the admin action deactivates the accounts and queues their deletion'''
+        url = reverse('admin:core_user_changelist')
+        res = self.client.post(url, {'action': 'delete_accounts', '_selected_action': [self.user.id]})
+
+        self.assertEqual(res.status_code, 302)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertTrue(Job.objects.filter(name='user.deletion.delete_account', args=[self.user.id]).exists())
+
+
+class RecipeAdminTests(TestCase):
+    '''test the recipe, tag and ingredient admin pages'''
+
+    def setUp(self):
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(email='admin@example.com',
+                                                                    password='adminpass123',
+                                                                    name='admin')
+        self.client.force_login(self.admin_user)
+        self.user = get_user_model().objects.create_user(email='test@example.com',
+                                                         password='testpass123',
+                                                         name='test')
+        self.other = get_user_model().objects.create_user(email='other@example.com',
+                                                          password='testpass123',
+                                                          name='other')
+
+    def create_recipes(self, user, count):
+        return [
+            Recipe.objects.create(user=user, title=f'recipe {i}', time_minutes=i, price=Decimal('1'))
+            for i in range(count)
+        ]
+
+    def changelist_queries(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(reverse('admin:core_recipe_changelist'), params)
+        self.assertEqual(res.status_code, 200)
+        return len(ctx)
+
+    def test_changelist_queries_constant(self):
+        '''test the recipe list doesn't query per row'''
+        self.create_recipes(self.user, 2)
+        few = self.changelist_queries()
+        self.create_recipes(self.other, 10)
+
+        self.assertEqual(self.changelist_queries(), few)
+
+    def test_changelist_user_filter_and_search(self):
+        '''test filtering by user and searching by id or exact email'''
+        mine = self.create_recipes(self.user, 2)
+        theirs = self.create_recipes(self.other, 1)
+        url = reverse('admin:core_recipe_changelist')
+
+        res = self.client.get(url, {'user': self.user.id})
+        self.assertEqual(set(res.context['cl'].result_list), set(mine))
+        res = self.client.get(url, {'q': 'other@example.com'})
+        self.assertEqual(list(res.context['cl'].result_list), theirs)
+        res = self.client.get(url, {'q': str(mine[0].id)})
+        self.assertEqual(list(res.context['cl'].result_list), [mine[0]])
+
+    def test_tag_autocomplete_scoped_to_user(self):
+        '''test a recipe's tag autocomplete only offers its owner's tags'''
+        recipe = self.create_recipes(self.user, 1)[0]
+        mine = Tag.objects.create(user=self.user, name='Dessert')
+        Tag.objects.create(user=self.other, name='Dessert')
+        res = self.client.get(reverse('admin:core_recipe_change', args=[recipe.id]))
+        self.assertContains(res, f'autocomplete/?user={self.user.id}')
+
+        res = self.client.get(reverse('admin:autocomplete'), {
+            'term': 'des', 'app_label': 'core', 'model_name': 'recipe', 'field_name': 'tags', 'user': self.user.id,
+        })
+        self.assertEqual([r['id'] for r in res.json()['results']], [str(mine.id)])
+
+    def test_inline_ingredients_refresh_summary(self):
+        '''test ingredients added through the inline update the recipe summary'''
+        recipe = self.create_recipes(self.user, 1)[0]
+        salt = Ingredient.objects.create(user=self.user, name='salt')
+        data = {
+            'user': self.user.id, 'title': recipe.title, 'description': '', 'time_minutes': 1, 'price': '1.00',
+            'link': '', 'ingredient_links-TOTAL_FORMS': 1, 'ingredient_links-INITIAL_FORMS': 0,
+            'ingredient_links-0-ingredient': salt.id, 'ingredient_links-0-quantity': '2', 'ingredient_links-0-unit': 'g',
+        }
+        res = self.client.post(reverse('admin:core_recipe_change', args=[recipe.id]), data)
+        self.assertEqual(res.status_code, 302)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.ingredient_ids, [salt.id])
+
+    def test_estimated_count_falls_back_to_count(self):
+        '''test the paginator counts exactly where there are no planner statistics'''
+        self.create_recipes(self.user, 3)
+
+        self.assertEqual(EstimatedCountPaginator(Recipe.objects.order_by('-id'), 100).count, 3)
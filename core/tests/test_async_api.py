@@ -0,0 +1,127 @@
+'''
+tests for async recipe read APIs
+'''
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from ..models import Recipe, Ingredient, Tag
+
+ASYNC_RECIPE_URL = reverse('recipe:async-recipe-list')
+ASYNC_TAG_URL = reverse('recipe:async-tag-list')
+ASYNC_INGREDIENT_URL = reverse('recipe:async-ingredient-list')
+
+
+def create_user(**params):
+    '''create and return a new user'''
+    defaults = {
+        'email': 'test@example.com',
+        'password': 'testpass123',
+        'name': 'test',
+    }
+    defaults.update(params)
+
+    return get_user_model().objects.create_user(**defaults)
+
+
+def create_recipe(user, **params):
+    '''create and return a sample recipe'''
+    defaults = {
+        'title': 'test recipe',
+        'time_minutes': 10,
+        'description': 'testesttest',
+        'price': Decimal('5.5'),
+        'link': 'http://example.com/recipe.pdf',
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class AsyncRecipeAPITests(TestCase):
+    '''test async read endpoints match the sync API'''
+
+    def setUp(self):
+        self.user = create_user()
+        self.token = Token.objects.create(user=self.user)
+        self.headers = {'Authorization': f'Token {self.token.key}'}
+        self.sync_client = APIClient()
+        self.sync_client.force_authenticate(self.user)
+
+        recipe = create_recipe(user=self.user)
+        self.tag = Tag.objects.create(user=self.user, name='vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user, name='salt')
+        recipe.tags.add(self.tag)
+        recipe.ingredients.add(self.ingredient)
+        create_recipe(user=self.user, title='second')
+        create_recipe(user=create_user(email='test2@example.com', name='test2'))
+        self.recipe = recipe
+
+    async def test_auth_required(self):
+        '''test auth is required to call async API'''
+        res = await self.async_client.get(ASYNC_RECIPE_URL)
+
+        self.assertEqual(res.status_code, 401)
+
+    async def test_recipe_list_matches_sync_api(self):
+        '''test async recipe list returns the same payload as the viewset'''
+        res = await self.async_client.get(ASYNC_RECIPE_URL, headers=self.headers)
+        expected = await self._sync_get(reverse('recipe:recipe-list'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), expected)
+
+    async def test_recipe_list_params_match_sync_api(self):
+        '''test filters, ordering and pagination are the viewset's'''
+        params = {'ordering': 'title', 'max_price': '6', 'min_tags': '0', 'page_size': '1'}
+        res = await self.async_client.get(ASYNC_RECIPE_URL, params, headers=self.headers)
+        expected = await self._sync_get(reverse('recipe:recipe-list'), params)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['results'], expected['results'])
+        self.assertEqual([r['title'] for r in res.json()['results']], ['second'])
+
+        res = await self.async_client.get(res.json()['next'], headers=self.headers)
+        self.assertEqual([r['title'] for r in res.json()['results']], ['test recipe'])
+        self.assertIsNone(res.json()['next'])
+
+    async def test_recipe_list_invalid_params(self):
+        '''test invalid params get the viewset's 400'''
+        for params in ({'ordering': 'description'}, {'min_price': 'abc'}):
+            res = await self.async_client.get(ASYNC_RECIPE_URL, params, headers=self.headers)
+            expected = await self._sync_get(reverse('recipe:recipe-list'), params)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.json(), expected)
+
+    async def test_recipe_detail(self):
+        '''test async recipe detail includes description and image'''
+        url = reverse('recipe:async-recipe-detail', args=[self.recipe.id])
+        res = await self.async_client.get(url, headers=self.headers)
+        expected = await self._sync_get(reverse('recipe:recipe-detail', args=[self.recipe.id]))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), expected)
+
+    async def test_other_users_recipe_not_found(self):
+        '''test async recipe detail is limited to the authenticated user'''
+        other = await Recipe.objects.exclude(user=self.user).afirst()
+        url = reverse('recipe:async-recipe-detail', args=[other.id])
+        res = await self.async_client.get(url, headers=self.headers)
+
+        self.assertEqual(res.status_code, 404)
+
+    async def test_tag_and_ingredient_lists(self):
+        '''test async tag and ingredient lists'''
+        tags = await self.async_client.get(ASYNC_TAG_URL, headers=self.headers)
+        ingredients = await self.async_client.get(ASYNC_INGREDIENT_URL, headers=self.headers)
+
+        self.assertEqual(tags.json(), [{'id': self.tag.id, 'name': 'vegan'}])
+        self.assertEqual(ingredients.json(), [{'id': self.ingredient.id, 'name': 'salt'}])
+
+    async def _sync_get(self, url, params=None):
+        res = await sync_to_async(self.sync_client.get)(url, params)
+        return res.json()
@@ -1,10 +1,22 @@
 '''test custom django management commands'''
 
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 from unittest.mock import patch
 from psycopg2 import OperationalError as Psycopg2Error
 from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from core.models import User, Recipe, Tag, ChangeLogEntry
+from recipe.sync import delta_sync
 
 
 @patch('core.management.commands.wait_for_db.Command.check')
@@ -24,3 +36,172 @@ class CommandTests(SimpleTestCase):
         call_command('wait_for_db')
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+
+class BackfillRecipeSummaryTests(TestCase):
+    '''test backfill_recipe_summary command'''
+
+    def test_backfill_recipe_summary(self):
+        '''test stale summary columns are recomputed'''
+        user = User.objects.create_user(email='test@example.com', password='testpass123', name='test')
+        recipe = Recipe.objects.create(user=user, title='test recipe', time_minutes=5, price=Decimal('5.5'))
+        recipe.tags.add(Tag.objects.create(user=user, name='test'))
+        Recipe.objects.update(tag_count=0, tag_ids=[])
+
+        call_command('backfill_recipe_summary', stdout=StringIO())
+        recipe.refresh_from_db()
+
+        self.assertEqual(recipe.tag_count, 1)
+
+
+class MergeDuplicateNamesTests(TransactionTestCase):
+    '''test merge_duplicate_names command'''
+
+    def setUp(self):
+        # duplicates can only exist without the unique constraint
+        self.constraint = Tag._meta.constraints[0]
+        # SQLite rebuilds the table from Meta.constraints
+        with patch.object(Tag._meta, 'constraints', []), connection.schema_editor() as editor:
+            editor.remove_constraint(Tag, self.constraint)
+        self.user = User.objects.create_user(email='test@example.com', password='testpass123', name='test')
+        self.salt = Tag.objects.create(user=self.user, name='Salty')
+        self.dupe = Tag.objects.create(user=self.user, name='salty ')
+        self.both = Recipe.objects.create(user=self.user, title='both', time_minutes=5, price=Decimal('5.5'))
+        self.both.tags.add(self.salt, self.dupe)
+        self.one = Recipe.objects.create(user=self.user, title='one', time_minutes=5, price=Decimal('5.5'))
+        self.one.tags.add(self.dupe)
+
+    def tearDown(self):
+        Tag.objects.all().delete()
+        with connection.schema_editor() as editor:
+            editor.add_constraint(Tag, self.constraint)
+
+    def test_merge_command(self):
+        '''test duplicates are merged into the oldest tag, keeping recipe references'''
+        out = StringIO()
+        call_command('merge_duplicate_names', '--batch-size', '1', stdout=out)
+
+        self.assertEqual(list(Tag.objects.filter(user=self.user)), [self.salt])
+        for recipe in (self.both, self.one):
+            recipe.refresh_from_db()
+            self.assertEqual(list(recipe.tags.all()), [self.salt])
+            self.assertEqual(recipe.tag_ids, [self.salt.id])
+        self.assertIn('Merged 1 duplicate tags', out.getvalue())
+
+
+class NormalizedNameMigrationTests(TransactionTestCase):
+    '''test the unique name migration merges leftover duplicates first'''
+    before = [('core', '0013_normalized_name')]
+
+    def test_migration_merges(self):
+        '''test duplicates created before the constraint are merged by the migration'''
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        # historical models: the current ones may not match the old schema
+        apps = executor.loader.project_state(self.before).apps
+        user = apps.get_model('core', 'User').objects.create(email='test@example.com', name='test')
+        tags = apps.get_model('core', 'Tag').objects
+        salt = tags.create(user=user, name='Salty', normalized_name='salty')
+        dupe = tags.create(user=user, name='salty ', normalized_name='salty')
+        recipes = apps.get_model('core', 'Recipe').objects
+        recipe = recipes.create(user=user, title='one', time_minutes=5, price=Decimal('5.5'))
+        recipe.tags.add(dupe)
+        both = recipes.create(user=user, title='both', time_minutes=5, price=Decimal('5.5'))
+        both.tags.add(salt, dupe)
+
+        # the migration keeps its own copy of the merge, the live manager may differ
+        with patch('core.models.RecipeManager.refresh_summaries') as refresh_summaries:
+            executor = MigrationExecutor(connection)
+            executor.migrate(executor.loader.graph.leaf_nodes())
+
+        refresh_summaries.assert_not_called()
+        self.assertEqual(list(Tag.objects.values_list('id', flat=True)), [salt.id])
+        for pk in (recipe.id, both.id):
+            merged = Recipe.objects.get(id=pk)
+            self.assertEqual(list(merged.tags.values_list('id', flat=True)), [salt.id])
+            self.assertEqual((merged.tag_ids, merged.tag_count), ([salt.id], 1))
+
+
+class GcMediaTests(TestCase):
+    '''test gc_media command'''
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        os.makedirs(os.path.join(self.media_root, 'recipe'))
+        user = User.objects.create_user(email='test@example.com', password='testpass123', name='test')
+        Recipe.objects.create(user=user, title='test recipe', time_minutes=5, price=Decimal('5.5'),
+                              image='recipe/kept.jpg')
+        self.kept = self._write('kept.jpg', age=7200)
+        self.orphan = self._write('orphan.jpg', age=7200)
+        self.new_orphan = self._write('new.jpg', age=0)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def _write(self, name, age):
+        path = os.path.join(self.media_root, 'recipe', name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * 10)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_gc_media_deletes_old_orphans(self):
+        '''test only unreferenced files older than the threshold are deleted'''
+        out = StringIO()
+        call_command('gc_media', stdout=out)
+
+        self.assertTrue(os.path.exists(self.kept))
+        self.assertFalse(os.path.exists(self.orphan))
+        self.assertTrue(os.path.exists(self.new_orphan))
+        self.assertIn('Deleted 1 orphaned files, reclaiming 10 bytes', out.getvalue())
+
+    def test_gc_media_dry_run(self):
+        '''test dry run reports without deleting'''
+        out = StringIO()
+        call_command('gc_media', '--dry-run', stdout=out)
+
+        self.assertTrue(os.path.exists(self.orphan))
+        self.assertIn('Would delete 1 orphaned files', out.getvalue())
+
+
+@override_settings(SYNC_SETTLE_SECONDS=60)
+class CompactChangeLogTests(TestCase):
+    '''test compact_change_log command'''
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='test@example.com', password='testpass123', name='test')
+
+    def _settle(self):
+        ChangeLogEntry.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+
+    def test_keeps_latest_entry_of_each_entity(self):
+        '''test superseded entries go, and a sync from any cursor sees the same changes'''
+        recipe = Recipe.objects.create(user=self.user, title='r', time_minutes=5, price=Decimal('5.5'))
+        cursor = ChangeLogEntry.objects.latest('id').id
+        recipe.save()
+        tag = Tag.objects.create(user=self.user, name='tag')
+        recipe.save()
+        self._settle()
+        before = delta_sync(self.user.id, cursor, 100)
+
+        out = StringIO()
+        call_command('compact_change_log', stdout=out)
+
+        remaining = list(ChangeLogEntry.objects.order_by('id').values_list('entity_type', 'entity_id'))
+        self.assertEqual(remaining, [('tag', tag.id), ('recipe', recipe.id)])
+        self.assertEqual(delta_sync(self.user.id, cursor, 100), before)
+        self.assertIn('Deleted 2 superseded change log entries', out.getvalue())
+
+    def test_keeps_entries_superseded_by_unsettled_ones(self):
+        '''test an entry whose later entry may still be committing is kept'''
+        recipe = Recipe.objects.create(user=self.user, title='r', time_minutes=5, price=Decimal('5.5'))
+        self._settle()
+        recipe.save()
+
+        call_command('compact_change_log', stdout=StringIO())
+
+        self.assertEqual(ChangeLogEntry.objects.count(), 2)
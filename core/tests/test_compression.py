@@ -0,0 +1,83 @@
+'''
+tests for the compression middleware
+'''
+import gzip
+import json
+import zlib
+from unittest.mock import patch
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from core.middleware import CompressionMiddleware, GzipCodec, negotiate
+
+PAYLOAD = {'recipes': [{'id': i, 'title': 'test recipe', 'tags': []} for i in range(200)]}
+
+
+class BrotliStub(GzipCodec):
+    name = 'br'
+
+
+def compress(response, accept_encoding='gzip'):
+    '''run a response through the middleware for a request accepting accept_encoding'''
+    request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+    return CompressionMiddleware(lambda request: response)(request)
+
+
+@override_settings(COMPRESSION_CACHE=None)
+class CompressionMiddlewareTests(SimpleTestCase):
+    '''test response compression'''
+
+    def test_compresses_json(self):
+        '''test a large JSON body is gzipped with Vary set and a weakened ETag'''
+        response = JsonResponse(PAYLOAD)
+        response['ETag'] = '"abc"'
+        res = compress(response)
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(res.content)), PAYLOAD)
+        self.assertEqual(res['Content-Length'], str(len(res.content)))
+        self.assertEqual(res['ETag'], 'W/"abc"')
+        self.assertIn('Accept-Encoding', res['Vary'])
+
+    def test_skips_small_and_binary(self):
+        '''test bodies under the threshold and non textual types are left alone'''
+        small = compress(JsonResponse({'id': 1}))
+        binary = compress(HttpResponse(b'\0' * 4096, content_type='image/jpeg'))
+
+        self.assertFalse(small.has_header('Content-Encoding'))
+        self.assertFalse(binary.has_header('Content-Encoding'))
+
+    def test_not_accepted(self):
+        '''test nothing is compressed for clients not accepting an available encoding'''
+        for header in ['', 'identity', 'gzip;q=0', 'br']:
+            self.assertFalse(compress(JsonResponse(PAYLOAD), header).has_header('Content-Encoding'))
+
+    def test_negotiate_prefers_highest_q(self):
+        '''test q values win over server preference, which breaks ties'''
+        codecs = [BrotliStub(4), GzipCodec(6)]
+
+        self.assertEqual(negotiate('gzip, br', codecs).name, 'br')
+        self.assertEqual(negotiate('gzip;q=1, br;q=0.5', codecs).name, 'gzip')
+        self.assertEqual(negotiate('*', codecs).name, 'br')
+        self.assertIsNone(negotiate('*;q=0', codecs))
+
+    def test_streaming(self):
+        '''test streaming bodies are compressed chunk by chunk'''
+        chunks = [json.dumps(row).encode() + b'\n' for row in PAYLOAD['recipes']]
+        res = compress(StreamingHttpResponse(iter(chunks), content_type='application/x-ndjson+json'))
+        parts = list(res.streaming_content)
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertGreater(len(parts), 1)
+        self.assertEqual(zlib.decompress(b''.join(parts), 16 + zlib.MAX_WBITS), b''.join(chunks))
+
+    @override_settings(COMPRESSION_CACHE='default', COMPRESSION_CACHE_MIN_SIZE=1024)
+    def test_compressed_body_cached(self):
+        '''test a repeated body is compressed once'''
+        cache.clear()
+        with patch.object(GzipCodec, 'compress', autospec=True, side_effect=GzipCodec.compress) as compressor:
+            first = compress(JsonResponse(PAYLOAD))
+            second = compress(JsonResponse(PAYLOAD))
+
+        self.assertEqual(compressor.call_count, 1)
+        self.assertEqual(first.content, second.content)
@@ -0,0 +1,192 @@
+'''
+tests for the database job queue and the run_worker command
+'''
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from ..models import Job, RecipeStats
+from core import jobs
+
+calls = []
+
+
+def record(*args, **kwargs):
+    '''job used by the tests'''
+    calls.append((args, kwargs))
+
+
+def fail():
+    raise ValueError('broken')
+
+
+def note_pid():
+    jobs.set_progress(pid=os.getpid())
+
+
+def connection_inherited():
+    return connection.connection is not None
+
+
+def create_user(**params):
+    '''create and return a new user'''
+    defaults = {
+        'email': 'test@example.com',
+        'password': 'testpass123',
+        'name': 'test',
+    }
+    defaults.update(params)
+
+    return get_user_model().objects.create_user(**defaults)
+
+
+class JobQueueTests(TestCase):
+    '''test enqueueing, claiming and running jobs'''
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        '''test a queued job is claimed once and called with its arguments'''
+        job = jobs.enqueue(record, 1, 'a', flag=True)
+
+        claimed = jobs.claim('test', 10)
+        self.assertEqual(claimed, [job.id])
+        self.assertEqual(jobs.claim('test', 10), [])
+
+        jobs.run_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(calls, [((1, 'a'), {'flag': True})])
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 1))
+        self.assertIsNotNone(job.duration)
+
+    def test_delayed_job_not_claimed(self):
+        '''test a job isn't run before its delay passed'''
+        jobs.enqueue(record, delay=60)
+
+        self.assertEqual(jobs.claim('test', 10), [])
+
+    def test_same_key_coalesced(self):
+        '''test a queued job with the same key isn't added twice'''
+        self.assertIsNotNone(jobs.enqueue(record, key='k'))
+        self.assertIsNone(jobs.enqueue(record, key='k'))
+
+        self.assertEqual(Job.objects.count(), 1)
+
+    @override_settings(JOB_RETRY_BACKOFF=10)
+    def test_failure_retried_with_backoff(self):
+        '''test a failing job is queued again later, then given up on'''
+        job = jobs.enqueue(fail, max_attempts=2)
+
+        with self.assertLogs('core.jobs', 'WARNING'):
+            jobs.run_job(jobs.claim('test', 1)[0])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('ValueError', job.last_error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=5))
+
+        Job.objects.update(run_after=timezone.now())
+        with self.assertLogs('core.jobs', 'WARNING'):
+            jobs.run_job(jobs.claim('test', 1)[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    @override_settings(JOB_TIMEOUT=60)
+    def test_stale_job_requeued(self):
+        '''test a job whose worker died is run again'''
+        job = jobs.enqueue(record)
+        jobs.claim('dead', 1)
+        Job.objects.update(started_at=timezone.now() - timedelta(minutes=5))
+
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.claim('test', 1), [job.id])
+
+    @override_settings(JOB_TIMEOUT=60)
+    def test_stale_job_out_of_attempts_failed(self):
+        '''test a job that keeps outliving its worker isn't queued forever'''
+        job = jobs.enqueue(record, max_attempts=1)
+        jobs.claim('dead', 1)
+        Job.objects.update(started_at=timezone.now() - timedelta(minutes=5))
+
+        with self.assertLogs('core.jobs', 'WARNING'):
+            self.assertEqual(jobs.requeue_stale(), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.claimed_by), (Job.FAILED, ''))
+        self.assertIn('JOB_TIMEOUT', job.last_error)
+
+    def test_run_worker_burst(self):
+        '''test the worker runs due jobs, reports them and exits when idle'''
+        jobs.enqueue(record, 1)
+        jobs.enqueue(record, 2)
+        out = StringIO()
+
+        call_command('run_worker', '--burst', '--concurrency', '1', stdout=out)
+
+        self.assertEqual(sorted(args for args, kwargs in calls), [(1,), (2,)])
+        self.assertIn('core.tests.test_jobs.record: 2 done, 0 failed', out.getvalue())
+
+    def test_recipe_writes_defer_stats(self):
+        '''test recipe writes queue one stats refresh, which the worker computes'''
+        user = create_user()
+        client = APIClient()
+        client.force_authenticate(user)
+        for i in range(2):
+            client.post(reverse('recipe:recipe-list'), {'title': f'r{i}', 'time_minutes': 5, 'price': '5.00'})
+
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.args), ('recipe.tasks.refresh_stats', [user.id]))
+
+        call_command('run_worker', '--burst', '--concurrency', '1', stdout=StringIO())
+        rollup = RecipeStats.objects.get(user=user)
+        self.assertEqual(rollup.computed_version, rollup.version)
+        self.assertEqual(rollup.data['count'], 2)
+
+
+class ProcessPoolTests(TransactionTestCase):
+    '''test running jobs on forked processes'''
+
+    def setUp(self):
+        # forked processes can't reach the in-memory test database, so run
+        # these tests on a file copy of it
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir, 'jobs.sqlite3')
+        connection.ensure_connection()
+        target = sqlite3.connect(path)
+        connection.connection.backup(target)
+        target.close()
+        self.memory = connection.connection, connection.settings_dict['NAME']
+        connection.connection = None
+        connection.settings_dict['NAME'] = path
+
+    def tearDown(self):
+        connection.close()
+        connection.connection, connection.settings_dict['NAME'] = self.memory
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_processes_drop_inherited_connections(self):
+        '''test pool processes don't use the connection of the parent'''
+        connection.ensure_connection()
+
+        with jobs.process_pool(1) as pool:
+            self.assertFalse(pool.submit(connection_inherited).result())
+        self.assertIsNotNone(connection.connection)
+
+    def test_run_worker_process_pool(self):
+        '''test the worker runs jobs in other processes'''
+        for i in range(3):
+            jobs.enqueue(note_pid)
+
+        call_command('run_worker', '--burst', '--pool', 'process', '--concurrency', '2', stdout=StringIO())
+
+        rows = list(Job.objects.values_list('status', 'progress'))
+        self.assertEqual([status for status, progress in rows], [Job.DONE] * 3)
+        self.assertNotIn(os.getpid(), {progress['pid'] for status, progress in rows})
@@ -0,0 +1,108 @@
+'''
+tests for media serving
+'''
+import os
+import shutil
+import tempfile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+MEDIA_ROOT = tempfile.mkdtemp()
+DIGEST = 'a' * 64
+CONTENT = bytes(range(256)) * 4
+
+
+def media_url(path):
+    '''create and return a media URL'''
+    return reverse('media', args=[path])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class MediaServingTests(TestCase):
+    '''test serving files from MEDIA_ROOT'''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        os.makedirs(os.path.join(MEDIA_ROOT, 'recipe'), exist_ok=True)
+        for name in [f'{DIGEST}.jpg', 'legacy.JPG']:
+            with open(os.path.join(MEDIA_ROOT, 'recipe', name), 'wb') as f:
+                f.write(CONTENT)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_serve_content_addressed_file(self):
+        '''test content addressed files are served as immutable'''
+        res = self.client.get(media_url(f'recipe/{DIGEST}.jpg'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(b''.join(res.streaming_content), CONTENT)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['ETag'], f'"{DIGEST}"')
+        self.assertIn('immutable', res['Cache-Control'])
+
+    def test_legacy_file_gets_weak_etag(self):
+        '''test other files get a weak ETag and a short max-age'''
+        res = self.client.get(media_url('recipe/legacy.JPG'))
+
+        self.assertTrue(res['ETag'].startswith('W/'))
+        self.assertNotIn('immutable', res['Cache-Control'])
+
+    def test_if_none_match_not_modified(self):
+        '''test a matching If-None-Match returns 304'''
+        res = self.client.get(media_url(f'recipe/{DIGEST}.jpg'), HTTP_IF_NONE_MATCH=f'"{DIGEST}"')
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res['ETag'], f'"{DIGEST}"')
+
+    def test_range_request(self):
+        '''test a byte range returns 206 with only those bytes'''
+        res = self.client.get(media_url(f'recipe/{DIGEST}.jpg'), HTTP_RANGE='bytes=10-19')
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res['Content-Range'], f'bytes 10-19/{len(CONTENT)}')
+        self.assertEqual(res['Content-Length'], '10')
+        self.assertEqual(b''.join(res.streaming_content), CONTENT[10:20])
+
+    def test_suffix_range_request(self):
+        '''test a suffix range returns the last bytes'''
+        res = self.client.get(media_url(f'recipe/{DIGEST}.jpg'), HTTP_RANGE='bytes=-5')
+
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(b''.join(res.streaming_content), CONTENT[-5:])
+
+    def test_unsatisfiable_range(self):
+        '''test a range past the end of the file returns 416'''
+        res = self.client.get(media_url(f'recipe/{DIGEST}.jpg'), HTTP_RANGE=f'bytes={len(CONTENT)}-')
+
+        self.assertEqual(res.status_code, 416)
+        self.assertEqual(res['Content-Range'], f'bytes */{len(CONTENT)}')
+
+    def test_stale_if_range_serves_whole_file(self):
+        '''test a non matching If-Range ignores the Range header'''
+        res = self.client.get(media_url(f'recipe/{DIGEST}.jpg'), HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"other"')
+
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect', MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_accel_redirect_offload(self):
+        '''test nginx offload sends no body'''
+        res = self.client.get(media_url(f'recipe/{DIGEST}.jpg'))
+
+        self.assertEqual(res['X-Accel-Redirect'], f'/protected-media/recipe/{DIGEST}.jpg')
+        self.assertEqual(res.content, b'')
+
+    def test_path_traversal_not_found(self):
+        '''test paths outside MEDIA_ROOT are not served'''
+        res = self.client.get(media_url('../app/settings.py'))
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_missing_file_not_found(self):
+        '''test a missing file returns 404'''
+        res = self.client.get(media_url('recipe/missing.jpg'))
+
+        self.assertEqual(res.status_code, 404)
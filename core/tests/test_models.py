@@ -65,3 +65,18 @@ class ModelTests(TestCase):
         )
 
         self.assertEqual(str(recipe), recipe.title)
+
+    def test_deleting_tag_updates_recipe_summary(self):
+        '''test recipe summary columns follow tag deletes and reverse adds'''
+        user = create_user(email='test@example.com', password='testpass123', name='test')
+        recipe = Recipe.objects.create(user=user, title='test recipe', time_minutes=5, price=Decimal('5.5'))
+        tag = Tag.objects.create(user=user, name='test')
+        tag.recipe_set.add(recipe)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.tag_ids, [tag.id])
+
+        tag.delete()
+        recipe.refresh_from_db()
+
+        self.assertEqual(recipe.tag_count, 0)
+        self.assertEqual(recipe.tag_ids, [])
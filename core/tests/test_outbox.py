@@ -0,0 +1,159 @@
+'''
+tests for the recipe change outbox and its dispatcher
+'''
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from ..models import Recipe, OutboxEvent, OutboxCursor
+from recipe import outbox
+
+RECIPE_URL = reverse('recipe:recipe-list')
+
+received = []
+
+
+def collect(events):
+    '''in-process handler used by the tests'''
+    received.extend(events)
+
+
+def create_user(**params):
+    '''create and return a new user'''
+    defaults = {
+        'email': 'test@example.com',
+        'password': 'testpass123',
+        'name': 'test',
+    }
+    defaults.update(params)
+
+    return get_user_model().objects.create_user(**defaults)
+
+
+class FailingSink(outbox.Sink):
+    def deliver(self, events):
+        raise ConnectionError('down')
+
+
+@override_settings(OUTBOX_SETTLE_SECONDS=0)
+class OutboxTests(TestCase):
+    '''test events are written with changes and delivered'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        received.clear()
+
+    def test_changes_write_events(self):
+        '''test creating, updating and deleting a recipe each add an event'''
+        res = self.client.post(RECIPE_URL, {'title': 'test', 'time_minutes': 5, 'price': '5.00'})
+        url = reverse('recipe:recipe-detail', args=[res.data['id']])
+        self.client.patch(url, {'title': 'new title'})
+        self.client.delete(url)
+
+        events = [outbox.event_data(event) for event in OutboxEvent.objects.order_by('id')]
+        self.assertEqual([event['type'] for event in events], ['recipe.changed', 'recipe.changed', 'recipe.deleted'])
+        self.assertTrue(all(event['entity_id'] == res.data['id'] for event in events))
+        self.assertTrue(all(event['user_id'] == self.user.id for event in events))
+
+    def test_dispatch_advances_cursor(self):
+        '''test events are delivered in order and only once per sink'''
+        for i in range(3):
+            Recipe.objects.create(user=self.user, title=f'r{i}', time_minutes=5, price=Decimal('5.00'))
+        sink = outbox.HandlerSink('test', handlers=['core.tests.test_outbox.collect'])
+
+        self.assertEqual(outbox.dispatch(sink, batch_size=2), 2)
+        self.assertEqual(outbox.dispatch(sink, batch_size=2), 1)
+        self.assertEqual(outbox.dispatch(sink, batch_size=2), 0)
+
+        ids = [event['id'] for event in received]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(OutboxCursor.objects.get(sink='test').position, ids[-1])
+
+    def test_failed_delivery_is_retried(self):
+        '''test the cursor doesn't move when the sink fails'''
+        Recipe.objects.create(user=self.user, title='r', time_minutes=5, price=Decimal('5.00'))
+
+        with self.assertRaises(ConnectionError):
+            outbox.dispatch(FailingSink('test'))
+
+        self.assertEqual(OutboxCursor.objects.get(sink='test').position, 0)
+        sink = outbox.HandlerSink('test', handlers=[collect])
+        self.assertEqual(outbox.dispatch(sink), 1)
+
+    @override_settings(OUTBOX_SETTLE_SECONDS=60)
+    def test_recent_events_wait(self):
+        '''test events younger than the settle time are not delivered yet'''
+        Recipe.objects.create(user=self.user, title='r', time_minutes=5, price=Decimal('5.00'))
+        sink = outbox.HandlerSink('test', handlers=[collect])
+
+        self.assertEqual(outbox.dispatch(sink), 0)
+        OutboxEvent.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(outbox.dispatch(sink), 1)
+
+    def test_account_deletion_writes_events(self):
+        '''test deleting an account still tells consumers its recipes are gone'''
+        recipe = Recipe.objects.create(user=self.user, title='r', time_minutes=5, price=Decimal('5.00'))
+        OutboxEvent.objects.all().delete()
+
+        self.user.delete()
+
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.entity_type, event.entity_id, event.deleted), ('recipe', recipe.id, True))
+
+
+@override_settings(OUTBOX_SETTLE_SECONDS=0)
+class DispatchOutboxCommandTests(TestCase):
+    '''test the dispatch_outbox command'''
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'events.jsonl')
+        self.user = create_user()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def sinks(self):
+        return {'file': {'BACKEND': 'recipe.outbox.FileSink', 'OPTIONS': {'path': self.path}}}
+
+    def test_delivers_to_file_and_prunes(self):
+        '''test events are appended as JSON lines and pruned once delivered'''
+        recipe = Recipe.objects.create(user=self.user, title='r', time_minutes=5, price=Decimal('5.00'))
+
+        with override_settings(OUTBOX_SINKS=self.sinks()):
+            out = StringIO()
+            call_command('dispatch_outbox', '--once', '--prune', stdout=out)
+
+        with open(self.path) as f:
+            events = [json.loads(line) for line in f]
+        self.assertEqual([(e['type'], e['entity_id']) for e in events], [('recipe.changed', recipe.id)])
+        self.assertIn('delivered 1 events', out.getvalue())
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_failure_reported(self):
+        '''test a failing sink makes the command fail without losing events'''
+        Recipe.objects.create(user=self.user, title='r', time_minutes=5, price=Decimal('5.00'))
+        sinks = {'down': {'BACKEND': 'core.tests.test_outbox.FailingSink'}}
+
+        with override_settings(OUTBOX_SINKS=sinks), self.assertRaises(CommandError):
+            call_command('dispatch_outbox', '--once', '--prune', stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+
+    def test_no_sinks(self):
+        '''test the command refuses to run without sinks'''
+        with override_settings(OUTBOX_SINKS={}), self.assertRaises(CommandError):
+            call_command('dispatch_outbox', '--once')
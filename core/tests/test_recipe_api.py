@@ -1,14 +1,24 @@
 '''
 tests for recipe APIs
 '''
+import os
+import shutil
+import tempfile
+import time
 from decimal import Decimal
-from django.test import TestCase
+from io import BytesIO
+from PIL import Image
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
-from ..models import Recipe, Ingredient, Tag
+from ..models import Recipe, Ingredient, Tag, RecipeIngredient
+from ..signals import release_image
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
-from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe.serializers import RecipeSerializer, RecipeDetailSerializer, RecipeImageSerializer, PreconditionFailed
 
 RECIPE_URL = reverse('recipe:recipe-list')
 
@@ -18,6 +28,16 @@ def detail_url(recipe_id):
     return reverse('recipe:recipe-detail', args=[recipe_id])
 
 
+def duplicate_url(recipe_id):
+    '''create and return a recipe duplicate URL'''
+    return reverse('recipe:recipe-duplicate', args=[recipe_id])
+
+
+def image_upload_url(recipe_id):
+    '''create and return an image upload URL'''
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
 def create_user(**params):
     '''create and return a new user'''
     defaults = {
@@ -179,6 +199,127 @@ class PrivateRecipeAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
         self.assertTrue(Recipe.objects.filter(id=recipe.id).exists())
 
+    def test_update_increments_version(self):
+        '''test each update bumps the version and returns it as the ETag'''
+        recipe = create_recipe(user=self.user)
+        res = self.client.get(detail_url(recipe.id))
+        self.assertEqual(res['ETag'], '"1"')
+
+        res = self.client.patch(detail_url(recipe.id), {'title': 'new title'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['version'], 2)
+        self.assertEqual(res['ETag'], '"2"')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.version, 2)
+
+    def test_update_with_matching_if_match(self):
+        '''test an update naming the current version is applied'''
+        recipe = create_recipe(user=self.user)
+        res = self.client.patch(detail_url(recipe.id), {'title': 'new title'}, HTTP_IF_MATCH='W/"1"')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'new title')
+
+    def test_update_with_stale_if_match(self):
+        '''test an update based on an outdated read fails without writing'''
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='test1'))
+        self.client.patch(detail_url(recipe.id), {'title': 'first'}, HTTP_IF_MATCH='"1"')
+
+        res = self.client.patch(
+            detail_url(recipe.id), {'title': 'second', 'tags': []}, format='json', HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'first')
+        self.assertEqual(recipe.version, 2)
+        self.assertEqual(recipe.tags.count(), 1)
+
+    def test_update_changed_after_read(self):
+        '''test a write committed between reading and updating wins'''
+        recipe = create_recipe(user=self.user)
+        Recipe.objects.filter(id=recipe.id).update(title='elsewhere', version=2)
+        serializer = RecipeSerializer(recipe, data={'title': 'here'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+
+        with self.assertRaises(PreconditionFailed):
+            serializer.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'elsewhere')
+
+    def test_delete_with_stale_if_match(self):
+        '''test deleting a recipe changed since it was read fails'''
+        recipe = create_recipe(user=self.user)
+        res = self.client.delete(detail_url(recipe.id), HTTP_IF_MATCH='"0"')
+
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertTrue(Recipe.objects.filter(id=recipe.id).exists())
+
+    def test_tag_changes_move_recipe_version(self):
+        '''test renaming, merging and deleting a recipe's tags invalidate its ETag'''
+        recipe = create_recipe(user=self.user)
+        tag = Tag.objects.create(user=self.user, name='test1')
+        other = Tag.objects.create(user=self.user, name='test2')
+        recipe.tags.add(tag)
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+
+        self.client.patch(reverse('recipe:tag-detail', args=[tag.id]), {'name': 'renamed'})
+        res = self.client.patch(detail_url(recipe.id), {'title': 'new'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+        self.client.post(reverse('recipe:tag-merge'), {'sources': [tag.id], 'target': other.id}, format='json')
+        res = self.client.patch(detail_url(recipe.id), {'title': 'new'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+        self.client.delete(reverse('recipe:tag-detail', args=[other.id]))
+        res = self.client.patch(detail_url(recipe.id), {'title': 'new'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_duplicate_recipe(self):
+        '''test copies get the recipe's fields, tags and ingredient amounts'''
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='test1'))
+        recipe.ingredients.add(
+            Ingredient.objects.create(user=self.user, name='salt'), through_defaults={'quantity': Decimal('2'), 'unit': 'g'})
+        res = self.client.post(duplicate_url(recipe.id), {'copies': 2, 'title': 'copy'}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 2)
+        for data in res.data:
+            copy = Recipe.objects.get(id=data['id'])
+            self.assertEqual((copy.title, copy.price, copy.user), ('copy', recipe.price, self.user))
+            self.assertEqual(copy.tag_ids, recipe.tag_ids)
+            link = RecipeIngredient.objects.get(recipe=copy)
+            self.assertEqual((link.quantity, link.unit), (Decimal('2.00'), 'g'))
+            self.assertEqual(data['ingredients'][0]['name'], 'salt')
+
+    def test_duplicate_queries_constant(self):
+        '''test copying doesn't query per copy, tag or ingredient'''
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(*[Tag.objects.create(user=self.user, name=f'tag{i}') for i in range(5)])
+        recipe.ingredients.add(*[Ingredient.objects.create(user=self.user, name=f'ingr{i}') for i in range(5)])
+        # queues the stats refresh, later copies find it queued
+        self.client.post(duplicate_url(recipe.id), format='json')
+
+        queries = []
+        for copies in (1, 10):
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.post(duplicate_url(recipe.id), {'copies': copies}, format='json')
+            queries.append(len(ctx))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_duplicate_other_users_recipe(self):
+        '''test another user's recipe can't be copied'''
+        recipe = create_recipe(user=create_user(email='test2@example.com', name='test2'))
+        res = self.client.post(duplicate_url(recipe.id), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Recipe.objects.count(), 1)
+
     def test_create_recipe_with_new_tags(self):
         '''test creating a recipe with new tags'''
         payload = {
@@ -223,6 +364,24 @@ class PrivateRecipeAPITests(TestCase):
             exists = recipe.tags.filter(name=tag['name'], user=self.user).exists()
             self.assertTrue(exists)
 
+    def test_create_recipe_matches_tags_case_insensitively(self):
+        '''test tag names differing only by case or whitespace reuse one tag'''
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        payload = {
+            'title': 'test recipe',
+            'time_minutes': 10,
+            'price': Decimal('5.5'),
+            'tags': [{'name': 'vegan '}, {'name': 'VEGAN'}],
+            'ingredients': [{'name': 'Salt'}, {'name': ' salt'}],
+        }
+        res = self.client.post(RECIPE_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(list(recipe.tags.all()), [tag])
+        self.assertEqual(recipe.ingredients.count(), 1)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
     def test_update_recipe_tags(self):
         '''test creating tag when updating a recipe'''
         recipe = create_recipe(user=self.user)
@@ -266,3 +425,257 @@ class PrivateRecipeAPITests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(recipe.tags.count(), 0)
+
+    def test_summary_columns_maintained(self):
+        '''test tag and ingredient counts are kept on create and update'''
+        payload = {
+            'title': 'test recipe',
+            'time_minutes': 10,
+            'price': Decimal('5.5'),
+            'tags': [{'name': 'test1'}, {'name': 'test2'}],
+            'ingredients': [{'name': 'salt'}],
+        }
+        res = self.client.post(RECIPE_URL, payload, format='json')
+        recipe = Recipe.objects.get(id=res.data['id'])
+
+        self.assertEqual(recipe.tag_count, 2)
+        self.assertEqual(recipe.ingredient_count, 1)
+        self.assertEqual(recipe.tag_ids, sorted(recipe.tags.values_list('id', flat=True)))
+
+        res = self.client.patch(detail_url(recipe.id), {'tags': [{'name': 'test1'}]}, format='json')
+        recipe.refresh_from_db()
+
+        self.assertEqual(recipe.tag_count, 1)
+        self.assertEqual(recipe.ingredient_count, 1)
+
+    def test_filter_by_min_ingredients(self):
+        '''test filtering recipes by number of ingredients'''
+        r1 = create_recipe(user=self.user, title='one')
+        r2 = create_recipe(user=self.user, title='two')
+        r1.ingredients.add(Ingredient.objects.create(user=self.user, name='salt'))
+        r2.ingredients.add(*[Ingredient.objects.create(user=self.user, name=name) for name in ['a', 'b']])
+        res = self.client.get(RECIPE_URL, {'min_ingredients': 2})
+
+        self.assertEqual([r['id'] for r in res.data], [r2.id])
+
+    def test_order_by_tag_count(self):
+        '''test ordering recipes by number of tags'''
+        r1 = create_recipe(user=self.user, title='one')
+        r2 = create_recipe(user=self.user, title='two')
+        r3 = create_recipe(user=self.user, title='three')
+        r1.tags.add(*[Tag.objects.create(user=self.user, name=name) for name in ['a', 'b']])
+        r3.tags.add(Tag.objects.create(user=self.user, name='c'))
+        res = self.client.get(RECIPE_URL, {'ordering': '-tag_count'})
+
+        self.assertEqual([r['id'] for r in res.data], [r1.id, r3.id, r2.id])
+
+    def test_invalid_ordering_error(self):
+        '''test ordering by a field that is not allowed returns an error'''
+        res = self.client.get(RECIPE_URL, {'ordering': 'description'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_by_time_and_price_range(self):
+        '''test filtering recipes by max time and price range'''
+        r1 = create_recipe(user=self.user, time_minutes=10, price=Decimal('5.00'))
+        create_recipe(user=self.user, time_minutes=60, price=Decimal('5.00'))
+        create_recipe(user=self.user, time_minutes=10, price=Decimal('20.00'))
+        res = self.client.get(RECIPE_URL, {'max_time': 30, 'min_price': '1', 'max_price': '10.50'})
+
+        self.assertEqual([r['id'] for r in res.data], [r1.id])
+
+    def test_invalid_range_filter_error(self):
+        '''test a non numeric range filter returns an error'''
+        res = self.client.get(RECIPE_URL, {'min_price': 'cheap'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_out_of_range_filter_error(self):
+        '''test non finite prices and integers too large for the column return an error'''
+        params = [{'min_price': 'NaN'}, {'max_price': 'Infinity'}, {'max_time': '9' * 23}, {'min_tags': str(-2 ** 64)}]
+        for param in params:
+            res = self.client.get(RECIPE_URL, param)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, param)
+
+    def test_keyset_pagination_by_price(self):
+        '''test paging through recipes ordered by price with a cursor'''
+        recipes = [create_recipe(user=self.user, price=Decimal(price)) for price in ['3', '1', '2', '5', '4']]
+        res = self.client.get(RECIPE_URL, {'ordering': 'price', 'page_size': 2})
+        seen = [r['id'] for r in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            seen += [r['id'] for r in res.data['results']]
+
+        expected = [r.id for r in sorted(recipes, key=lambda r: r.price)]
+        self.assertEqual(seen, expected)
+
+    def test_pagination_through_many_ties(self):
+        '''test more recipes sharing a price than DRF's offset cutoff are each returned once'''
+        Recipe.objects.bulk_create([
+            Recipe(user=self.user, title=f'r{i}', time_minutes=5, price=Decimal('5.00')) for i in range(1300)
+        ])
+        create_recipe(user=self.user, price=Decimal('1.00'))
+        res = self.client.get(RECIPE_URL, {'ordering': '-price', 'page_size': 100})
+        pages = [[r['id'] for r in res.data['results']]]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            pages.append([r['id'] for r in res.data['results']])
+        seen = [pk for page in pages for pk in page]
+
+        self.assertEqual(len(pages), 14)
+        self.assertEqual(seen, list(Recipe.objects.order_by('-price', '-id').values_list('id', flat=True)))
+        res = self.client.get(res.data['previous'])
+        self.assertEqual([r['id'] for r in res.data['results']], pages[-2])
+
+    def test_invalid_cursor(self):
+        '''test a cursor that doesn't decode to the ordering's values is rejected'''
+        res = self.client.get(RECIPE_URL, {'ordering': 'price', 'page_size': 2, 'cursor': 'cD1hYmMmcD0x'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_RELEASE_GRACE_SECONDS=0)
+class ImageUploadTests(TestCase):
+    '''test image upload API'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def _upload(self, recipe, color='red', **extra):
+        with tempfile.NamedTemporaryFile(suffix='.JPG') as image_file:
+            Image.new('RGB', (10, 10), color=color).save(image_file, format='JPEG')
+            image_file.seek(0)
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.post(image_upload_url(recipe.id), {'image': image_file}, format='multipart', **extra)
+
+    def test_upload_image(self):
+        '''test uploading an image to a recipe'''
+        res = self._upload(self.recipe)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('image', res.data)
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+        self.assertRegex(self.recipe.image.name, r'^recipe/[0-9a-f]{64}\.jpg$')
+
+    def test_upload_image_moves_version(self):
+        '''test a write based on the recipe as read before an image upload fails'''
+        etag = self.client.get(detail_url(self.recipe.id))['ETag']
+        self._upload(self.recipe)
+
+        res = self.client.patch(detail_url(self.recipe.id), {'title': 'new'}, HTTP_IF_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_upload_image_with_stale_if_match(self):
+        '''test uploading to a recipe changed since it was read fails'''
+        etag = self.client.get(detail_url(self.recipe.id))['ETag']
+        self.client.patch(detail_url(self.recipe.id), {'title': 'new'})
+
+        res = self._upload(self.recipe, HTTP_IF_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    def test_upload_image_keeps_concurrent_write(self):
+        '''test an upload racing another write doesn't save the recipe as it was read'''
+        Recipe.objects.filter(id=self.recipe.id).update(title='elsewhere', version=2)
+        content = BytesIO()
+        Image.new('RGB', (10, 10)).save(content, format='JPEG')
+        image = SimpleUploadedFile('test.jpg', content.getvalue(), content_type='image/jpeg')
+        serializer = RecipeImageSerializer(self.recipe, data={'image': image})
+        serializer.is_valid(raise_exception=True)
+
+        with self.assertRaises(PreconditionFailed):
+            serializer.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual((self.recipe.title, self.recipe.version), ('elsewhere', 2))
+
+    def test_upload_image_bad_request(self):
+        '''test uploading an invalid image'''
+        res = self.client.post(image_upload_url(self.recipe.id), {'image': 'notanimage'}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(FILE_UPLOAD_PERMISSIONS=None)
+    def test_uploaded_image_readable(self):
+        '''test the stored file gets the upload mode, not mkstemp's 0600'''
+        self._upload(self.recipe)
+        self.recipe.refresh_from_db()
+
+        self.assertEqual(os.stat(self.recipe.image.path).st_mode & 0o777, 0o644)
+
+    def test_same_image_stored_once(self):
+        '''test uploading identical content to two recipes shares one file'''
+        other = create_recipe(user=self.user)
+        self._upload(self.recipe)
+        self._upload(other)
+
+        self.recipe.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.recipe.image.name, other.image.name)
+
+    def test_replaced_image_deleted_when_unreferenced(self):
+        '''test the old file is removed when the image is replaced'''
+        self._upload(self.recipe, color='red')
+        self.recipe.refresh_from_db()
+        old_path = self.recipe.image.path
+        self._upload(self.recipe, color='blue')
+
+        self.assertFalse(os.path.exists(old_path))
+
+    @override_settings(MEDIA_RELEASE_GRACE_SECONDS=60)
+    def test_recently_touched_image_left_for_gc(self):
+        '''test an unreferenced file touched within the grace window is kept'''
+        self._upload(self.recipe, color='red')
+        self.recipe.refresh_from_db()
+        old_name, old_path = self.recipe.image.name, self.recipe.image.path
+        self._upload(self.recipe, color='blue')
+        self.assertTrue(os.path.exists(old_path))
+
+        mtime = time.time() - 120
+        os.utime(old_path, (mtime, mtime))
+        release_image(old_name)
+        self.assertFalse(os.path.exists(old_path))
+
+    def test_shared_image_kept_until_last_recipe_deleted(self):
+        '''test a shared file survives until no recipe references it'''
+        other = create_recipe(user=self.user)
+        self._upload(self.recipe)
+        self._upload(other)
+        self.recipe.refresh_from_db()
+        other.refresh_from_db()
+        path = self.recipe.image.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_duplicate_shares_image(self):
+        '''test a copy references the same file, kept while either recipe uses it'''
+        self._upload(self.recipe)
+        res = self.client.post(duplicate_url(self.recipe.id), format='json')
+        self.recipe.refresh_from_db()
+        copy = Recipe.objects.get(id=res.data[0]['id'])
+
+        self.assertEqual(copy.image.name, self.recipe.image.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+        self.assertTrue(os.path.exists(copy.image.path))
@@ -0,0 +1,87 @@
+'''
+tests for the prebuilt OpenAPI schema
+'''
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from core import schema
+
+SCHEMA_URL = reverse('api_schema')
+
+
+class SchemaServingTests(TestCase):
+    '''test serving the schema artefact'''
+
+    def setUp(self):
+        self.artefact_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(SCHEMA_ARTEFACT_DIR=self.artefact_dir, CODE_VERSION='test')
+        self.settings_override.enable()
+        schema.clear()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        schema.clear()
+        shutil.rmtree(self.artefact_dir, ignore_errors=True)
+
+    def test_build_schema_command(self):
+        '''test the command writes the artefact for the code version'''
+        call_command('build_schema', stdout=StringIO())
+
+        with open(os.path.join(self.artefact_dir, 'openapi-test.json')) as f:
+            self.assertIn('/api/recipe/recipes/', json.load(f)['paths'])
+
+    def test_schema_generated_once(self):
+        '''test the schema is generated on first use and then served from memory'''
+        with patch('core.schema.generate_schema', wraps=schema.generate_schema) as generate:
+            first = self.client.get(SCHEMA_URL)
+            second = self.client.get(SCHEMA_URL, {'format': 'json'})
+            self.client.get(SCHEMA_URL)
+
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn(b'openapi: 3', first.content)
+        self.assertIn('/api/recipe/recipes/', json.loads(second.content)['paths'])
+
+    def test_prebuilt_artefact_used(self):
+        '''test an artefact written by a deploy step is served without generating'''
+        with open(os.path.join(self.artefact_dir, 'openapi-test.json'), 'w') as f:
+            json.dump({'openapi': '3.0.3', 'paths': {'/prebuilt/': {}}}, f)
+        with patch('core.schema.generate_schema') as generate:
+            res = self.client.get(SCHEMA_URL, {'format': 'json'})
+
+        generate.assert_not_called()
+        self.assertEqual(json.loads(res.content)['paths'], {'/prebuilt/': {}})
+
+    def test_new_code_version_regenerates(self):
+        '''test an artefact of another code version is ignored'''
+        with open(os.path.join(self.artefact_dir, 'openapi-old.json'), 'w') as f:
+            json.dump({'openapi': '3.0.3', 'paths': {'/stale/': {}}}, f)
+        res = self.client.get(SCHEMA_URL, {'format': 'json'})
+
+        self.assertNotIn('/stale/', json.loads(res.content)['paths'])
+
+    def test_etag_and_gzip(self):
+        '''test conditional requests and gzip encoding'''
+        plain = self.client.get(SCHEMA_URL)
+        compressed = self.client.get(SCHEMA_URL, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        not_modified = self.client.get(SCHEMA_URL, HTTP_IF_NONE_MATCH=plain['ETag'])
+
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertNotEqual(compressed['ETag'], plain['ETag'])
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_docs_use_cached_schema(self):
+        '''test the swagger UI loads the schema from the cached endpoint'''
+        res = self.client.get(reverse('api_docs'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(SCHEMA_URL.encode(), res.content)
@@ -0,0 +1,81 @@
+'''
+tests for the shopping list API
+'''
+from decimal import Decimal
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+from ..models import Recipe, Ingredient, RecipeIngredient
+
+SHOPPING_LIST_URL = reverse('recipe:recipe-shopping-list')
+RECIPE_URL = reverse('recipe:recipe-list')
+
+
+def create_user(**params):
+    '''create and return a new user'''
+    defaults = {
+        'email': 'test@example.com',
+        'password': 'testpass123',
+        'name': 'test',
+    }
+    defaults.update(params)
+
+    return get_user_model().objects.create_user(**defaults)
+
+
+class ShoppingListAPITests(TestCase):
+    '''test the shopping list action'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def _create_recipe(self, ingredients):
+        payload = {'title': 'test recipe', 'time_minutes': 10, 'price': Decimal('5.5'), 'ingredients': ingredients}
+        res = self.client.post(RECIPE_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id']
+
+    def test_create_recipe_with_amounts(self):
+        '''test ingredient quantities and units are stored on the through rows and returned'''
+        recipe_id = self._create_recipe([{'name': 'flour', 'quantity': '250', 'unit': 'g'}, {'name': 'salt'}])
+        links = RecipeIngredient.objects.filter(recipe_id=recipe_id).order_by('ingredient__name')
+
+        self.assertEqual([(link.quantity, link.unit) for link in links], [(Decimal('250'), 'g'), (None, '')])
+        res = self.client.get(reverse('recipe:recipe-detail', args=[recipe_id]))
+        self.assertEqual(res.data['ingredients'][0]['quantity'], '250.00')
+        self.assertEqual(res.data['ingredients'][0]['unit'], 'g')
+
+    def test_shopping_list_sums_quantities(self):
+        '''test ingredients are combined across recipes, per unit'''
+        first = self._create_recipe([{'name': 'Flour', 'quantity': '250', 'unit': 'g'}, {'name': 'egg', 'quantity': '2'}])
+        second = self._create_recipe([{'name': 'flour ', 'quantity': '100.5', 'unit': 'g'}, {'name': 'egg'}])
+        third = self._create_recipe([{'name': 'flour', 'quantity': '1', 'unit': 'cup'}])
+        res = self.client.post(SHOPPING_LIST_URL, {'recipes': [first, second, third]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        items = [(i['name'], i['quantity'], i['unit'], i['unmeasured'], i['recipes']) for i in res.data]
+        self.assertEqual(items, [
+            ('egg', '2.00', '', 1, [first, second]),
+            ('Flour', '1.00', 'cup', 0, [third]),
+            ('Flour', '350.50', 'g', 0, [first, second]),
+        ])
+
+    def test_shopping_list_limited_to_user(self):
+        '''test other users' recipes are left out'''
+        mine = self._create_recipe([{'name': 'salt'}])
+        other = create_user(email='test2@example.com', name='test2')
+        theirs = Recipe.objects.create(user=other, title='theirs', time_minutes=5, price=Decimal('1'))
+        theirs.ingredients.add(Ingredient.objects.create(user=other, name='pepper'))
+        res = self.client.post(SHOPPING_LIST_URL, {'recipes': [mine, theirs.id]}, format='json')
+
+        self.assertEqual([i['name'] for i in res.data], ['salt'])
+
+    def test_shopping_list_validates_recipes(self):
+        '''test an empty or oversized recipe list is rejected'''
+        for recipes in ([], list(range(1, 52))):
+            res = self.client.post(SHOPPING_LIST_URL, {'recipes': recipes}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
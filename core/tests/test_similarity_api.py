@@ -0,0 +1,108 @@
+'''
+tests for the related recipes API
+'''
+from decimal import Decimal
+from unittest.mock import patch
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+from recipe import similarity
+from ..models import Recipe, Tag, Ingredient
+
+RECIPE_URL = reverse('recipe:recipe-list')
+
+
+def similar_url(recipe_id):
+    '''create and return a related recipes URL'''
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+def detail_url(recipe_id):
+    '''create and return a recipe detail URL'''
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def create_user(**params):
+    '''create and return a new user'''
+    defaults = {
+        'email': 'test@example.com',
+        'password': 'testpass123',
+        'name': 'test',
+    }
+    defaults.update(params)
+
+    return get_user_model().objects.create_user(**defaults)
+
+
+class SimilarRecipeAPITests(TestCase):
+    '''test the similar recipes action'''
+
+    def setUp(self):
+        # ids are reused between tests, so start from empty indexes
+        similarity.clear()
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        self.salt = Ingredient.objects.create(user=self.user, name='salt')
+        self.egg = Ingredient.objects.create(user=self.user, name='egg')
+        self.vegan = Tag.objects.create(user=self.user, name='vegan')
+
+    def _create_recipe(self, user=None, tags=(), ingredients=()):
+        recipe = Recipe.objects.create(user=user or self.user, title='test recipe', time_minutes=10, price=Decimal('5.5'))
+        recipe.tags.add(*tags)
+        recipe.ingredients.add(*ingredients)
+        return recipe
+
+    def test_similar_ranked_by_overlap(self):
+        '''test recipes are ranked by shared tags and ingredients, excluding unrelated ones'''
+        recipe = self._create_recipe(tags=[self.vegan], ingredients=[self.salt, self.egg])
+        close = self._create_recipe(tags=[self.vegan], ingredients=[self.salt, self.egg])
+        far = self._create_recipe(ingredients=[self.salt])
+        self._create_recipe(tags=[Tag.objects.create(user=self.user, name='other')])
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data], [close.id, far.id])
+        self.assertEqual(res.data[0]['similarity'], 1.0)
+        self.assertAlmostEqual(res.data[1]['similarity'], 1 / 3, places=3)
+
+    def test_similar_follows_updates(self):
+        '''test membership changes after the index is built are picked up'''
+        recipe = self._create_recipe(ingredients=[self.salt])
+        other = self._create_recipe(ingredients=[self.egg])
+        self.assertEqual(self.client.get(similar_url(recipe.id)).data, [])
+
+        self.client.patch(detail_url(other.id), {'ingredients': [{'name': 'salt'}]}, format='json')
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual([r['id'] for r in res.data], [other.id])
+
+        self.client.delete(detail_url(other.id))
+        self.assertEqual(self.client.get(similar_url(recipe.id)).data, [])
+
+    def test_similar_limited_to_user(self):
+        '''test other users' recipes are never suggested, nor their recipes looked up'''
+        recipe = self._create_recipe(ingredients=[self.salt])
+        other_user = create_user(email='test2@example.com', name='test2')
+        theirs = self._create_recipe(user=other_user, ingredients=[Ingredient.objects.create(user=other_user, name='salt')])
+
+        self.assertEqual(self.client.get(similar_url(recipe.id)).data, [])
+        self.assertEqual(self.client.get(similar_url(theirs.id)).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_index_built_outside_the_global_lock(self):
+        '''test building one user's index doesn't hold up other users' lookups'''
+        recipe = self._create_recipe(tags=[self.vegan])
+        build = similarity._build
+        held = []
+
+        def tracking_build(user_id):
+            held.append(similarity._lock.locked())
+            return build(user_id)
+
+        with patch('recipe.similarity._build', side_effect=tracking_build):
+            res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(held, [False])
@@ -0,0 +1,113 @@
+'''
+tests for the recipe snapshot API
+'''
+from decimal import Decimal
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+from ..models import Recipe, Ingredient, Tag
+from recipe.snapshot import _cache_key
+
+SNAPSHOT_URL = reverse('recipe:snapshot')
+RECIPE_URL = reverse('recipe:recipe-list')
+
+
+def create_user(**params):
+    '''create and return a new user'''
+    defaults = {
+        'email': 'test@example.com',
+        'password': 'testpass123',
+        'name': 'test',
+    }
+    defaults.update(params)
+
+    return get_user_model().objects.create_user(**defaults)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class SnapshotAPITests(TestCase):
+    '''test the snapshot endpoint'''
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def _create_recipe(self, **params):
+        payload = {'title': 'test recipe', 'time_minutes': 10, 'price': Decimal('5.5')}
+        payload.update(params)
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(RECIPE_URL, payload, format='json')
+        return res.data['id']
+
+    def test_auth_required(self):
+        '''test auth is required'''
+        res = APIClient().get(SNAPSHOT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_snapshot_is_normalized(self):
+        '''test recipes refer to tags and ingredients by id'''
+        recipe_id = self._create_recipe(tags=[{'name': 'vegan'}], ingredients=[{'name': 'salt'}])
+        create_user(email='test2@example.com', name='test2')
+        res = self.client.get(SNAPSHOT_URL)
+
+        tag = Tag.objects.get(user=self.user)
+        ingredient = Ingredient.objects.get(user=self.user)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['tags'], {str(tag.id): {'id': tag.id, 'name': 'vegan'}})
+        self.assertEqual(res.data['ingredients'], {str(ingredient.id): {'id': ingredient.id, 'name': 'salt'}})
+        recipe = res.data['recipes'][str(recipe_id)]
+        self.assertEqual(recipe['tags'], [tag.id])
+        self.assertEqual(recipe['ingredients'], [ingredient.id])
+        self.assertEqual(recipe['price'], '5.50')
+
+    def test_snapshot_catches_up_on_read(self):
+        '''test writes after the snapshot is cached are reflected without a rebuild'''
+        recipe_id = self._create_recipe(tags=[{'name': 'vegan'}])
+        self.client.get(SNAPSHOT_URL)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('recipe:recipe-detail', args=[recipe_id]),
+                              {'title': 'new title', 'tags': [{'name': 'quick'}]}, format='json')
+        new_id = self._create_recipe(title='second')
+        tag = Tag.objects.get(name='vegan')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('recipe:tag-detail', args=[tag.id]))
+
+        res = self.client.get(SNAPSHOT_URL)
+        quick = Tag.objects.get(name='quick')
+        self.assertEqual(res.data['recipes'][str(recipe_id)]['title'], 'new title')
+        self.assertEqual(res.data['recipes'][str(recipe_id)]['tags'], [quick.id])
+        self.assertIn(str(new_id), res.data['recipes'])
+        self.assertNotIn(str(tag.id), res.data['tags'])
+        # caught up: the change log query is all that is left
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(SNAPSHOT_URL).data, res.data)
+
+    def test_stale_copy_catches_up(self):
+        '''test a worker still holding a copy from before a write serves the write'''
+        recipe_id = self._create_recipe()
+        self.client.get(SNAPSHOT_URL)
+        stale = cache.get(_cache_key(self.user.id))
+
+        self.client.patch(reverse('recipe:recipe-detail', args=[recipe_id]), {'title': 'new title'})
+        cache.set(_cache_key(self.user.id), stale)
+        res = self.client.get(SNAPSHOT_URL)
+
+        self.assertEqual(res.data['recipes'][str(recipe_id)]['title'], 'new title')
+
+    def test_deleted_recipe_removed(self):
+        '''test deleting a recipe removes it from the snapshot'''
+        recipe_id = self._create_recipe()
+        self.client.get(SNAPSHOT_URL)
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(id=recipe_id).delete()
+
+        res = self.client.get(SNAPSHOT_URL)
+
+        self.assertEqual(res.data['recipes'], {})
@@ -0,0 +1,53 @@
+'''
+tests for worker startup helpers
+'''
+import sys
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from app import startup
+from core.management.commands.startup_report import parse_importtime
+
+IMPORTTIME = '''import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     yaml.error
+import time:       500 |        620 |   yaml
+import time:      1000 |       1620 | app.wsgi
+'''
+
+
+class StartupTests(TestCase):
+    '''test preload and startup reporting'''
+
+    def test_warmup(self):
+        '''test the warmup loads the URLconf and serializers and connects'''
+        timings = startup.warmup()
+
+        self.assertEqual(set(timings), {'urls', 'serializers', 'database'})
+        self.assertIn('recipe.serializers', sys.modules)
+
+    def test_warm_serializers(self):
+        '''test every view serializer is built'''
+        count = startup.warm_serializers(startup.warm_urls())
+
+        self.assertGreater(count, 3)
+
+    @override_settings(PRELOAD=False)
+    def test_ready_without_preload(self):
+        '''test only the setup time is reported when preload is off'''
+        with self.assertLogs('app.startup', 'INFO') as logs:
+            total, timings = startup.ready(0, 0)
+
+        self.assertEqual(set(timings), {'setup'})
+        self.assertIn('worker ready', logs.output[0])
+
+    def test_lazy_admin_urls(self):
+        '''test the admin URLconf resolves and reverses after being built lazily'''
+        url = reverse('admin:core_recipe_changelist')
+
+        self.assertEqual(url, '/admin/core/recipe/')
+        self.assertEqual(self.client.get(url).status_code, 302)  # to the login page
+
+    def test_parse_importtime(self):
+        '''test python -X importtime output is parsed with nesting depth'''
+        rows = parse_importtime(IMPORTTIME)
+
+        self.assertEqual(rows, [('yaml.error', 120, 120, 2), ('yaml', 500, 620, 1), ('app.wsgi', 1000, 1620, 0)])
@@ -0,0 +1,83 @@
+'''
+tests for the recipe statistics API
+'''
+from decimal import Decimal
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework import status
+from ..models import Recipe, Tag, RecipeStats
+
+STATS_URL = reverse('recipe:recipe-stats')
+
+
+def create_user(**params):
+    '''create and return a new user'''
+    defaults = {
+        'email': 'test@example.com',
+        'password': 'testpass123',
+        'name': 'test',
+    }
+    defaults.update(params)
+
+    return get_user_model().objects.create_user(**defaults)
+
+
+def create_recipe(user, **params):
+    '''create and return a sample recipe'''
+    defaults = {'title': 'test recipe', 'time_minutes': 10, 'price': Decimal('5.5')}
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class RecipeStatsAPITests(TestCase):
+    '''test the stats action'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def test_stats(self):
+        '''test aggregates, percentiles and per tag breakdown'''
+        vegan = Tag.objects.create(user=self.user, name='vegan')
+        for minutes, price in [(10, '1'), (20, '2'), (30, '3'), (40, '4')]:
+            recipe = create_recipe(self.user, time_minutes=minutes, price=Decimal(price))
+            if minutes <= 20:
+                recipe.tags.add(vegan)
+        create_recipe(create_user(email='test2@example.com', name='test2'), price=Decimal('100'))
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 4)
+        self.assertEqual(res.data['price'], {'avg': '2.50', 'min': '1.00', 'max': '4.00',
+                                             'p50': '2.00', 'p90': '4.00', 'p95': '4.00'})
+        self.assertEqual(res.data['time_minutes']['avg'], 25.0)
+        self.assertEqual(res.data['time_minutes']['p50'], 20)
+        self.assertEqual(res.data['tags'], [
+            {'id': vegan.id, 'name': 'vegan', 'count': 2, 'avg_price': '1.50', 'avg_time_minutes': 15.0},
+        ])
+        self.assertEqual(res.data['ingredients'], [])
+
+    def test_stats_empty(self):
+        '''test a user without recipes gets empty stats'''
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['count'], 0)
+        self.assertIsNone(res.data['price']['p50'])
+
+    def test_stats_served_from_rollup_until_a_write(self):
+        '''test repeated reads don't aggregate again, and writes invalidate the rollup'''
+        create_recipe(self.user)
+        self.client.get(STATS_URL)
+        with self.assertNumQueries(1):
+            self.client.get(STATS_URL)
+
+        create_recipe(self.user, price=Decimal('10.5'))
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['count'], 2)
+        self.assertEqual(res.data['price']['max'], '10.50')
+        rollup = RecipeStats.objects.get(user=self.user)
+        self.assertEqual(rollup.computed_version, rollup.version)
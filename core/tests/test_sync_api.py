@@ -0,0 +1,200 @@
+'''
+tests for the recipe delta sync API
+'''
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework import status
+from ..models import Recipe, Tag, Ingredient, ChangeLogEntry, OutboxEvent
+from recipe.signals import recording_changes
+
+SYNC_URL = reverse('recipe:sync')
+RECIPE_URL = reverse('recipe:recipe-list')
+
+
+def create_user(**params):
+    '''create and return a new user'''
+    defaults = {
+        'email': 'test@example.com',
+        'password': 'testpass123',
+        'name': 'test',
+    }
+    defaults.update(params)
+
+    return get_user_model().objects.create_user(**defaults)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class SyncAPITests(TestCase):
+    '''test the sync endpoint'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def _create_recipe(self, **params):
+        payload = {'title': 'test recipe', 'time_minutes': 10, 'price': Decimal('5.5')}
+        payload.update(params)
+        return self.client.post(RECIPE_URL, payload, format='json').data['id']
+
+    def test_full_sync_without_cursor(self):
+        '''test a sync without a cursor returns everything and a cursor'''
+        recipe_id = self._create_recipe(tags=[{'name': 'vegan'}])
+        res = self.client.get(SYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data['recipes']], [recipe_id])
+        self.assertEqual([t['name'] for t in res.data['tags']], ['vegan'])
+        self.assertEqual(res.data['cursor'], ChangeLogEntry.objects.latest('id').id)
+
+    def test_delta_returns_changes_and_tombstones(self):
+        '''test only changes after the cursor are returned, with deletions'''
+        kept_id = self._create_recipe(title='kept')
+        deleted_id = self._create_recipe(title='deleted')
+        cursor = self.client.get(SYNC_URL).data['cursor']
+
+        self.client.patch(reverse('recipe:recipe-detail', args=[kept_id]), {'title': 'renamed'})
+        self.client.delete(reverse('recipe:recipe-detail', args=[deleted_id]))
+        new_id = self._create_recipe(title='new')
+        res = self.client.get(SYNC_URL, {'since': cursor})
+
+        self.assertEqual({r['id']: r['title'] for r in res.data['recipes']}, {kept_id: 'renamed', new_id: 'new'})
+        self.assertEqual(res.data['deleted']['recipes'], [deleted_id])
+        self.assertFalse(res.data['has_more'])
+
+        res = self.client.get(SYNC_URL, {'since': res.data['cursor']})
+
+        self.assertEqual(res.data['recipes'], [])
+        self.assertEqual(res.data['deleted']['recipes'], [])
+
+    def test_tag_delete_syncs_recipe(self):
+        '''test deleting a tag reports the tag and the recipes that lost it'''
+        recipe_id = self._create_recipe(tags=[{'name': 'vegan'}])
+        cursor = self.client.get(SYNC_URL).data['cursor']
+        tag = Tag.objects.get(user=self.user)
+        self.client.delete(reverse('recipe:tag-detail', args=[tag.id]))
+        res = self.client.get(SYNC_URL, {'since': cursor})
+
+        self.assertEqual(res.data['deleted']['tags'], [tag.id])
+        self.assertEqual(res.data['recipes'][0]['id'], recipe_id)
+        self.assertEqual(res.data['recipes'][0]['tags'], [])
+
+    def test_batches_are_bounded(self):
+        '''test limit bounds the batch and has_more pages through the rest'''
+        self._create_recipe()
+        cursor = self.client.get(SYNC_URL).data['cursor']
+        ids = [Recipe.objects.create(user=self.user, title=str(i), time_minutes=1, price=Decimal('1')).id
+               for i in range(3)]
+        res = self.client.get(SYNC_URL, {'since': cursor, 'limit': 2})
+
+        self.assertTrue(res.data['has_more'])
+        seen = [r['id'] for r in res.data['recipes']]
+        res = self.client.get(SYNC_URL, {'since': res.data['cursor'], 'limit': 2})
+        seen += [r['id'] for r in res.data['recipes']]
+        self.assertEqual(sorted(seen), ids)
+
+    def test_other_users_changes_excluded(self):
+        '''test changes of other users are not synced'''
+        other = create_user(email='test2@example.com', name='test2')
+        Recipe.objects.create(user=other, title='other', time_minutes=1, price=Decimal('1'))
+        res = self.client.get(SYNC_URL, {'since': 1})
+
+        self.assertEqual(res.data['recipes'], [])
+
+    @override_settings(SYNC_SETTLE_SECONDS=60)
+    def test_recent_changes_wait(self):
+        '''test the cursor doesn't move past changes younger than the settle time'''
+        old_id = self._create_recipe(title='old')
+        ChangeLogEntry.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+        cursor = ChangeLogEntry.objects.get().id
+        new_id = self._create_recipe(title='new')
+
+        res = self.client.get(SYNC_URL)
+        self.assertEqual(res.data['cursor'], cursor)
+        self.assertEqual({r['id'] for r in res.data['recipes']}, {old_id, new_id})
+
+        res = self.client.get(SYNC_URL, {'since': cursor})
+        self.assertEqual((res.data['cursor'], res.data['recipes']), (cursor, []))
+
+        ChangeLogEntry.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+        res = self.client.get(SYNC_URL, {'since': cursor})
+        self.assertEqual([r['id'] for r in res.data['recipes']], [new_id])
+
+
+class ChangeRecordingTests(TestCase):
+    '''test changes are recorded once per entity and transaction'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def _writes(self, queries):
+        '''the change log, outbox and stats statements among queries'''
+        return sorted(
+            query['sql'].split(' (')[0].split(' SET')[0] for query in queries
+            if any(table in query['sql'] for table in ('core_changelogentry', 'core_outboxevent', 'core_recipestats'))
+        )
+
+    def test_create_records_each_entity_once(self):
+        '''test a create with tags and ingredients writes its changes in one statement each'''
+        payload = {'title': 'r', 'time_minutes': 5, 'price': '5.00',
+                   'tags': [{'name': 'a'}, {'name': 'b'}], 'ingredients': [{'name': 'x'}, {'name': 'y'}]}
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(RECIPE_URL, payload, format='json')
+
+        self.assertEqual(self._writes(ctx.captured_queries), [
+            'INSERT INTO "core_changelogentry"', 'INSERT INTO "core_outboxevent"', 'UPDATE "core_recipestats"',
+        ])
+        logged = sorted(ChangeLogEntry.objects.values_list('entity_type', flat=True))
+        self.assertEqual(logged, ['ingredient', 'ingredient', 'recipe', 'tag', 'tag'])
+        self.assertEqual(OutboxEvent.objects.count(), 5)
+
+    def test_tags_update_records_each_entity_once(self):
+        '''test replacing the tags of a recipe logs the recipe once'''
+        recipe_id = self.client.post(RECIPE_URL, {'title': 'r', 'time_minutes': 5, 'price': '5.00',
+                                                  'tags': [{'name': 'a'}]}, format='json').data['id']
+        cursor = ChangeLogEntry.objects.latest('id').id
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.patch(reverse('recipe:recipe-detail', args=[recipe_id]), {'tags': [{'name': 'b'}]},
+                              format='json')
+
+        self.assertEqual(len(self._writes(ctx.captured_queries)), 3)
+        logged = ChangeLogEntry.objects.filter(id__gt=cursor).values_list('entity_type', flat=True)
+        self.assertEqual(sorted(logged), ['recipe', 'tag'])
+
+    def test_rolled_back_block_records_nothing(self):
+        '''test the changes of a nested block that raised are dropped with it'''
+        with recording_changes():
+            Tag.objects.create(user=self.user, name='kept')
+            with self.assertRaises(ValueError):
+                with recording_changes():
+                    Ingredient.objects.create(user=self.user, name='gone')
+                    raise ValueError
+
+        self.assertEqual(list(ChangeLogEntry.objects.values_list('entity_type', flat=True)), ['tag'])
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+
+
+class AccountDeletionSyncTests(TransactionTestCase):
+    '''test deleting accounts with synced data, with foreign keys checked on commit'''
+
+    def test_delete_user_through_queryset(self):
+        '''test a queryset delete of a user doesn't log changes for the deleted user'''
+        user = create_user()
+        client = APIClient()
+        client.force_authenticate(user)
+        client.post(RECIPE_URL, {'title': 'r', 'time_minutes': 5, 'price': '5.00', 'tags': [{'name': 'vegan'}]},
+                    format='json')
+
+        get_user_model().objects.filter(pk=user.pk).delete()
+
+        self.assertFalse(get_user_model().objects.exists())
+        self.assertFalse(ChangeLogEntry.objects.exists())
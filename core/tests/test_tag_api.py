@@ -4,13 +4,17 @@ tests for tag APIs
 from decimal import Decimal
 from django.test import TestCase
 from django.contrib.auth import get_user_model
-from ..models import Recipe, Ingredient, Tag
+from ..models import Recipe, Ingredient, Tag, RecipeIngredient
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer, TagSerializer
 
 TAG_URL = reverse('recipe:tag-list')
+AUTOCOMPLETE_URL = reverse('recipe:tag-autocomplete')
+BULK_RENAME_URL = reverse('recipe:tag-bulk-rename')
+BULK_DELETE_URL = reverse('recipe:tag-bulk-delete')
+MERGE_URL = reverse('recipe:tag-merge')
 
 
 def detail_url(tag_id):
@@ -64,11 +68,11 @@ class PrivateRecipeAPITests(TestCase):
 
     def test_retrieve_tag(self):
         '''test retrieve a list of tags'''
-        create_tag(user=self.user)
-        create_tag(user=self.user)
+        create_tag(user=self.user, name='Dessert')
+        create_tag(user=self.user, name='Breakfast')
         res = self.client.get(TAG_URL)
 
-        tags = Tag.objects.all().order_by('-name')  # all tags
+        tags = Tag.objects.all().order_by('name')  # all tags
         serializer = TagSerializer(tags, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
@@ -96,6 +100,16 @@ class PrivateRecipeAPITests(TestCase):
         tag.refresh_from_db()
         self.assertEqual(tag.name, payload['name'])
 
+    def test_update_tag_name_clash(self):
+        '''test renaming a tag onto another tag's name is rejected'''
+        create_tag(user=self.user, name='Dessert')
+        tag = create_tag(user=self.user, name='Breakfast')
+        res = self.client.patch(detail_url(tag.id), {'name': ' dessert'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'Breakfast')
+
     def test_delete_tag(self):
         '''test deleting a tag'''
         tag = create_tag(user=self.user)
@@ -104,3 +118,132 @@ class PrivateRecipeAPITests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
         self.assertFalse(Tag.objects.filter(id=tag.id).exists())
+
+    def test_autocomplete_prefix(self):
+        '''test autocomplete matches prefixes case insensitively, most used first'''
+        rare = create_tag(user=self.user, name='Salty')
+        common = create_tag(user=self.user, name='salad')
+        create_tag(user=self.user, name='sweet')
+        create_tag(user=create_user(email='test2@example.com', name='test2'), name='sauce')
+        recipe = Recipe.objects.create(user=self.user, title='test', time_minutes=1, price=Decimal('1'))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.tags.add(common)
+        res = self.client.get(AUTOCOMPLETE_URL, {'prefix': 'SA'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([t['id'] for t in res.data], [common.id, rare.id])
+        self.assertEqual(res.data[0]['usage'], 1)
+
+    def test_autocomplete_invalidated_on_write(self):
+        '''test new and renamed tags show up in suggestions'''
+        tag = create_tag(user=self.user, name='spicy')
+        self.client.get(AUTOCOMPLETE_URL, {'prefix': 's'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(detail_url(tag.id), {'name': 'hot'})
+        res = self.client.get(AUTOCOMPLETE_URL, {'prefix': 'h'})
+
+        self.assertEqual([t['name'] for t in res.data], ['hot'])
+
+    def test_autocomplete_sees_writes_of_other_workers(self):
+        '''test a rename is suggested without this worker's index being dropped'''
+        tag = create_tag(user=self.user, name='spicy')
+        self.client.get(AUTOCOMPLETE_URL, {'prefix': 's'})
+        # on commit callbacks don't run here, as if another process made the write
+        self.client.patch(detail_url(tag.id), {'name': 'hot'})
+        res = self.client.get(AUTOCOMPLETE_URL, {'prefix': 's'})
+
+        self.assertEqual(res.data, [])
+
+    def test_autocomplete_requires_prefix(self):
+        '''test a missing prefix is an error'''
+        res = self.client.get(AUTOCOMPLETE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def create_recipe(self, *tags):
+        recipe = Recipe.objects.create(user=self.user, title='test', time_minutes=1, price=Decimal('1'))
+        recipe.tags.add(*tags)
+        return recipe
+
+    def test_bulk_rename(self):
+        '''test several tags are renamed in one request'''
+        first = create_tag(user=self.user, name='Dessert')
+        second = create_tag(user=self.user, name='Breakfast')
+        payload = {'items': [{'id': first.id, 'name': 'Sweets'}, {'id': second.id, 'name': 'breakfast'}]}
+        res = self.client.post(BULK_RENAME_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([t['name'] for t in res.data], ['Sweets', 'breakfast'])
+        first.refresh_from_db()
+        self.assertEqual((first.name, first.normalized_name), ('Sweets', 'sweets'))
+
+    def test_bulk_rename_clash(self):
+        '''test renaming onto an existing name renames nothing'''
+        first = create_tag(user=self.user, name='Dessert')
+        second = create_tag(user=self.user, name='Breakfast')
+        payload = {'items': [{'id': first.id, 'name': 'Sweets'}, {'id': second.id, 'name': 'DESSERT'}]}
+        res = self.client.post(BULK_RENAME_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        first.refresh_from_db()
+        self.assertEqual(first.name, 'Dessert')
+
+    def test_bulk_rename_other_users_tag(self):
+        '''test another user's tags can't be renamed'''
+        tag = create_tag(user=create_user(email='test2@example.com', name='test2'))
+        res = self.client.post(BULK_RENAME_URL, {'items': [{'id': tag.id, 'name': 'mine'}]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'test tag')
+
+    def test_bulk_delete(self):
+        '''test deleting several tags removes them from their recipes'''
+        keep = create_tag(user=self.user, name='keep')
+        gone = [create_tag(user=self.user, name=f'gone{i}') for i in range(2)]
+        recipe = self.create_recipe(keep, *gone)
+        other = create_tag(user=create_user(email='test2@example.com', name='test2'))
+        res = self.client.post(BULK_DELETE_URL, {'ids': [t.id for t in gone] + [other.id]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'deleted': 2, 'recipes': 1})
+        self.assertEqual(list(Tag.objects.filter(user=self.user)), [keep])
+        self.assertTrue(Tag.objects.filter(id=other.id).exists())
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.tag_ids, recipe.tag_count), ([keep.id], 1))
+
+    def test_merge(self):
+        '''test merged tags' recipes get the target tag, once'''
+        target = create_tag(user=self.user, name='Dessert')
+        sources = [create_tag(user=self.user, name='Sweets'), create_tag(user=self.user, name='Puddings')]
+        both = self.create_recipe(target, sources[0])
+        moved = self.create_recipe(*sources)
+        res = self.client.post(MERGE_URL, {'sources': [t.id for t in sources], 'target': target.id}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'merged': 2, 'recipes': 2})
+        self.assertEqual(list(Tag.objects.filter(user=self.user)), [target])
+        for recipe in (both, moved):
+            recipe.refresh_from_db()
+            self.assertEqual(list(recipe.tags.all()), [target])
+            self.assertEqual(recipe.tag_ids, [target.id])
+
+    def test_merge_into_itself(self):
+        '''test the target can't be among the sources'''
+        tag = create_tag(user=self.user)
+        res = self.client.post(MERGE_URL, {'sources': [tag.id], 'target': tag.id}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_merge_ingredients_keeps_amounts(self):
+        '''test merged ingredient links keep their quantity and unit'''
+        target = Ingredient.objects.create(user=self.user, name='Sugar')
+        source = Ingredient.objects.create(user=self.user, name='Caster sugar')
+        recipe = self.create_recipe()
+        recipe.ingredients.add(source, through_defaults={'quantity': Decimal('100'), 'unit': 'g'})
+        res = self.client.post(
+            reverse('recipe:ingredient-merge'), {'sources': [source.id], 'target': target.id}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        link = RecipeIngredient.objects.get(recipe=recipe)
+        self.assertEqual((link.ingredient_id, link.quantity, link.unit), (target.id, Decimal('100'), 'g'))
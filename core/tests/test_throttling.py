@@ -0,0 +1,117 @@
+'''
+tests for API throttling
+'''
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework import status
+from core.throttling import UserTokenBucketThrottle
+
+RECIPE_URL = reverse('recipe:recipe-list')
+
+
+def create_user(**params):
+    '''create and return a new user'''
+    defaults = {
+        'email': 'test@example.com',
+        'password': 'testpass123',
+        'name': 'test',
+    }
+    defaults.update(params)
+
+    return get_user_model().objects.create_user(**defaults)
+
+
+def throttle_rates(**rates):
+    '''REST_FRAMEWORK settings with the given throttle rates'''
+    return {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}
+
+
+class ThrottlingTests(TestCase):
+    '''test token bucket throttles'''
+
+    def setUp(self):
+        caches['throttle'].clear()
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(recipe='2/min'))
+    def test_user_throttled_after_burst(self):
+        '''test requests over the bucket capacity get 429 and Retry-After'''
+        for _ in range(2):
+            res = self.client.get(RECIPE_URL)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        res = self.client.get(RECIPE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertTrue(0 < int(res['Retry-After']) <= 30)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(recipe='1/min'))
+    def test_users_have_separate_buckets(self):
+        '''test one user's requests don't use another user's bucket'''
+        self.client.get(RECIPE_URL)
+        other_client = APIClient()
+        other_client.force_authenticate(create_user(email='test2@example.com', name='test2'))
+        res = other_client.get(RECIPE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(recipe='100/min', recipe_ip='1/min'))
+    def test_ip_throttled_across_users(self):
+        '''test the per address bucket applies across users'''
+        self.client.get(RECIPE_URL)
+        other_client = APIClient()
+        other_client.force_authenticate(create_user(email='test2@example.com', name='test2'))
+        res = other_client.get(RECIPE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(login='1/min'))
+    def test_token_endpoint_throttled(self):
+        '''test the login endpoint is throttled'''
+        client = APIClient()
+        payload = {'email': 'test@example.com', 'password': 'testpass123'}
+        client.post(reverse('user:token'), payload)
+        res = client.post(reverse('user:token'), payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(recipe='1/min'))
+    def test_async_views_share_the_bucket(self):
+        '''test a client throttled on the viewset can't switch to the async list'''
+        self.client.get(RECIPE_URL)
+        token = Token.objects.create(user=self.user)
+
+        res = self.client.get(reverse('recipe:async-recipe-list'), HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(recipe='50/min'))
+    def test_concurrent_requests_dont_overspend(self):
+        '''test threads sharing a bucket get exactly its capacity'''
+        request = SimpleNamespace(user=self.user, META={'REMOTE_ADDR': '127.0.0.1'})
+        view = SimpleNamespace(throttle_scope='recipe')
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            allowed = list(pool.map(lambda i: UserTokenBucketThrottle().allow_request(request, view), range(200)))
+
+        self.assertEqual(allowed.count(True), 50)
+
+    @override_settings(CACHES={**settings.CACHES, 'throttle': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/throttle'}})
+    def test_shared_cache_rejected(self):
+        '''test buckets can't be kept in a cache other processes share'''
+        request = SimpleNamespace(user=self.user, META={'REMOTE_ADDR': '127.0.0.1'})
+
+        with self.assertRaises(ImproperlyConfigured):
+            UserTokenBucketThrottle().allow_request(request, SimpleNamespace(throttle_scope='recipe'))
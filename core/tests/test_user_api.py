@@ -1,12 +1,25 @@
 '''
 tests for user API
 '''
-
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache, caches
+from rest_framework.authtoken.models import Token
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
+from core.models import Recipe, Tag, Ingredient, Job, OutboxEvent
 
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
@@ -23,6 +36,8 @@ class PublicUserAPITests(TestCase):
 
     def setUp(self):
         self.client = APIClient()
+        cache.clear()
+        caches['throttle'].clear()
 
     def test_create_user_success(self):
         '''test creating a user is successful'''
@@ -103,6 +118,44 @@ class PublicUserAPITests(TestCase):
         self.assertNotIn('token', res.data)
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_token_reuses_existing_token(self):
+        '''test logging in again returns the same token'''
+        user = create_user(email='test@example.com', password='testpass123', name='test')
+        token = Token.objects.create(user=user)
+        payload = {'email': 'test@example.com', 'password': 'testpass123'}
+        res = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['token'], token.key)
+        self.assertEqual(Token.objects.filter(user=user).count(), 1)
+
+    def test_login_rehashes_legacy_password(self):
+        '''test a PBKDF2 password is upgraded to the preferred hasher on login'''
+        user = create_user(email='test@example.com', password='testpass123', name='test')
+        user.password = make_password('testpass123', hasher='pbkdf2_sha256')
+        user.save()
+        payload = {'email': 'test@example.com', 'password': 'testpass123'}
+        res = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('scrypt$'))
+
+    @patch('user.serializers.authenticate')
+    def test_repeated_login_failures_throttled(self, patched_authenticate):
+        '''test login is rejected without hashing after too many failures'''
+        patched_authenticate.return_value = None
+        payload = {'email': 'test@example.com', 'password': 'badpass'}
+        for _ in range(settings.LOGIN_FAILURE_LIMIT):
+            res = self.client.post(TOKEN_URL, payload)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+        self.assertEqual(patched_authenticate.call_count, settings.LOGIN_FAILURE_LIMIT)
+
     def test_retrieve_user_unauthorized(self):
         '''test authentication is required for users'''
         res = self.client.get(ME_URL)
@@ -137,3 +190,61 @@ class PrivateUserAPITests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
+
+    def test_delete_account_deactivates(self):
+        '''test deleting the account locks it out at once and queues the deletion'''
+        Token.objects.create(user=self.user)
+        res = self.client.delete(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.args), ('user.deletion.delete_account', [self.user.id]))
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_RELEASE_GRACE_SECONDS=0, ACCOUNT_DELETE_BATCH_SIZE=2)
+class AccountDeletionTests(TestCase):
+    '''test the background account deletion'''
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_deleted_in_batches(self):
+        '''test everything of the account goes, in batches, and unshared images with it'''
+        user = create_user(email='test@example.com', password='testpass123', name='test')
+        other = create_user(email='other@example.com', password='testpass123', name='other')
+        storage = Recipe._meta.get_field('image').storage
+        own = storage.save('recipe/own.jpg', ContentFile(b'own'))
+        shared = storage.save('recipe/shared.jpg', ContentFile(b'shared'))
+        tag = Tag.objects.create(user=user, name='tag')
+        ingredient = Ingredient.objects.create(user=user, name='salt')
+        for i in range(5):
+            recipe = Recipe.objects.create(user=user, title=f'r{i}', time_minutes=1, price=Decimal('1'), image=own)
+            recipe.tags.add(tag)
+            recipe.ingredients.add(ingredient)
+        kept = Recipe.objects.create(user=other, title='kept', time_minutes=1, price=Decimal('1'), image=shared)
+        Recipe.objects.filter(user=user, title='r0').update(image=shared)
+        OutboxEvent.objects.all().delete()
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+        self.client.delete(ME_URL)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('run_worker', '--burst', '--concurrency', '1', stdout=StringIO())
+
+        self.assertFalse(get_user_model().objects.filter(id=user.id).exists())
+        self.assertEqual(list(Recipe.objects.all()), [kept])
+        self.assertFalse(Tag.objects.exists() or Ingredient.objects.exists())
+        self.assertFalse(os.path.exists(storage.path(own)))
+        self.assertTrue(os.path.exists(storage.path(shared)))
+        self.assertEqual(OutboxEvent.objects.filter(entity_type='recipe', deleted=True).count(), 5)
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.progress, {'recipes': 5, 'tags': 1, 'ingredients': 1, 'done': True})
@@ -0,0 +1,100 @@
+'''
+token bucket throttles for the API
+
+each client key holds a small (tokens, timestamp) pair in a local cache, so a
+request costs one cache read and one write instead of the request history list
+kept by DRF's SimpleRateThrottle, and never touches the database. buckets refill
+continuously at the configured rate, which also lets us tell a throttled client
+exactly when its next token arrives via Retry-After. the read-modify-write of a
+bucket holds a lock, so concurrent threads of a worker can't spend the same token.
+
+the buckets are per process: the timestamps come from time.monotonic, which
+means nothing in another process, and the lock only covers this one. so
+THROTTLE_CACHE must be a local memory cache, and every worker process enforces
+the rates on its own; with N workers a client can get up to N times a rate.
+'''
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    '''parse "120/min" into (capacity, seconds)'''
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    '''
+    base token bucket throttle scoped by the view's `throttle_scope`
+    rates come from DEFAULT_THROTTLE_RATES[scope + rate_suffix]
+    '''
+    rate_suffix = ''
+    timer = time.monotonic
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    @property
+    def cache(self):
+        cache = caches[getattr(settings, 'THROTTLE_CACHE', 'default')]
+        if not isinstance(cache, LocMemCache):
+            # a shared cache would mix up monotonic clocks and race across processes
+            raise ImproperlyConfigured('THROTTLE_CACHE must be a local memory cache')
+        return cache
+
+    def get_ident_key(self, request):
+        '''return the client part of the bucket key'''
+        raise NotImplementedError('.get_ident_key() must be overridden')
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(f'{scope}{self.rate_suffix}') if scope else None
+        if rate is None:
+            return True
+
+        capacity, duration = parse_rate(rate)
+        refill = capacity / duration
+        key = f'bucket:{scope}{self.rate_suffix}:{self.get_ident_key(request)}'
+        with _lock:
+            now = self.timer()
+            tokens, stamp = self.cache.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * refill)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.wait_seconds = (1 - tokens) / refill
+            # an idle bucket is full again after `duration`, so it can expire then
+            self.cache.set(key, (tokens, now), duration)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    '''limit each authenticated user (or anonymous client address) per scope'''
+
+    def get_ident_key(self, request):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{self.get_ident(request)}'
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    '''limit each client address per scope, across all users behind it'''
+    rate_suffix = '_ip'
+
+    def get_ident_key(self, request):
+        return f'ip:{self.get_ident(request)}'
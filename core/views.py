@@ -1,3 +1,185 @@
-from django.shortcuts import render
+'''
+media file and prebuilt schema serving
 
-# Create your views here.
+files under MEDIA_ROOT are served with ETag/Last-Modified validators,
+Cache-Control, and single byte range support. when MEDIA_SENDFILE is set the
+body is handed off to the front end server (X-Sendfile for Apache/lighttpd,
+X-Accel-Redirect for nginx) and Python only checks the path. otherwise the file
+is streamed with FileResponse, which WSGI servers providing wsgi.file_wrapper
+(e.g. gunicorn) send with zero-copy sendfile().
+'''
+import mimetypes
+import os
+import re
+import stat
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_safe
+
+# names written by core.storage.ContentAddressedStorage never change content
+CONTENT_ADDRESSED_NAME = re.compile(r'^[0-9a-f]{64}(\.\w+)?$')
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class FileRange:
+    '''read-limited view of length bytes of an open file, starting at offset'''
+
+    def __init__(self, file, offset, length):
+        file.seek(offset)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        # lets wsgi.file_wrapper sendfile() from the current offset
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def _parse_range(header, size):
+    '''
+    return (start, end) inclusive for a single satisfiable byte range,
+    None if the header should be ignored, or False if it is unsatisfiable
+    '''
+    match = RANGE_HEADER.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None  # malformed or multiple ranges: serve the whole file
+    first, last = match.groups()
+    if first == '':
+        # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _validators(path, st):
+    '''return (etag, cache_control) for a media file'''
+    name = os.path.basename(path)
+    if CONTENT_ADDRESSED_NAME.match(name):
+        return quote_etag(os.path.splitext(name)[0]), IMMUTABLE_CACHE_CONTROL
+    etag = f'W/"{st.st_size:x}-{int(st.st_mtime):x}"'
+    return etag, f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+
+
+def _if_range_passes(request, etag, mtime):
+    '''a Range is honoured only if If-Range (when sent) still matches'''
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # weak validators never match for If-Range
+        return not etag.startswith('W/') and if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(mtime) <= date
+
+
+@require_safe
+def serve_media(request, path):
+    '''serve a file from MEDIA_ROOT'''
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('File does not exist')
+    if not stat.S_ISREG(st.st_mode) or os.path.basename(full_path).startswith('.'):
+        raise Http404('File does not exist')
+
+    etag, cache_control = _validators(full_path, st)
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(st.st_mtime),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+    validators = HttpResponse(content_type=content_type, headers=headers)
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime), response=validators)
+    if conditional is not validators:
+        return conditional
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and _if_range_passes(request, etag, st.st_mtime):
+        byte_range = _parse_range(range_header, st.st_size)
+        if byte_range is False:
+            headers['Content-Range'] = f'bytes */{st.st_size}'
+            return HttpResponse(status=416, content_type=content_type, headers=headers)
+
+    sendfile = getattr(settings, 'MEDIA_SENDFILE', None)
+    if sendfile:
+        # the front end server handles Range itself
+        response = HttpResponse(content_type=content_type, headers=headers)
+        if sendfile == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + path.lstrip('/')
+        else:
+            response['X-Sendfile'] = full_path
+        return response
+
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        return FileResponse(file, content_type=content_type, headers=headers)
+
+    start, end = byte_range
+    length = end - start + 1
+    response = FileResponse(FileRange(file, start, length), status=206, content_type=content_type, headers=headers)
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = f'bytes {start}-{end}/{st.st_size}'
+    return response
+
+
+@require_safe
+def serve_schema(request):
+    '''serve the prebuilt OpenAPI schema, YAML by default or JSON with ?format=json'''
+    fmt = 'json' if request.GET.get('format') == 'json' or 'json' in request.headers.get('Accept', '') else 'yaml'
+    # drf-spectacular is only imported once the schema is asked for
+    from . import schema
+    body = schema.get_body(fmt)
+    gzipped = 'gzip' in request.headers.get('Accept-Encoding', '')
+    # each encoding is a different representation, so it gets its own strong ETag
+    etag = body.etag[:-1] + '-gzip"' if gzipped else body.etag
+    headers = {'ETag': etag, 'Cache-Control': 'public, no-cache'}
+    response = HttpResponse(content_type=body.content_type, headers=headers)
+    patch_vary_headers(response, ['Accept', 'Accept-Encoding'])
+    conditional = get_conditional_response(request, etag=etag, response=response)
+    if conditional is not response:
+        return conditional
+
+    if gzipped:
+        response.content = body.gzipped
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response.content = body.content
+    response['Content-Length'] = str(len(response.content))
+    return response
+
+
+_api_docs = None
+
+
+def api_docs(request, *args, **kwargs):
+    '''swagger UI for the schema, imported on first use'''
+    global _api_docs
+    if _api_docs is None:
+        from drf_spectacular.views import SpectacularSwaggerView
+        _api_docs = SpectacularSwaggerView.as_view(url_name='api_schema')
+    return _api_docs(request, *args, **kwargs)
@@ -0,0 +1,212 @@
+'''
+async read-only views for recipe APIs
+
+these mirror the list/detail output of the DRF viewsets but run natively
+under ASGI, so a slow client doesn't pin a worker thread for the whole request.
+they are throttled with the same buckets as the viewsets they mirror, and the
+recipe list takes its query params, ordering and pagination from RecipeViewSet
+'''
+from decimal import Decimal
+from functools import wraps
+from types import SimpleNamespace
+from django.http import JsonResponse, HttpResponseNotAllowed
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from core.models import Recipe, Tag, Ingredient
+from .views import RecipeViewSet
+
+# prices and ingredient quantities both have two decimal places
+DECIMAL_QUANTUM = Decimal('0.01')
+
+
+async def _aget_user(request):
+    '''resolve the user from the Token authorization header, or None'''
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'token':
+        return None
+    token = await Token.objects.select_related('user').filter(key=auth[1]).afirst()
+    if token is None or not token.user.is_active:
+        return None
+    return token.user
+
+
+def _get_only(view):
+    '''async counterpart of require_GET'''
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _unauthorized():
+    response = JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    response['WWW-Authenticate'] = 'Token'
+    return response
+
+
+def _throttled(request, user, scope):
+    '''run the API throttles for a view with this throttle_scope, returning a 429 or None'''
+    request.user = user
+    view = SimpleNamespace(throttle_scope=scope)
+    # the throttle cache is local memory, so this doesn't block the event loop
+    waits = [
+        throttle.wait()
+        for throttle in (throttle_class() for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES)
+        if not throttle.allow_request(request, view)
+    ]
+    if not waits:
+        return None
+    exc = Throttled(max((wait for wait in waits if wait is not None), default=None))
+    response = JsonResponse({'detail': exc.detail}, status=exc.status_code)
+    if exc.wait is not None:
+        response['Retry-After'] = '%d' % exc.wait
+    return response
+
+
+def _recipe_query(request, user):
+    '''
+    RecipeViewSet's list query for the request's params, with its validation,
+    filters and ordering, and its paginator, which is None when unpaginated
+    '''
+    drf_request = Request(request)
+    drf_request.user = user
+    view = RecipeViewSet(request=drf_request, action='list', format_kwarg=None)
+    # the related rows are read by _related rather than prefetched
+    queryset = view.get_queryset().prefetch_related(None)
+    paginator = view.paginator
+    page = paginator.page_queryset(queryset, drf_request, view)
+    return (queryset, None) if page is None else (page, paginator)
+
+
+def _error(exc):
+    '''the response DRF's exception handler gives for exc'''
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return JsonResponse(data, status=exc.status_code, safe=False)
+
+
+def _decimal(value):
+    '''format a decimal the way DRF's DecimalField does'''
+    return None if value is None else str(value.quantize(DECIMAL_QUANTUM))
+
+
+async def _related(through, attr, recipe_ids, extra=()):
+    '''map recipe id to a list of {id, name, *extra} for a recipe M2M through table'''
+    related = {}
+    # values() rather than values_list(): the latter isn't lazily iterable by aiterator() in Django 4.2
+    rows = through.objects.filter(recipe__in=recipe_ids).order_by('id').values(
+        'recipe_id', f'{attr}_id', f'{attr}__name', *extra)
+    async for row in rows.aiterator():
+        item = {'id': row[f'{attr}_id'], 'name': row[f'{attr}__name']}
+        item.update((field, row[field]) for field in extra)
+        related.setdefault(row['recipe_id'], []).append(item)
+    return related
+
+
+async def _ingredients(recipe_ids):
+    '''recipe ingredients with their amounts'''
+    related = await _related(Recipe.ingredients.through, 'ingredient', recipe_ids, extra=('quantity', 'unit'))
+    for items in related.values():
+        for item in items:
+            item['quantity'] = _decimal(item['quantity'])
+    return related
+
+
+def _row(recipe):
+    return {field: getattr(recipe, field) for field in ['id', 'title', 'time_minutes', 'price', 'link', 'version']}
+
+
+def _recipe_data(row, tags, ingredients):
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'time_minutes': row['time_minutes'],
+        'price': _decimal(row['price']),
+        'link': row['link'],
+        'version': row['version'],
+        'tags': tags.get(row['id'], []),
+        'ingredients': ingredients.get(row['id'], []),
+    }
+
+
+@_get_only
+async def recipe_list(request):
+    '''list recipes for the authenticated user'''
+    user = await _aget_user(request)
+    if user is None:
+        return _unauthorized()
+    throttled = _throttled(request, user, 'recipe')
+    if throttled is not None:
+        return throttled
+
+    try:
+        queryset, paginator = _recipe_query(request, user)
+    except APIException as exc:
+        return _error(exc)
+    if paginator is None:
+        recipes = [recipe async for recipe in queryset]
+        # a subquery, as the whole list may hold more ids than a query can take
+        recipe_ids = queryset.order_by().values('id')
+    else:
+        recipes = paginator.set_page([recipe async for recipe in queryset])
+        recipe_ids = [recipe.id for recipe in recipes]
+
+    tags = await _related(Recipe.tags.through, 'tag', recipe_ids)
+    ingredients = await _ingredients(recipe_ids)
+    data = [_recipe_data(_row(recipe), tags, ingredients) for recipe in recipes]
+    if paginator is None:
+        return JsonResponse(data, safe=False)
+    return JsonResponse({'next': paginator.get_next_link(), 'previous': paginator.get_previous_link(), 'results': data})
+
+
+@_get_only
+async def recipe_detail(request, pk):
+    '''retrieve a single recipe of the authenticated user'''
+    user = await _aget_user(request)
+    if user is None:
+        return _unauthorized()
+    throttled = _throttled(request, user, 'recipe')
+    if throttled is not None:
+        return throttled
+
+    recipes = Recipe.objects.filter(user=user, pk=pk)
+    recipe = await recipes.afirst()
+    if recipe is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    tags = await _related(Recipe.tags.through, 'tag', [recipe.id])
+    ingredients = await _ingredients([recipe.id])
+    data = _recipe_data(_row(recipe), tags, ingredients)
+    data['description'] = recipe.description
+    data['image'] = request.build_absolute_uri(recipe.image.url) if recipe.image else None
+    return JsonResponse(data)
+
+
+async def _attr_list(request, model):
+    user = await _aget_user(request)
+    if user is None:
+        return _unauthorized()
+    throttled = _throttled(request, user, 'recipe_attr')
+    if throttled is not None:
+        return throttled
+
+    queryset = model.objects.filter(user=user)
+    if bool(int(request.GET.get('assigned_only', 0))):
+        queryset = queryset.filter(recipe__isnull=False)
+    rows = queryset.order_by('name').distinct().values('id', 'name')
+    return JsonResponse([row async for row in rows.aiterator()], safe=False)
+
+
+@_get_only
+async def tag_list(request):
+    '''list tags for the authenticated user'''
+    return await _attr_list(request, Tag)
+
+
+@_get_only
+async def ingredient_list(request):
+    '''list ingredients for the authenticated user'''
+    return await _attr_list(request, Ingredient)
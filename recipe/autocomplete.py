@@ -0,0 +1,87 @@
+'''
+prefix autocomplete for tag and ingredient names
+
+each worker keeps, per (model, user), the user's names sorted by
+normalized_name, so a lookup is a bisect plus a scan of the matches. an index
+is versioned by the user's latest change log entry: every tag/ingredient
+write, and every change to which recipes use them, logs one in the database
+all workers share, so a lookup rebuilds its copy once it sees a newer entry,
+whichever process made the write. the writing worker also drops its own copy
+after commit, and an index older than RECIPE_AUTOCOMPLETE_MAX_AGE is rebuilt
+in case an older transaction committed after a newer entry was seen.
+'''
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import Count
+from core.models import ChangeLogEntry, normalize_name
+
+MAX_USERS = 1024  # per worker LRU bound
+
+
+class _Index:
+    def __init__(self, version, rows):
+        self.version = version
+        self.built_at = time.monotonic()
+        # rows: (normalized_name, name, id, usage) sorted by normalized_name
+        self.rows = rows
+        self.keys = [row[0] for row in rows]
+
+    def search(self, prefix, limit):
+        matches = []
+        for i in range(bisect_left(self.keys, prefix), len(self.rows)):
+            if not self.keys[i].startswith(prefix):
+                break
+            matches.append(self.rows[i])
+        # most used first, then alphabetical
+        return heapq.nsmallest(limit, matches, key=lambda row: (-row[3], row[0]))
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def _version(user_id):
+    return ChangeLogEntry.objects.filter(user_id=user_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def invalidate(model, user_id):
+    '''drop this worker's index of a user's tags or ingredients, others see the change log'''
+    with _lock:
+        _indexes.pop((model, user_id), None)
+
+
+def _build(model, user_id, version):
+    rows = (
+        model.objects.filter(user_id=user_id)
+        .annotate(usage=Count('recipe'))
+        .order_by('normalized_name', 'id')
+        .values_list('normalized_name', 'name', 'id', 'usage')
+    )
+    return _Index(version, list(rows))
+
+
+def suggest(model, user_id, prefix, limit=10):
+    '''return up to limit {id, name, usage} whose name starts with prefix'''
+    version = _version(user_id)
+    key = (model, user_id)
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+    if (index is None or index.version != version
+            or time.monotonic() - index.built_at > settings.RECIPE_AUTOCOMPLETE_MAX_AGE):
+        index = _build(model, user_id, version)
+        with _lock:
+            _indexes[key] = index
+            _indexes.move_to_end(key)
+            while len(_indexes) > MAX_USERS:
+                _indexes.popitem(last=False)
+
+    return [
+        {'id': pk, 'name': name, 'usage': usage}
+        for normalized, name, pk, usage in index.search(normalize_name(prefix), limit)
+    ]
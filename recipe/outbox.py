@@ -0,0 +1,164 @@
+'''
+transactional outbox of recipe/tag/ingredient changes
+
+every change recorded by recipe.signals.entities_changed also inserts an
+OutboxEvent in the same transaction, so an event exists exactly when its
+change committed. `manage.py dispatch_outbox` reads the events in id order
+and hands them in batches to the sinks configured in OUTBOX_SINKS, keeping a
+per sink high-water mark (OutboxCursor). the mark only advances after the
+sink accepted the batch, so delivery is at least once: after a failure or a
+crash the batch is delivered again, and consumers must be idempotent (events
+carry their id for that).
+
+ids are taken when a transaction inserts, not when it commits, so a newer id
+can become visible before an older one. events younger than
+OUTBOX_SETTLE_SECONDS are left for the next pass to keep the mark from moving
+past a transaction that is still committing.
+'''
+import json
+import logging
+import os
+import urllib.request
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from core.models import OutboxEvent, OutboxCursor
+
+logger = logging.getLogger(__name__)
+
+
+def publish(entity_type, user_id, ids, deleted=False):
+    '''add events for changed entities to the caller's transaction'''
+    publish_changes([(entity_type, user_id, pk, deleted) for pk in ids])
+
+
+def publish_changes(changes):
+    '''add events for (entity type, user id, entity id, deleted) changes, in one insert'''
+    OutboxEvent.objects.bulk_create([
+        OutboxEvent(entity_type=entity_type, entity_id=pk, user_id=user_id, deleted=deleted)
+        for entity_type, user_id, pk, deleted in changes
+    ])
+
+
+def event_data(event):
+    return {
+        'id': event.id,
+        'type': f'{event.entity_type}.{"deleted" if event.deleted else "changed"}',
+        'entity_id': event.entity_id,
+        'user_id': event.user_id,
+        'created_at': event.created_at.isoformat(),
+    }
+
+
+class Sink:
+    '''receives batches of events; raising leaves the batch to be delivered again'''
+
+    def __init__(self, name, **options):
+        self.name = name
+
+    def deliver(self, events):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FileSink(Sink):
+    '''append events to a file as JSON lines'''
+
+    def __init__(self, name, path):
+        super().__init__(name)
+        self.path = path
+        self.file = None
+
+    def deliver(self, events):
+        if self.file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(''.join(json.dumps(event) + '\n' for event in events))
+        self.file.flush()
+        # the mark advances next, so the lines must be on disk first
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class WebhookSink(Sink):
+    '''POST each batch as {"events": [...]} to a URL'''
+
+    def __init__(self, name, url, timeout=10, headers=None):
+        super().__init__(name)
+        self.url = url
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+
+    def deliver(self, events):
+        body = json.dumps({'events': events}).encode()
+        request = urllib.request.Request(self.url, data=body, headers=self.headers, method='POST')
+        # non 2xx statuses raise HTTPError
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class HandlerSink(Sink):
+    '''call in-process functions (dotted paths) with each batch'''
+
+    def __init__(self, name, handlers=()):
+        super().__init__(name)
+        self.handlers = [import_string(handler) if isinstance(handler, str) else handler for handler in handlers]
+
+    def deliver(self, events):
+        for handler in self.handlers:
+            handler(events)
+
+
+def load_sinks(names=None):
+    '''instantiate the sinks configured in OUTBOX_SINKS, or only those named'''
+    sinks = {}
+    for name, config in settings.OUTBOX_SINKS.items():
+        if names is None or name in names:
+            sinks[name] = import_string(config['BACKEND'])(name, **config.get('OPTIONS', {}))
+    return sinks
+
+
+def dispatch(sink, batch_size=None):
+    '''deliver the next batch of settled events to sink, returning how many'''
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    OutboxCursor.objects.get_or_create(sink=sink.name)
+    with transaction.atomic():
+        # a second dispatcher for the same sink waits here rather than
+        # delivering the same batch (no-op on SQLite, which has one writer)
+        cursor = OutboxCursor.objects.select_for_update().get(sink=sink.name)
+        events = OutboxEvent.objects.filter(id__gt=cursor.position).order_by('id')[:batch_size]
+        horizon = timezone.now() - timedelta(seconds=settings.OUTBOX_SETTLE_SECONDS)
+        batch = []
+        for event in events:
+            if event.created_at > horizon:
+                break
+            batch.append(event)
+        if not batch:
+            return 0
+        sink.deliver([event_data(event) for event in batch])
+        cursor.position = batch[-1].id
+        cursor.save(update_fields=['position', 'updated_at'])
+    return len(batch)
+
+
+def prune(sink_names, batch_size=None):
+    '''delete events every named sink has received, returning how many'''
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    positions = dict(OutboxCursor.objects.filter(sink__in=sink_names).values_list('sink', 'position'))
+    if set(positions) != set(sink_names):
+        return 0  # a sink that never ran still needs everything
+    low_water = min(positions.values(), default=0)
+    pruned = 0
+    while True:
+        ids = list(OutboxEvent.objects.filter(id__lte=low_water).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return pruned
+        pruned += OutboxEvent.objects.filter(id__in=ids).delete()[0]
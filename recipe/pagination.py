@@ -0,0 +1,120 @@
+from base64 import b64decode
+from urllib import parse
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.utils.urls import remove_query_param
+
+
+def _flip(term):
+    return term[1:] if term.startswith('-') else f'-{term}'
+
+
+def _after(ordering, position):
+    '''rows after position in ordering: (a > x) or (a = x and b > y) ...'''
+    condition, equal = Q(), Q()
+    for term, value in zip(ordering, position):
+        field = term.lstrip('-')
+        condition |= equal & Q(**{f'{field}__{"lt" if term.startswith("-") else "gt"}': value})
+        equal &= Q(**{field: value})
+    return condition
+
+
+class RecipeCursorPagination(CursorPagination):
+    '''
+    keyset pagination for recipes, enabled by passing ?page_size=
+    the cursor holds the values of the view's validated ordering, which always
+    ends with id, for the row at the page boundary, and the next page is the
+    rows after it: (field > value) or (field = value and id > last id). each
+    page is a range scan on the matching (user, field) index rather than an
+    OFFSET, and rows sharing a value are stepped through however many there
+    are, where DRF's cursor skips past them with an offset capped at offset_cutoff
+    '''
+    page_size = None  # unpaginated unless the client asks for a page size
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(view._get_ordering())
+
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = self.page_queryset(queryset, request, view)
+        if rows is None:
+            return None
+        return self.set_page(list(rows))
+
+    def page_queryset(self, queryset, request, view=None):
+        '''
+        the unevaluated query for the requested page, None if unpaginated; its
+        rows go to set_page(), so an async view can fetch them itself
+        '''
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        # a previous page is read backwards from the first row of this one
+        ordering = [_flip(term) for term in self.ordering] if self._reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(_after(ordering, self._clean_position(queryset.model)))
+        # one row more tells whether there is a further page
+        return queryset[:self.page_size + 1]
+
+    @property
+    def _reverse(self):
+        return self.cursor is not None and self.cursor.reverse
+
+    def set_page(self, rows):
+        '''the page among the rows of page_queryset(), in order'''
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if self._reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        if self.has_next or self.has_previous:
+            self.display_page_controls = True
+        return self.page
+
+    def _clean_position(self, model):
+        position = self.cursor.position
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)  # made for another ordering
+        try:
+            return [model._meta.get_field(term.lstrip('-')).to_python(value)
+                    for term, value in zip(self.ordering, position)]
+        except ValidationError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def _position(self, row):
+        return [str(getattr(row, term.lstrip('-'))) for term in self.ordering]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # nothing before the cursor, so the first page starts at it
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self._position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self._position(self.page[0])))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            tokens = parse.parse_qs(b64decode(encoded.encode('ascii')).decode('ascii'), keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(offset=0, reverse=reverse, position=tokens.get('p', []))
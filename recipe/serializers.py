@@ -1,70 +1,144 @@
-from rest_framework import serializers
-from core.models import Recipe, Tag, Ingredient
+from django.db.models import F
+from rest_framework import exceptions, serializers, status
+from core.models import Recipe, Tag, Ingredient, RecipeIngredient, normalize_name
+from .signals import entities_changed, recording_changes
 
+# most tags/ingredients a bulk request may name
+BULK_MAX_ITEMS = 1000
+# most copies one duplicate request may make
+DUPLICATE_MAX_COPIES = 50
 
-class TagSerializer(serializers.ModelSerializer):
+
+class PreconditionFailed(exceptions.APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The recipe has been changed since it was read.'
+    default_code = 'precondition_failed'
+
+
+class UniqueNameMixin:
+    '''reject renaming a tag/ingredient onto another of the user's names'''
+
+    def validate_name(self, value):
+        # nested in RecipeSerializer names are looked up, not renamed
+        if self.instance is not None:
+            clash = type(self.instance).objects.filter(
+                user=self.instance.user, normalized_name=normalize_name(value)).exclude(pk=self.instance.pk)
+            if clash.exists():
+                raise serializers.ValidationError(f'"{value}" already exists.')
+        return value
+
+
+class TagSerializer(UniqueNameMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = ['id', 'name']
         read_only_fields = ['id']
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(UniqueNameMixin, serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ['id', 'name']
         read_only_fields = ['id']
 
 
+class RecipeIngredientSerializer(serializers.Serializer):
+    '''an ingredient of a recipe, with its optional amount'''
+    id = serializers.IntegerField(source='ingredient_id', read_only=True)
+    name = serializers.CharField(source='ingredient.name', max_length=100)
+    quantity = serializers.DecimalField(max_digits=8, decimal_places=2, required=False, allow_null=True)
+    unit = serializers.CharField(max_length=20, required=False, allow_blank=True)
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True, required=False)
-    ingredients = IngredientSerializer(many=True, required=False)
+    ingredients = RecipeIngredientSerializer(source='ingredient_links', many=True, required=False)
 
     class Meta:
         model = Recipe
-        fields = ['id', 'title', 'time_minutes', 'price', 'link', 'tags', 'ingredients']
-        read_only_fields = ['id']
+        fields = ['id', 'title', 'time_minutes', 'price', 'link', 'version', 'tags', 'ingredients']
+        read_only_fields = ['id', 'version']
 
-    def _get_or_create_tags(self, tags, recipe):
-        '''handle getting or creating tags as needed'''
+    def _get_or_create_named(self, model, items):
+        '''fetch the user's tags/ingredients by normalized name in one query, creating the missing ones'''
         auth_user = self.context['request'].user
-        for tag in tags:
-            tag_obj, created = Tag.objects.get_or_create(user=auth_user, **tag)
-            recipe.tags.add(tag_obj)
+        by_name = {normalize_name(item['name']): item for item in items}
+        found = {obj.normalized_name: obj for obj in model.objects.filter(user=auth_user, normalized_name__in=by_name)}
+        for name, item in by_name.items():
+            if name not in found:
+                # get_or_create retries the lookup if a concurrent request won the unique constraint
+                found[name] = model.objects.get_or_create(user=auth_user, normalized_name=name, defaults=item)[0]
+        return [found[name] for name in by_name]
+
+    def _get_or_create_tags(self, tags):
+        '''handle getting or creating tags as needed'''
+        return self._get_or_create_named(Tag, tags)
 
-    def _get_or_create_ingredients(self, ingredients, recipe):
+    def _get_or_create_ingredients(self, ingredients):
         '''handle getting or creating ingredients as needed'''
-        auth_user = self.context['request'].user
-        for ingredient in ingredients:
-            ingredient_obj, created = Ingredient.objects.get_or_create(user=auth_user, **ingredient)
-            recipe.ingredients.add(ingredient_obj)
-
+        return self._get_or_create_named(Ingredient, [item['ingredient'] for item in ingredients])
+
+    def _set_amounts(self, recipe, ingredients):
+        '''store the quantity and unit given for each ingredient on its through row'''
+        amounts = {
+            normalize_name(item['ingredient']['name']): (item.get('quantity'), item.get('unit', ''))
+            for item in ingredients
+        }
+        links = RecipeIngredient.objects.filter(recipe=recipe).select_related('ingredient')
+        changed = []
+        for link in links:
+            amount = amounts.get(link.ingredient.normalized_name)
+            if amount is not None and amount != (link.quantity, link.unit):
+                link.quantity, link.unit = amount
+                changed.append(link)
+        RecipeIngredient.objects.bulk_update(changed, ['quantity', 'unit'])
+
+    @recording_changes()
     def create(self, validated_data):
         '''create a recipe'''
         tags = validated_data.pop('tags', [])
-        ingredients = validated_data.pop('ingredients', [])
+        ingredients = validated_data.pop('ingredient_links', [])
         recipe = Recipe.objects.create(**validated_data)
-        self._get_or_create_tags(tags, recipe)
-        self._get_or_create_ingredients(ingredients, recipe)
+        # one add() per relation, so the summary columns are refreshed once
+        recipe.tags.add(*self._get_or_create_tags(tags))
+        recipe.ingredients.add(*self._get_or_create_ingredients(ingredients))
+        if any('quantity' in item or 'unit' in item for item in ingredients):
+            self._set_amounts(recipe, ingredients)
 
         return recipe
 
+    @recording_changes()
     def update(self, instance, validated_data):
-        '''update recipe'''
+        '''update recipe, provided it is still at the version it was read at'''
         tags = validated_data.pop('tags', None)
-        ingredients = validated_data.pop('ingredients', None)
-
-        if tags is not None:
-            instance.tags.clear()
-            self._get_or_create_tags(tags, instance)
-        if ingredients is not None:
-            instance.ingredients.clear()
-            self._get_or_create_ingredients(ingredients, instance)
-
+        ingredients = validated_data.pop('ingredient_links', None)
+        # files are stored by save(), not by a queryset update
+        image_given = 'image' in validated_data
+        image = validated_data.pop('image', None)
+
+        # one conditional UPDATE claims the next version. it holds the row
+        # until commit, so of two writers that read the same version the
+        # second matches no row and fails instead of overwriting the first
+        claimed = Recipe.objects.filter(pk=instance.pk, version=instance.version).update(
+            version=F('version') + 1, **validated_data)
+        if not claimed:
+            raise PreconditionFailed()
+        instance.version += 1
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
 
-        instance.save()
+        if tags is not None:
+            instance.tags.set(self._get_or_create_tags(tags))
+        if ingredients is not None:
+            instance.ingredients.set(self._get_or_create_ingredients(ingredients))
+            self._set_amounts(instance, ingredients)
+
+        if image_given:
+            instance.image = image
+            instance.save(update_fields=['image'])
+        else:
+            # the queryset update bypasses post_save
+            entities_changed(Recipe, instance.user_id, [instance.pk])
         return instance
 
 
@@ -77,6 +151,77 @@ class RecipeDetailSerializer(RecipeSerializer):
 class RecipeImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
-        fields = ['id', 'image']
-        read_only_fields = ['id']
+        fields = ['id', 'image', 'version']
+        read_only_fields = ['id', 'version']
         extra_kwargs = {'image': {'required': 'True'}}
+
+    @recording_changes()
+    def update(self, instance, validated_data):
+        '''store the image, provided the recipe is still at the version it was read at'''
+        # the same conditional claim as RecipeSerializer.update, and only the
+        # image column is saved, so a write since the read is never undone
+        claimed = Recipe.objects.filter(pk=instance.pk, version=instance.version).update(version=F('version') + 1)
+        if not claimed:
+            raise PreconditionFailed()
+        instance.version += 1
+        instance.image = validated_data['image']
+        instance.save(update_fields=['image'])
+        return instance
+
+
+class ShoppingListSerializer(serializers.Serializer):
+    '''recipes to combine into a shopping list'''
+    recipes = serializers.ListField(child=serializers.IntegerField(min_value=1), min_length=1, max_length=50)
+
+
+class ShoppingListItemSerializer(serializers.Serializer):
+    '''an ingredient of a shopping list, summed over the recipes using it in the same unit'''
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    quantity = serializers.DecimalField(max_digits=12, decimal_places=2, allow_null=True)
+    unit = serializers.CharField()
+    unmeasured = serializers.IntegerField(help_text='Recipes listing the ingredient without a quantity')
+    recipes = serializers.ListField(child=serializers.IntegerField())
+
+
+class BulkRenameItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField(min_value=1)
+    name = serializers.CharField()
+
+
+class BulkRenameSerializer(serializers.Serializer):
+    '''new names for several of the user's tags/ingredients'''
+    items = BulkRenameItemSerializer(many=True, min_length=1, max_length=BULK_MAX_ITEMS)
+
+    def validate_items(self, items):
+        max_length = self.context['view'].queryset.model._meta.get_field('name').max_length
+        if len({item['id'] for item in items}) < len(items):
+            raise serializers.ValidationError('Each id may only be renamed once.')
+        names = [normalize_name(item['name']) for item in items]
+        if len(set(names)) < len(names):
+            raise serializers.ValidationError('The new names must differ, merge the rows instead.')
+        if any(len(item['name']) > max_length for item in items):
+            raise serializers.ValidationError(f'Names may have at most {max_length} characters.')
+        return items
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    '''tags/ingredients to delete'''
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), min_length=1, max_length=BULK_MAX_ITEMS)
+
+
+class MergeSerializer(serializers.Serializer):
+    '''tags/ingredients to fold into another, moving their recipes over'''
+    sources = serializers.ListField(child=serializers.IntegerField(min_value=1), min_length=1, max_length=BULK_MAX_ITEMS)
+    target = serializers.IntegerField(min_value=1)
+
+    def validate(self, attrs):
+        if attrs['target'] in attrs['sources']:
+            raise serializers.ValidationError({'sources': 'The target cannot be merged into itself.'})
+        return attrs
+
+
+class DuplicateSerializer(serializers.Serializer):
+    '''copies to make of a recipe'''
+    copies = serializers.IntegerField(min_value=1, max_value=DUPLICATE_MAX_COPIES, default=1)
+    title = serializers.CharField(max_length=150, required=False, help_text='Title of the copies, the original one if omitted')
@@ -0,0 +1,50 @@
+'''
+combined shopping list for a set of recipes
+
+one grouped query over the recipe ingredient through table: a row per
+ingredient and unit, with the summed quantity and the recipes it came from
+concatenated by the database, so the cost doesn't grow with one query per
+recipe. amounts in different units are kept apart rather than converted.
+'''
+from django.db.models import Aggregate, CharField, Count, Sum
+from core.models import RecipeIngredient
+
+
+class GroupConcat(Aggregate):
+    '''comma separated values of a group, GROUP_CONCAT on SQLite and STRING_AGG on PostgreSQL'''
+    function = 'GROUP_CONCAT'
+    template = '%(function)s(%(distinct)s%(expressions)s)'
+    allow_distinct = True
+    output_field = CharField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, function='STRING_AGG',
+            template="%(function)s(%(distinct)s%(expressions)s::text, ',')", **extra_context,
+        )
+
+
+def shopping_list(user_id, recipe_ids):
+    '''return [{id, name, quantity, unit, recipes}] for the user's recipes among recipe_ids'''
+    rows = (
+        RecipeIngredient.objects.filter(recipe__user_id=user_id, recipe_id__in=recipe_ids)
+        .values('ingredient_id', 'ingredient__name', 'unit')
+        .annotate(
+            total=Sum('quantity'),
+            # recipes without an amount for the ingredient, to flag partial totals
+            unmeasured=Count('id') - Count('quantity'),
+            recipe_ids=GroupConcat('recipe_id', distinct=True),
+        )
+        .order_by('ingredient__normalized_name', 'unit')
+    )
+    return [
+        {
+            'id': row['ingredient_id'],
+            'name': row['ingredient__name'],
+            'quantity': row['total'],
+            'unit': row['unit'],
+            'unmeasured': row['unmeasured'],
+            'recipes': sorted(int(pk) for pk in row['recipe_ids'].split(',')),
+        }
+        for row in rows
+    ]
@@ -0,0 +1,160 @@
+'''
+propagate committed recipe/tag/ingredient writes to autocomplete and stats,
+and record them in the per user change log read by delta sync, the snapshots
+and the similarity index, and in the outbox read by downstream consumers
+
+write paths run inside recording_changes, which collects what the signals
+report and writes it once, at the end of the block: a save of a recipe and
+every tag/ingredient add on it make one change log entry and one outbox event,
+not one per signal. writes outside such a block are recorded straight away
+'''
+from contextlib import contextmanager
+from functools import partial
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from core.models import Recipe, Tag, Ingredient, ChangeLogEntry
+from . import autocomplete, outbox, stats
+
+ENTITY_TYPES = {Recipe: 'recipe', Tag: 'tag', Ingredient: 'ingredient'}
+
+
+class _Changes:
+    '''what a recording_changes block has changed, written by write()'''
+
+    def __init__(self):
+        self.entities = {}  # (model, user id, id): deleted, the last change wins
+        self.names = set()  # (model, user id) whose autocomplete is out of date
+
+    def merge(self, other):
+        self.entities.update(other.entities)
+        self.names |= other.names
+
+    def write(self):
+        '''add the log entries and events to the current transaction'''
+        changes = [(ENTITY_TYPES[model], user_id, pk, deleted)
+                   for (model, user_id, pk), deleted in self.entities.items()]
+        if changes:
+            ChangeLogEntry.objects.bulk_create([
+                ChangeLogEntry(user_id=user_id, entity_type=entity_type, entity_id=pk, deleted=deleted)
+                for entity_type, user_id, pk, deleted in changes
+            ])
+            outbox.publish_changes(changes)
+            for user_id in sorted({user_id for entity_type, user_id, pk, deleted in changes}):
+                stats.invalidate(user_id)
+        for model, user_id in self.names:
+            transaction.on_commit(partial(autocomplete.invalidate, model, user_id))
+
+
+def _recording():
+    '''the changes of the innermost recording_changes block, None outside one'''
+    return getattr(transaction.get_connection(), 'recorded_changes', None)
+
+
+@contextmanager
+def recording_changes():
+    '''
+    transaction.atomic for write paths, recording what the block changed when
+    the outermost block ends, still inside its transaction. a nested block
+    passes its changes on to the enclosing one, unless it raises: then its
+    savepoint is rolled back and so are its changes
+    '''
+    connection = transaction.get_connection()
+    outer = _recording()
+    changes = connection.recorded_changes = _Changes()
+    try:
+        with transaction.atomic():
+            yield
+            if outer is None:
+                changes.write()
+    finally:
+        connection.recorded_changes = outer
+    if outer is not None:
+        outer.merge(changes)
+
+
+def _record(update):
+    '''apply update to the changes being recorded, or write them at once outside a block'''
+    changes = _recording()
+    if changes is not None:
+        update(changes)
+        return
+    changes = _Changes()
+    update(changes)
+    changes.write()
+
+
+def names_changed(model, user_id):
+    '''tag/ingredient names or usage counts changed: refresh autocomplete after commit'''
+    _record(lambda changes: changes.names.add((model, user_id)))
+
+
+def entities_changed(model, user_id, ids, deleted=False):
+    '''record changed entities in the change log and the outbox'''
+    def update(changes):
+        for pk in ids:
+            changes.entities[(model, user_id, pk)] = deleted
+    _record(update)
+
+
+def _account_deleted(origin):
+    '''whether a delete cascades from a user, deleted directly or through a queryset'''
+    User = get_user_model()
+    return isinstance(origin, User) or getattr(origin, 'model', None) is User
+
+
+def relations_changed(user_id, recipe_ids):
+    '''
+    tags/ingredients of these recipes were renamed, removed or replaced from
+    the tag/ingredient side: their details changed, so give them new versions
+    '''
+    recipe_ids = list(recipe_ids)
+    Recipe.objects.bump_versions(recipe_ids)
+    entities_changed(Recipe, user_id, recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def entity_saved(sender, instance, created=False, **kwargs):
+    entities_changed(sender, instance.user_id, [instance.pk])
+    if sender is not Recipe:
+        names_changed(sender, instance.user_id)
+        if not created:
+            # the name shows in the details of the recipes using it
+            relations_changed(instance.user_id, instance.recipe_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def entity_deleted(sender, instance, origin=None, **kwargs):
+    if _account_deleted(origin):
+        # the whole account is going away, including its change log, but
+        # consumers still need to drop what they hold of it
+        outbox.publish(ENTITY_TYPES[sender], instance.user_id, [instance.pk], deleted=True)
+        return
+    entities_changed(sender, instance.user_id, [instance.pk], deleted=True)
+    if sender is Recipe:
+        names_changed(Tag, instance.user_id)
+        names_changed(Ingredient, instance.user_id)
+    else:
+        names_changed(sender, instance.user_id)
+    # deleting a tag/ingredient changes the id lists of its recipes (see core.signals)
+    relations_changed(instance.user_id, getattr(instance, '_deleted_recipe_ids', []))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # through the recipe, whose write path moves it to a new version
+        entities_changed(Recipe, instance.user_id, [instance.pk])
+    elif action == 'post_clear':
+        relations_changed(instance.user_id, getattr(instance, '_cleared_recipe_ids', []))
+    else:
+        relations_changed(instance.user_id, pk_set)
+    names_changed(Tag if sender is Recipe.tags.through else Ingredient, instance.user_id)
@@ -0,0 +1,129 @@
+'''
+"related recipes" by shared tags and ingredients
+
+each worker keeps, per user, an inverted index from every tag and ingredient
+to the recipes using it, built from the denormalized Recipe.tag_ids and
+ingredient_ids columns in one query. similarity is the Jaccard index of the
+two recipes' combined tag and ingredient sets; only recipes sharing at least
+one of them are ever scored, by walking the target recipe's postings.
+
+the index remembers the last change log entry it has seen. a lookup first
+applies the recipe changes logged since (the same entries delta sync reads),
+so edits from any worker reach it incrementally; a long backlog, or an index
+older than RECIPE_SIMILARITY_MAX_AGE, is rebuilt instead. an index is built
+without holding any lock and published once complete; catching up and scoring
+lock only that user's index, so one large account doesn't hold up the others.
+'''
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from core.models import Recipe, ChangeLogEntry
+
+MAX_USERS = 256  # per worker LRU bound
+MAX_CHANGES = 500  # past this many pending changes a rebuild is cheaper
+
+
+class _Index:
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.built_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.features = {}  # recipe id -> frozenset of ('tag', id) / ('ingredient', id)
+        self.postings = {}  # feature -> set of recipe ids
+
+    def put(self, pk, tag_ids, ingredient_ids):
+        self.remove(pk)
+        features = frozenset([('tag', i) for i in tag_ids] + [('ingredient', i) for i in ingredient_ids])
+        self.features[pk] = features
+        for feature in features:
+            self.postings.setdefault(feature, set()).add(pk)
+
+    def remove(self, pk):
+        for feature in self.features.pop(pk, ()):
+            recipes = self.postings[feature]
+            recipes.discard(pk)
+            if not recipes:
+                del self.postings[feature]
+
+    def similar(self, pk, limit):
+        '''return up to limit (score, recipe id), best first'''
+        features = self.features.get(pk, frozenset())
+        shared = {}
+        for feature in features:
+            for other in self.postings[feature]:
+                shared[other] = shared.get(other, 0) + 1
+        shared.pop(pk, None)
+        scores = (
+            (count / (len(features) + len(self.features[other]) - count), other)
+            for other, count in shared.items()
+        )
+        # ties go to the newer recipe
+        return heapq.nlargest(limit, scores)
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()  # guards _indexes only
+
+
+def _cursor(user_id):
+    return ChangeLogEntry.objects.filter(user_id=user_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def _build(user_id):
+    # take the cursor first: changes committed while reading are applied again later
+    index = _Index(_cursor(user_id))
+    rows = Recipe.objects.filter(user_id=user_id).values_list('id', 'tag_ids', 'ingredient_ids')
+    for pk, tag_ids, ingredient_ids in rows.iterator():
+        index.put(pk, tag_ids, ingredient_ids)
+    return index
+
+
+def _catch_up(index, user_id):
+    '''apply recipe changes logged after the index cursor, False if a rebuild is due'''
+    entries = list(
+        ChangeLogEntry.objects.filter(user_id=user_id, id__gt=index.cursor, entity_type='recipe')
+        .order_by('id').values_list('id', 'entity_id')[:MAX_CHANGES + 1]
+    )
+    if len(entries) > MAX_CHANGES:
+        return False
+    if not entries:
+        return True
+    changed = {entity_id for entry_id, entity_id in entries}
+    rows = Recipe.objects.filter(user_id=user_id, id__in=changed).values_list('id', 'tag_ids', 'ingredient_ids')
+    for pk, tag_ids, ingredient_ids in rows:
+        index.put(pk, tag_ids, ingredient_ids)
+        changed.discard(pk)
+    for pk in changed:
+        index.remove(pk)  # deleted since
+    index.cursor = entries[-1][0]
+    return True
+
+
+def similar(user_id, recipe_id, limit=10):
+    '''return up to limit (recipe id, score) of the user's recipes most similar to recipe_id'''
+    with _lock:
+        index = _indexes.get(user_id)
+        if index is not None:
+            _indexes.move_to_end(user_id)
+    if index is not None:
+        with index.lock:
+            expired = time.monotonic() - index.built_at > settings.RECIPE_SIMILARITY_MAX_AGE
+            if not expired and _catch_up(index, user_id):
+                return [(pk, score) for score, pk in index.similar(recipe_id, limit)]
+
+    index = _build(user_id)
+    with _lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > MAX_USERS:
+            _indexes.popitem(last=False)
+    with index.lock:
+        return [(pk, score) for score, pk in index.similar(recipe_id, limit)]
+
+
+def clear():
+    '''drop every index held by this worker'''
+    with _lock:
+        _indexes.clear()
@@ -0,0 +1,120 @@
+'''
+per user snapshot of recipes, tags and ingredients
+
+the snapshot is a normalized payload (entities keyed by id, recipes refer to
+tags and ingredients by id) materialized in the cache. it is built with one
+query per entity type, reading the denormalized tag_ids/ingredient_ids columns
+instead of joining the through tables.
+
+the cached snapshot remembers the last change log entry it has seen, and a
+read first applies the entries logged since (the same ones delta sync reads),
+re-reading just the changed entities. the database is the only shared state,
+so with a per process cache every worker's copy still catches up with writes
+made by other workers and by run_worker, and readers patching concurrently
+can't lose a change: at worst an older copy is stored and caught up again.
+reads cost one indexed change log query plus the cache fetch. entries younger
+than SYNC_SETTLE_SECONDS are applied but not yet counted as seen, in case an
+older transaction is still committing.
+'''
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import serializers
+from core.models import Recipe, Tag, Ingredient, ChangeLogEntry
+
+PRICE_FIELD = serializers.DecimalField(max_digits=5, decimal_places=2)
+RECIPE_FIELDS = ['id', 'title', 'time_minutes', 'price', 'link', 'version', 'tag_ids', 'ingredient_ids']
+# snapshot section -> model
+SECTIONS = {'recipes': Recipe, 'tags': Tag, 'ingredients': Ingredient}
+# change log entity type -> snapshot section
+ENTITY_SECTIONS = {'recipe': 'recipes', 'tag': 'tags', 'ingredient': 'ingredients'}
+MAX_CHANGES = 500  # past this many pending changes a rebuild is cheaper
+
+
+def _cache_key(user_id):
+    # v3: cached as (change log cursor, snapshot)
+    return f'recipe-snapshot:v3:{user_id}'
+
+
+def settle_horizon():
+    '''change log entries created after this may still have older ones committing'''
+    return timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+
+
+def _recipe_entity(row):
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'time_minutes': row['time_minutes'],
+        'price': PRICE_FIELD.to_representation(row['price']),
+        'link': row['link'],
+        'version': row['version'],
+        'tags': row['tag_ids'],
+        'ingredients': row['ingredient_ids'],
+    }
+
+
+def serialize_entities(section, queryset):
+    '''return {id: entity} for the rows of a snapshot section'''
+    if section == 'recipes':
+        return {str(row['id']): _recipe_entity(row) for row in queryset.values(*RECIPE_FIELDS)}
+    return {str(row['id']): row for row in queryset.values('id', 'name')}
+
+
+def build_snapshot(user_id):
+    '''build and cache the snapshot for a user'''
+    # take the cursor first: changes committed while reading are applied again later
+    cursor = ChangeLogEntry.objects.filter(
+        user_id=user_id, created_at__lte=settle_horizon()).order_by('-id').values_list('id', flat=True).first() or 0
+    snapshot = {
+        section: serialize_entities(section, model.objects.filter(user_id=user_id).order_by('id'))
+        for section, model in SECTIONS.items()
+    }
+    cache.set(_cache_key(user_id), (cursor, snapshot), settings.RECIPE_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def _catch_up(user_id, cursor, snapshot):
+    '''apply changes logged after cursor, returning the new cursor or None if a rebuild is due'''
+    entries = list(
+        ChangeLogEntry.objects.filter(user_id=user_id, id__gt=cursor)
+        .order_by('id').values_list('id', 'entity_type', 'entity_id', 'created_at')[:MAX_CHANGES + 1]
+    )
+    if len(entries) > MAX_CHANGES:
+        return None
+    changed = {section: set() for section in SECTIONS}
+    horizon = settle_horizon()
+    settled = True
+    for entry_id, entity_type, entity_id, created_at in entries:
+        changed[ENTITY_SECTIONS[entity_type]].add(entity_id)
+        settled = settled and created_at <= horizon
+        if settled:
+            cursor = entry_id
+    for section, ids in changed.items():
+        if not ids:
+            continue
+        entities = snapshot[section]
+        for pk in ids:
+            entities.pop(str(pk), None)  # deleted ones are not read back
+        entities.update(serialize_entities(section, SECTIONS[section].objects.filter(user_id=user_id, id__in=ids)))
+    return cursor
+
+
+def get_snapshot(user_id):
+    '''return the cached snapshot for a user, brought up to date or built if needed'''
+    cached = cache.get(_cache_key(user_id))
+    if cached is None:
+        return build_snapshot(user_id)
+    cursor, snapshot = cached
+    new_cursor = _catch_up(user_id, cursor, snapshot)
+    if new_cursor is None:
+        return build_snapshot(user_id)
+    if new_cursor != cursor:
+        cache.set(_cache_key(user_id), (new_cursor, snapshot), settings.RECIPE_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def forget(user_id):
+    '''drop a user's cached snapshot'''
+    cache.delete(_cache_key(user_id))
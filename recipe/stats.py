@@ -0,0 +1,95 @@
+'''
+per user recipe statistics
+
+everything is aggregated by the database: count/avg/min/max in one query,
+percentiles as nearest-rank lookups that walk the (user, price) and
+(user, time_minutes) indexes, and the per tag/ingredient breakdowns as
+GROUP BY queries over the through tables. the result is kept in
+core.RecipeStats, so repeated reads cost one primary key lookup until a
+write bumps the row's version.
+'''
+import math
+from decimal import Decimal
+from django.db.models import Avg, Count, F, Max, Min
+from core.models import Recipe, RecipeIngredient, RecipeStats
+
+PERCENTILES = [50, 90, 95]
+PRICE_QUANTUM = Decimal('0.01')
+FIELDS = ['price', 'time_minutes']
+
+
+def _format(field, value):
+    '''prices as two decimal strings like the recipe API, times as numbers'''
+    if value is None:
+        return None
+    if field == 'price':
+        return str(Decimal(value).quantize(PRICE_QUANTUM))
+    return round(float(value), 1)
+
+
+def _summary(recipes, field, count, totals):
+    summary = {
+        'avg': _format(field, totals[f'{field}_avg']),
+        'min': _format(field, totals[f'{field}_min']),
+        'max': _format(field, totals[f'{field}_max']),
+    }
+    ordered = recipes.order_by(field).values_list(field, flat=True)
+    for percentile in PERCENTILES:
+        rank = max(math.ceil(percentile / 100 * count), 1)
+        summary[f'p{percentile}'] = _format(field, ordered[rank - 1]) if count else None
+    return summary
+
+
+def _breakdown(through, attr, user_id):
+    '''recipe count and averages per tag or ingredient, most used first'''
+    rows = (
+        through.objects.filter(recipe__user_id=user_id)
+        .values(f'{attr}_id', f'{attr}__name')
+        .annotate(count=Count('recipe_id'), avg_price=Avg('recipe__price'), avg_time=Avg('recipe__time_minutes'))
+        .order_by('-count', f'{attr}__normalized_name')
+    )
+    return [
+        {
+            'id': row[f'{attr}_id'],
+            'name': row[f'{attr}__name'],
+            'count': row['count'],
+            'avg_price': _format('price', row['avg_price']),
+            'avg_time_minutes': _format('time_minutes', row['avg_time']),
+        }
+        for row in rows
+    ]
+
+
+def compute_stats(user_id):
+    '''aggregate the user's recipes'''
+    recipes = Recipe.objects.filter(user_id=user_id)
+    aggregates = {'count': Count('id')}
+    for field in FIELDS:
+        aggregates.update({
+            f'{field}_avg': Avg(field), f'{field}_min': Min(field), f'{field}_max': Max(field),
+        })
+    totals = recipes.aggregate(**aggregates)
+    data = {'count': totals['count']}
+    for field in FIELDS:
+        data[field] = _summary(recipes, field, totals['count'], totals)
+    data['tags'] = _breakdown(Recipe.tags.through, 'tag', user_id)
+    data['ingredients'] = _breakdown(RecipeIngredient, 'ingredient', user_id)
+    return data
+
+
+def get_stats(user_id):
+    '''return the user's stats, recomputing them if a write happened since'''
+    rollup, created = RecipeStats.objects.get_or_create(user_id=user_id)
+    if rollup.computed_version == rollup.version:
+        return rollup.data
+    # record the version read before aggregating: a write landing meanwhile
+    # bumps it again, so the next read recomputes
+    version = rollup.version
+    data = compute_stats(user_id)
+    RecipeStats.objects.filter(user_id=user_id).update(data=data, computed_version=version)
+    return data
+
+
+def invalidate(user_id):
+    '''mark the user's stats stale, inside the writing transaction'''
+    RecipeStats.objects.filter(user_id=user_id).update(version=F('version') + 1)
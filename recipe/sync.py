@@ -0,0 +1,84 @@
+'''
+delta sync for offline clients
+
+a client keeps the cursor returned by the previous call and asks for
+everything that changed after it. changes are read from core.ChangeLogEntry
+in bounded batches, collapsed to the latest state of each entity, and returned
+as current rows plus tombstones for deleted ids.
+
+the cursor is the change log id, which is taken when a transaction inserts,
+not when it commits, so a newer id can become visible before an older one.
+entries younger than SYNC_SETTLE_SECONDS are left for the next call, and the
+cursor never moves past them, so a client can't skip a change that was still
+committing (the same horizon as recipe.outbox).
+
+compact() keeps the log from growing with every write. it only deletes
+entries of an entity that has a later settled entry, so for any cursor the
+set of entities changed after it stays the same, which is all that sync, the
+snapshots and the similarity index read. the latest id of each user stays too.
+'''
+from django.db.models import Exists, Max, OuterRef
+from core.models import ChangeLogEntry
+from .snapshot import ENTITY_SECTIONS, SECTIONS, serialize_entities, settle_horizon
+
+
+def full_sync(user_id):
+    '''current state of everything, for a client without a cursor'''
+    # take the cursor first and only up to settled entries: anything committed
+    # after it is sent again next time
+    cursor = ChangeLogEntry.objects.filter(
+        user_id=user_id, created_at__lte=settle_horizon()).aggregate(cursor=Max('id'))['cursor'] or 0
+    data = {
+        section: list(serialize_entities(section, model.objects.filter(user_id=user_id).order_by('id')).values())
+        for section, model in SECTIONS.items()
+    }
+    data.update({'cursor': cursor, 'has_more': False, 'deleted': {section: [] for section in SECTIONS}})
+    return data
+
+
+def delta_sync(user_id, since, limit):
+    '''changes after the cursor, at most limit change log entries per call'''
+    horizon = settle_horizon()
+    entries = []
+    for entry in (ChangeLogEntry.objects.filter(user_id=user_id, id__gt=since).order_by('id')
+                  .values_list('id', 'entity_type', 'entity_id', 'deleted', 'created_at')[:limit + 1]):
+        if entry[-1] > horizon:
+            break
+        entries.append(entry)
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # latest entry wins for each entity
+    latest = {}
+    for entry_id, entity_type, entity_id, deleted, created_at in entries:
+        latest[(ENTITY_SECTIONS[entity_type], entity_id)] = deleted
+
+    data = {'cursor': entries[-1][0] if entries else since, 'has_more': has_more}
+    deleted_ids = {section: [] for section in SECTIONS}
+    for section, model in SECTIONS.items():
+        changed = [pk for (sec, pk), deleted in latest.items() if sec == section and not deleted]
+        rows = serialize_entities(section, model.objects.filter(user_id=user_id, id__in=changed).order_by('id'))
+        data[section] = list(rows.values())
+        # a changed entity that is gone by now is reported as deleted straight away
+        deleted_ids[section] = sorted(
+            pk for (sec, pk), deleted in latest.items() if sec == section and (deleted or str(pk) not in rows)
+        )
+    data['deleted'] = deleted_ids
+    return data
+
+
+def compact(batch_size=1000):
+    '''delete change log entries superseded by a later settled one, returning how many'''
+    horizon = settle_horizon()
+    later = ChangeLogEntry.objects.filter(
+        user_id=OuterRef('user_id'), entity_type=OuterRef('entity_type'), entity_id=OuterRef('entity_id'),
+        id__gt=OuterRef('id'), created_at__lte=horizon,
+    )
+    deleted, start = 0, 0
+    while True:
+        ids = list(ChangeLogEntry.objects.filter(id__gt=start, created_at__lte=horizon)
+                   .order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += ChangeLogEntry.objects.filter(id__in=ids).filter(Exists(later)).delete()[0]
+        start = ids[-1]
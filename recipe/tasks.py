@@ -0,0 +1,9 @@
+'''
+deferred recipe work, queued with core.jobs.enqueue and run by manage.py run_worker
+'''
+from . import stats
+
+
+def refresh_stats(user_id):
+    '''recompute a user's stats after writes, so the next read doesn't wait for it'''
+    stats.get_stats(user_id)
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, async_views
 
 router = DefaultRouter()  # automatically create router
 router.register('recipes', views.RecipeViewSet)  # generate url patterns for view
@@ -12,4 +12,11 @@ app_name = 'recipe'
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('snapshot/', views.SnapshotView.as_view(), name='snapshot'),
+    path('sync/', views.SyncView.as_view(), name='sync'),
+    # ASGI-native read endpoints
+    path('async/recipes/', async_views.recipe_list, name='async-recipe-list'),
+    path('async/recipes/<int:pk>/', async_views.recipe_detail, name='async-recipe-detail'),
+    path('async/tags/', async_views.tag_list, name='async-tag-list'),
+    path('async/ingredients/', async_views.ingredient_list, name='async-ingredient-list'),
 ]
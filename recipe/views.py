@@ -1,14 +1,40 @@
 from django.shortcuts import render
-from .serializers import RecipeSerializer, RecipeDetailSerializer, TagSerializer, IngredientSerializer, RecipeImageSerializer
-from rest_framework import viewsets, mixins, status
+from decimal import Decimal, InvalidOperation
+from .serializers import (
+    RecipeSerializer, RecipeDetailSerializer, TagSerializer, IngredientSerializer, RecipeImageSerializer,
+    ShoppingListSerializer, ShoppingListItemSerializer, PreconditionFailed,
+    BulkRenameSerializer, BulkDeleteSerializer, MergeSerializer, DuplicateSerializer,
+)
+from .pagination import RecipeCursorPagination
+from .snapshot import get_snapshot
+from .signals import entities_changed, names_changed, recording_changes, relations_changed
+from .sync import full_sync, delta_sync
+from . import autocomplete, shopping, similarity, stats, tasks
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Value, When
+from rest_framework import viewsets, mixins, status, views
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
-from core.models import Recipe, Tag, Ingredient
+from core import jobs
+from core.dedup import RELATIONS, repoint
+from core.models import Recipe, Tag, Ingredient, RecipeIngredient, normalize_name
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter, OpenApiTypes
 
 
+def recipe_etag(version):
+    return f'"{version}"'
+
+
+IF_MATCH = OpenApiParameter(
+    'If-Match', OpenApiTypes.STR, location=OpenApiParameter.HEADER,
+    description='ETag of the recipe as read; the request fails with 412 if it has changed since',
+)
+
+
 @extend_schema_view(
     list=extend_schema(
         parameters=[
@@ -22,8 +48,42 @@ from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiPara
                 OpenApiTypes.STR,
                 description='Comma seperated list of ingredient IDs to filter',
             ),
+            OpenApiParameter(
+                'ordering',
+                OpenApiTypes.STR,
+                description='Field to order by, prefix with - for descending. One of '
+                            'id, title, time_minutes, price, tag_count, ingredient_count (default -id)',
+            ),
+            OpenApiParameter(
+                'max_time',
+                OpenApiTypes.INT,
+                description='Only recipes taking at most this many minutes',
+            ),
+            OpenApiParameter(
+                'min_price',
+                OpenApiTypes.DECIMAL,
+                description='Only recipes costing at least this much',
+            ),
+            OpenApiParameter(
+                'max_price',
+                OpenApiTypes.DECIMAL,
+                description='Only recipes costing at most this much',
+            ),
+            OpenApiParameter(
+                'min_ingredients',
+                OpenApiTypes.INT,
+                description='Only recipes with at least this many ingredients',
+            ),
+            OpenApiParameter(
+                'min_tags',
+                OpenApiTypes.INT,
+                description='Only recipes with at least this many tags',
+            ),
         ]
-    )
+    ),
+    update=extend_schema(parameters=[IF_MATCH]),
+    partial_update=extend_schema(parameters=[IF_MATCH]),
+    destroy=extend_schema(parameters=[IF_MATCH]),
 )
 class RecipeViewSet(viewsets.ModelViewSet):
     '''view for manage recipe APIs'''
@@ -31,52 +91,219 @@ class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()  # query set that is managable through this API
     authentication_classes = [TokenAuthentication]  # use TokenAuthentication
     permission_classes = [IsAuthenticated]  # user should be authenticated
+    throttle_scope = 'recipe'
+    pagination_class = RecipeCursorPagination
+    similar_max_limit = 50
+    etag_actions = ('create', 'retrieve', 'update', 'partial_update', 'upload_image')
+    # time_minutes, price and the counts are backed by (user, field) indexes on Recipe
+    ordering_fields = ['id', 'title', 'time_minutes', 'price', 'tag_count', 'ingredient_count']
+    # query param -> (lookup, type)
+    range_filters = {
+        'max_time': ('time_minutes__lte', int),
+        'min_price': ('price__gte', Decimal),
+        'max_price': ('price__lte', Decimal),
+        'min_ingredients': ('ingredient_count__gte', int),
+        'min_tags': ('tag_count__gte', int),
+    }
 
     def _params_to_ints(self, qs):
         '''convert a list of strings to integers'''
         return [int(str_id) for str_id in qs.split(',')]
 
+    def _param_to_number(self, name, cast):
+        '''return a numeric query param, or None if absent'''
+        value = self.request.query_params.get(name)
+        if value in (None, ''):
+            return None
+        try:
+            value = cast(value)
+        except (ValueError, InvalidOperation):
+            raise ValidationError({name: 'A valid number is required.'})
+        if isinstance(value, Decimal) and not value.is_finite():
+            raise ValidationError({name: 'A valid number is required.'})
+        return value
+
+    def _range_filter(self, name, lookup, cast):
+        '''the lookup for a range query param, with integers bounded to their column'''
+        value = self._param_to_number(name, cast)
+        if value is None or cast is not int:
+            return value
+        field = Recipe._meta.get_field(lookup.split('__')[0])
+        low, high = connection.ops.integer_field_range(field.get_internal_type())
+        # SQLite leaves the range open, but its integers are 64 bit
+        low, high = (-2 ** 63 if low is None else low), (2 ** 63 - 1 if high is None else high)
+        if not low <= value <= high:
+            raise ValidationError({name: f'Must be between {low} and {high}.'})
+        return value
+
+    def _get_ordering(self):
+        '''validate the ordering param, ending with id so the order is total'''
+        ordering = self.request.query_params.get('ordering') or '-id'
+        field = ordering.lstrip('-')
+        if ordering.count('-') > 1 or field not in self.ordering_fields:
+            raise ValidationError({'ordering': f'Must be one of {", ".join(self.ordering_fields)}, optionally prefixed with -.'})
+        if field == 'id':
+            return [ordering]
+        return [ordering, '-id' if ordering.startswith('-') else 'id']
+
     def get_queryset(self):
         '''retrieve recipes for authenticated user'''
-        # return self.queryset.filter(user=self.request.user).order_by('-id')
         tags = self.request.query_params.get('tags')
-        print(tags)
         ingredients = self.request.query_params.get('ingredients')
         queryset = self.queryset
         if tags:
             tag_ids = self._params_to_ints(tags)
-            print(tag_ids)
             queryset = queryset.filter(tags__id__in=tag_ids)
         if ingredients:
             ingredient_ids = self._params_to_ints(ingredients)
             queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+        for param, (lookup, cast) in self.range_filters.items():
+            value = self._range_filter(param, lookup, cast)
+            if value is not None:
+                queryset = queryset.filter(**{lookup: value})
 
-        return queryset.filter(user=self.request.user).order_by('-id').distinct()
+        queryset = queryset.filter(user=self.request.user).order_by(*self._get_ordering()).distinct()
+        return queryset.prefetch_related('tags', 'ingredient_links__ingredient')
 
     def get_serializer_class(self):
         '''return the serializer class for request'''
-        if self.action == 'list':
+        if self.action in ('list', 'similar'):
             return RecipeSerializer
         elif self.action == 'upload_image':
             return RecipeImageSerializer
+        elif self.action == 'shopping_list':
+            return ShoppingListSerializer
+        elif self.action == 'duplicate':
+            return DuplicateSerializer
 
         return self.serializer_class
 
+    def _defer_stats(self):
+        '''recompute the stats off the request, once per burst of writes'''
+        user_id = self.request.user.id
+        jobs.enqueue(tasks.refresh_stats, user_id, key=f'recipe-stats:{user_id}')
+
     def perform_create(self, serializer):
         '''create a new recipe'''
         serializer.save(user=self.request.user)
+        self._defer_stats()
+
+    def _check_if_match(self, recipe):
+        '''reject the write unless If-Match, when sent, names the current version'''
+        header = self.request.headers.get('If-Match')
+        if header is None or header.strip() == '*':
+            return
+        # compression weakens the ETag, the version it names is the same
+        etags = [etag.strip().removeprefix('W/') for etag in header.split(',')]
+        if recipe_etag(recipe.version) not in etags:
+            raise PreconditionFailed()
+
+    def perform_update(self, serializer):
+        self._check_if_match(serializer.instance)
+        serializer.save()
+        self._defer_stats()
+
+    def perform_destroy(self, instance):
+        self._check_if_match(instance)
+        # conditional too, so a recipe changed since it was read survives
+        with recording_changes():
+            deleted, _ = Recipe.objects.filter(pk=instance.pk, version=instance.version).delete()
+            if not deleted:
+                raise PreconditionFailed()
+        self._defer_stats()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        '''give single recipe responses the ETag to send back as If-Match'''
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.action in self.etag_actions and response.status_code < 300:
+            response['ETag'] = recipe_etag(response.data['version'])
+        return response
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('limit', OpenApiTypes.INT, description='Maximum number of recipes (default 10, at most 50)'),
+        ],
+    )
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        '''the user's recipes sharing the most tags and ingredients with this one'''
+        recipe = self.get_object()
+        limit = self._param_to_number('limit', int) or 10
+        scores = similarity.similar(request.user.id, recipe.id, min(max(limit, 1), self.similar_max_limit))
+        recipes = Recipe.objects.filter(id__in=[pk for pk, score in scores]).prefetch_related('tags', 'ingredient_links__ingredient').in_bulk()
+        data = []
+        for pk, score in scores:
+            if pk in recipes:
+                data.append({**self.get_serializer(recipes[pk]).data, 'similarity': round(score, 4)})
+        return Response(data)
+
+    @extend_schema(responses={200: OpenApiTypes.OBJECT})
+    @action(methods=['GET'], detail=False)
+    def stats(self, request):
+        '''count, price and time statistics of the user's recipes, overall and per tag/ingredient'''
+        return Response(stats.get_stats(request.user.id))
 
-    @action(methods='POST', detail=True, url_path='upload-image')
+    @extend_schema(responses=ShoppingListItemSerializer(many=True))
+    @action(methods=['POST'], detail=False, url_path='shopping-list')
+    def shopping_list(self, request):
+        '''combined ingredients of the given recipes, with summed quantities'''
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = shopping.shopping_list(request.user.id, serializer.validated_data['recipes'])
+        return Response(ShoppingListItemSerializer(items, many=True).data)
+
+    @extend_schema(responses={201: RecipeDetailSerializer(many=True)})
+    @action(methods=['POST'], detail=True)
+    def duplicate(self, request, pk=None):
+        '''copy a recipe with its tags, ingredients and image, optionally several times'''
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe = self.get_object()
+        fields = {
+            field.attname: getattr(recipe, field.attname)
+            for field in Recipe._meta.concrete_fields if not field.primary_key and field.name != 'version'
+        }
+        fields['title'] = serializer.validated_data.get('title', recipe.title)
+        # the image file is shared by name, it is only deleted once no recipe uses it
+        fields['image'] = recipe.image.name or None
+        # from the prefetch done by get_object
+        tag_ids = [tag.id for tag in recipe.tags.all()]
+        amounts = [
+            {'ingredient_id': link.ingredient_id, 'quantity': link.quantity, 'unit': link.unit}
+            for link in recipe.ingredient_links.all()
+        ]
+
+        # a fixed number of queries whatever the number of copies, tags and ingredients
+        with recording_changes():
+            created = Recipe.objects.bulk_create([Recipe(**fields) for _ in range(serializer.validated_data['copies'])])
+            Recipe.tags.through.objects.bulk_create(
+                [Recipe.tags.through(recipe_id=copy.id, tag_id=tag_id) for copy in created for tag_id in tag_ids])
+            RecipeIngredient.objects.bulk_create(
+                [RecipeIngredient(recipe_id=copy.id, **amount) for copy in created for amount in amounts])
+            # the summary columns were copied along; bulk inserts send no signals
+            entities_changed(Recipe, request.user.id, [copy.id for copy in created])
+            names_changed(Tag, request.user.id)
+            names_changed(Ingredient, request.user.id)
+        self._defer_stats()
+
+        created = Recipe.objects.filter(id__in=[copy.id for copy in created]).order_by('id').prefetch_related(
+            'tags', 'ingredient_links__ingredient')
+        data = RecipeDetailSerializer(created, many=True, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @extend_schema(parameters=[IF_MATCH])
+    @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
         '''upload an image to recipe'''
         # get obj using pk
         recipe = self.get_object()
+        self._check_if_match(recipe)
         # if passing an existing instance - update, otherwise - create
         serializer = self.get_serializer(recipe, data=request.data)
 
         if serializer.is_valid():
             serializer.save()
-            return Response(serializer.errors, status=status.HTTP_200_OK)
+            return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -98,6 +325,15 @@ class BaseRecipeAttrViewSet(mixins.ListModelMixin,
     '''base viewset for recipe attributes'''
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'recipe_attr'
+    autocomplete_max_limit = 50
+    # rows per statement of the bulk actions, large merges move links in batches of this size
+    bulk_batch_size = 500
+    bulk_serializers = {
+        'bulk_rename': BulkRenameSerializer,
+        'bulk_delete': BulkDeleteSerializer,
+        'merge': MergeSerializer,
+    }
 
     def get_queryset(self):
         '''filter queryset to authenticated user'''
@@ -108,6 +344,129 @@ class BaseRecipeAttrViewSet(mixins.ListModelMixin,
 
         return queryset.filter(user=self.request.user).order_by('name').distinct()
 
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('prefix', OpenApiTypes.STR, required=True,
+                             description='Case insensitive name prefix'),
+            OpenApiParameter('limit', OpenApiTypes.INT, description='Maximum number of suggestions (default 10)'),
+        ],
+        responses={200: OpenApiTypes.OBJECT},
+    )
+    @action(methods=['GET'], detail=False)
+    def autocomplete(self, request):
+        '''suggest existing names starting with prefix, most used first'''
+        prefix = request.query_params.get('prefix', '')
+        if not prefix.strip():
+            raise ValidationError({'prefix': 'This parameter is required.'})
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), self.autocomplete_max_limit)
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required.'})
+        return Response(autocomplete.suggest(self.queryset.model, request.user.id, prefix, limit))
+
+    def get_serializer_class(self):
+        return self.bulk_serializers.get(self.action, self.serializer_class)
+
+    def perform_update(self, serializer):
+        # a rename also moves the recipes using the tag/ingredient to new versions
+        with recording_changes():
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with recording_changes():
+            instance.delete()
+
+    def _owned(self, ids):
+        '''the ids among ids of the user's rows, raising for the others'''
+        owned = set(self.queryset.model.objects.filter(user=self.request.user, id__in=ids).values_list('id', flat=True))
+        unknown = sorted(set(ids) - owned)
+        if unknown:
+            raise ValidationError({'detail': f'Not found: {", ".join(map(str, unknown))}.'})
+        return sorted(owned)
+
+    def _delete_rows(self, ids):
+        '''
+        delete rows whose recipe links are gone with one statement per batch,
+        doing the bookkeeping the per row delete signals would do once for all
+        '''
+        model = self.queryset.model
+        user_id = self.request.user.id
+        table = connection.ops.quote_name(model._meta.db_table)
+        with connection.cursor() as cursor:
+            for start in range(0, len(ids), self.bulk_batch_size):
+                # plain SQL rather than QuerySet.delete(), whose collector would
+                # load every row to send its signals; nothing references the rows
+                # any more, so there is nothing to cascade either
+                chunk = ids[start:start + self.bulk_batch_size]
+                cursor.execute(f'DELETE FROM {table} WHERE id IN ({", ".join(["%s"] * len(chunk))})', chunk)
+        entities_changed(model, user_id, ids, deleted=True)
+        names_changed(model, user_id)
+
+    @extend_schema(responses={200: OpenApiTypes.OBJECT})
+    @action(methods=['POST'], detail=False, url_path='bulk-rename')
+    def bulk_rename(self, request):
+        '''rename several of the user's tags/ingredients at once'''
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        model = self.queryset.model
+        names = {item['id']: item['name'] for item in serializer.validated_data['items']}
+        with recording_changes():
+            ids = self._owned(names)
+            normalized = {pk: normalize_name(name) for pk, name in names.items()}
+            holders = model.objects.filter(user=request.user, normalized_name__in=normalized.values())
+            clashes = sorted(name for pk, name in holders.values_list('id', 'normalized_name') if normalized.get(pk) != name)
+            if clashes:
+                raise ValidationError({'detail': f'Already exist: {", ".join(clashes)}.'})
+            for start in range(0, len(ids), self.bulk_batch_size):
+                chunk = ids[start:start + self.bulk_batch_size]
+                model.objects.filter(id__in=chunk).update(
+                    name=Case(*(When(id=pk, then=Value(names[pk])) for pk in chunk)),
+                    normalized_name=Case(*(When(id=pk, then=Value(normalized[pk])) for pk in chunk)),
+                )
+            entities_changed(model, request.user.id, ids)
+            names_changed(model, request.user.id)
+            relations_changed(request.user.id, Recipe.objects.filter(
+                **{f'{RELATIONS[model._meta.model_name]}__in': ids}).values_list('id', flat=True).distinct())
+        renamed = model.objects.filter(id__in=ids).order_by('name')
+        return Response(self.serializer_class(renamed, many=True).data)
+
+    @extend_schema(responses={200: OpenApiTypes.OBJECT})
+    @action(methods=['POST'], detail=False, url_path='bulk-delete')
+    def bulk_delete(self, request):
+        '''delete several of the user's tags/ingredients, removing them from their recipes'''
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        model = self.queryset.model
+        column = f'{model._meta.model_name}_id'
+        through = getattr(Recipe, RELATIONS[model._meta.model_name]).through
+        with recording_changes():
+            ids = sorted(set(model.objects.filter(
+                user=request.user, id__in=serializer.validated_data['ids']).values_list('id', flat=True)))
+            links = through.objects.filter(**{f'{column}__in': ids})
+            recipe_ids = set(links.values_list('recipe_id', flat=True))
+            links.delete()
+            self._delete_rows(ids)
+            Recipe.objects.refresh_summaries(recipe_ids, self.bulk_batch_size)
+            relations_changed(request.user.id, recipe_ids)
+        return Response({'deleted': len(ids), 'recipes': len(recipe_ids)})
+
+    @extend_schema(responses={200: OpenApiTypes.OBJECT})
+    @action(methods=['POST'], detail=False)
+    def merge(self, request):
+        '''fold tags/ingredients into target: their recipes get target instead, and they are deleted'''
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        model = self.queryset.model
+        target = serializer.validated_data['target']
+        with recording_changes():
+            sources = self._owned(set(serializer.validated_data['sources']))
+            self._owned([target])
+            remap = {pk: (target, request.user.id) for pk in sources}
+            recipe_ids = repoint(model, Recipe, remap, self.bulk_batch_size).get(request.user.id, set())
+            self._delete_rows(sources)
+            relations_changed(request.user.id, recipe_ids)
+        return Response({'merged': len(sources), 'recipes': len(recipe_ids)})
+
 
 class TagViewSet(BaseRecipeAttrViewSet):
     '''manage tags in the databse'''
@@ -119,3 +478,44 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
     '''manage ingredients in the databse'''
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
+
+
+class SnapshotView(views.APIView):
+    '''recipes, tags and ingredients of the authenticated user in one normalized payload'''
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'recipe'
+
+    @extend_schema(responses={200: OpenApiTypes.OBJECT})
+    def get(self, request):
+        return Response(get_snapshot(request.user.id))
+
+
+class SyncView(views.APIView):
+    '''changes to recipes, tags and ingredients since a cursor, for offline clients'''
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'recipe'
+
+    def _param_to_int(self, name, default):
+        try:
+            value = int(self.request.query_params.get(name, default))
+        except ValueError:
+            raise ValidationError({name: 'A valid integer is required.'})
+        if value < 0:
+            raise ValidationError({name: 'Must not be negative.'})
+        return value
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('since', OpenApiTypes.INT, description='Cursor from the previous sync, omit for a full sync'),
+            OpenApiParameter('limit', OpenApiTypes.INT, description='Maximum number of changes to return'),
+        ],
+        responses={200: OpenApiTypes.OBJECT},
+    )
+    def get(self, request):
+        since = self._param_to_int('since', 0)
+        if not since:
+            return Response(full_sync(request.user.id))
+        limit = min(self._param_to_int('limit', settings.SYNC_BATCH_SIZE) or 1, settings.SYNC_MAX_BATCH_SIZE)
+        return Response(delta_sync(request.user.id, since, limit))
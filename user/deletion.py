@@ -0,0 +1,108 @@
+'''
+account deletion in bounded batches
+
+deleting a User through the ORM makes the collector load every recipe, tag,
+ingredient and through row of the account to send their delete signals,
+which for large accounts takes minutes and a lot of memory. instead
+request_deletion() deactivates the account at once (and drops its token) and
+queues delete_account() as a background job, which removes the rows
+ACCOUNT_DELETE_BATCH_SIZE at a time with plain DELETE statements, one
+transaction per batch. what the signals would have done is done per batch:
+outbox events so consumers drop the entities, and image files released once
+no recipe references them. the job reports its progress on the Job row.
+
+the account's change log is deleted with it, sync clients of a deleted
+account have nothing left to sync.
+'''
+import logging
+from functools import partial
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from rest_framework.authtoken.models import Token
+from core import jobs
+from core.models import Recipe, Tag, Ingredient, RecipeIngredient, ChangeLogEntry, RecipeStats
+from core.signals import release_image
+from recipe import autocomplete, outbox, snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def request_deletion(user):
+    '''lock the account out now and queue the deletion, returning the job'''
+    with transaction.atomic():
+        get_user_model().objects.filter(id=user.id).update(is_active=False)
+        Token.objects.filter(user_id=user.id).delete()
+        return jobs.enqueue(delete_account, user.id, key=f'delete-account:{user.id}')
+
+
+def _delete_batch(queryset):
+    '''delete the first batch of queryset with one DELETE, returning the deleted ids'''
+    ids = list(queryset.order_by('id').values_list('id', flat=True)[:settings.ACCOUNT_DELETE_BATCH_SIZE])
+    if ids:
+        # plain SQL rather than QuerySet.delete(), whose collector would load
+        # the rows to send their signals; the callers do that work per batch
+        table = connection.ops.quote_name(queryset.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {table} WHERE id IN ({", ".join(["%s"] * len(ids))})', ids)
+    return ids
+
+
+def _delete_recipes(user_id):
+    '''delete a batch of recipes and their links, returning how many'''
+    with transaction.atomic():
+        rows = list(
+            Recipe.objects.filter(user_id=user_id).order_by('id')
+            .values_list('id', 'image')[:settings.ACCOUNT_DELETE_BATCH_SIZE]
+        )
+        if not rows:
+            return 0
+        ids = [pk for pk, image in rows]
+        # neither through model has signals, so these are single DELETEs
+        Recipe.tags.through.objects.filter(recipe_id__in=ids).delete()
+        RecipeIngredient.objects.filter(recipe_id__in=ids).delete()
+        _delete_batch(Recipe.objects.filter(id__in=ids))
+        outbox.publish('recipe', user_id, ids, deleted=True)
+        for image in {image for pk, image in rows if image}:
+            transaction.on_commit(partial(release_image, image))
+    return len(ids)
+
+
+def _delete_named(model, user_id):
+    '''delete a batch of tags/ingredients, whose recipe links are already gone'''
+    with transaction.atomic():
+        ids = _delete_batch(model.objects.filter(user_id=user_id))
+        outbox.publish(model._meta.model_name, user_id, ids, deleted=True)
+    return len(ids)
+
+
+def delete_account(user_id):
+    '''delete the account and everything it owns, a batch per transaction'''
+    User = get_user_model()
+    if not User.objects.filter(id=user_id).exists():
+        return
+    progress = {'recipes': 0, 'tags': 0, 'ingredients': 0}
+    steps = [
+        ('recipes', partial(_delete_recipes, user_id)),
+        ('tags', partial(_delete_named, Tag, user_id)),
+        ('ingredients', partial(_delete_named, Ingredient, user_id)),
+    ]
+    for name, step in steps:
+        while True:
+            deleted = step()
+            if not deleted:
+                break
+            progress[name] += deleted
+            jobs.set_progress(**progress, done=False)
+    while _delete_batch(ChangeLogEntry.objects.filter(user_id=user_id)):
+        pass
+
+    # only small rows are left for the collector
+    with transaction.atomic():
+        RecipeStats.objects.filter(user_id=user_id).delete()
+        User.objects.filter(id=user_id).delete()
+    snapshot.forget(user_id)
+    autocomplete.invalidate(Tag, user_id)
+    autocomplete.invalidate(Ingredient, user_id)
+    jobs.set_progress(**progress, done=True)
+    logger.info('deleted account %s: %s', user_id, progress)
@@ -1,6 +1,7 @@
 from django.contrib.auth import get_user_model, authenticate
 from django.utils.translation import gettext as _
 from rest_framework import serializers
+from .throttling import check_login_allowed, record_login_failure, clear_login_failures
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -39,14 +40,20 @@ class AuthTokenSerializer(serializers.Serializer):
         '''validate and authenticate the user'''
         email = attrs.get('email')
         password = attrs.get('password')
+        request = self.context.get('request')
+        # reject before authenticate() spends a password hash on it
+        check_login_allowed(request, email)
         user = authenticate(
-            request=self.context.get('request'),
+            request=request,
             username=email,
             password=password,
         )
         if not user:
+            record_login_failure(request, email)
             msg = _('Unable to authenticate with provided credentials.')
             raise serializers.ValidationError(msg, code='authorization')
 
+        clear_login_failures(email)
+
         attrs['user'] = user
         return attrs
@@ -0,0 +1,43 @@
+'''
+login failure throttling
+
+failed logins are counted per email and per client address in the cache; once
+either reaches the limit further attempts are rejected before authenticate()
+runs the password hasher
+'''
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+
+def _limits(request, email):
+    '''map cache key to the failure limit for that key'''
+    limits = {f'login-failures:email:{email.lower()}': settings.LOGIN_FAILURE_LIMIT}
+    if request is not None:
+        limits[f'login-failures:ip:{BaseThrottle().get_ident(request)}'] = settings.LOGIN_FAILURE_IP_LIMIT
+    return limits
+
+
+def check_login_allowed(request, email):
+    '''raise Throttled if the email or client has too many recent failures'''
+    limits = _limits(request, email)
+    counts = cache.get_many(limits)
+    if any(count >= limits[key] for key, count in counts.items()):
+        raise Throttled(wait=settings.LOGIN_FAILURE_WINDOW)
+
+
+def record_login_failure(request, email):
+    '''count a failed login for the email and client'''
+    for key in _limits(request, email):
+        # add() starts the window, incr() keeps the original expiry
+        cache.add(key, 0, settings.LOGIN_FAILURE_WINDOW)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, settings.LOGIN_FAILURE_WINDOW)
+
+
+def clear_login_failures(email):
+    '''reset the per-email counter after a successful login'''
+    cache.delete(f'login-failures:email:{email.lower()}')
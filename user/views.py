@@ -1,22 +1,40 @@
 from django.shortcuts import render
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, authentication, permissions, status
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 from .serializers import UserSerializer, AuthTokenSerializer
+from .deletion import request_deletion
 
 
 class CreateUserView(generics.CreateAPIView):
     '''create a new user'''
     serializer_class = UserSerializer
+    throttle_scope = 'user'
 
 
 class CreateTokenView(ObtainAuthToken):
     '''create a new auth token for user'''
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES  # ObtainAuthToken disables throttling
+    throttle_scope = 'login'
 
+    def post(self, request, *args, **kwargs):
+        '''return the user's existing token, creating one only on first login'''
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        try:
+            # joined in by UserManager.get_by_natural_key, so no extra query
+            token = user.auth_token
+        except Token.DoesNotExist:
+            token, created = Token.objects.get_or_create(user=user)
+        return Response({'token': token.key})
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     '''
     manage the authenticated user
     retrieve the user that is authenticated, run it through serializer and return 
@@ -24,7 +42,13 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
     authentication_classes = [authentication.TokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'user'
 
     def get_object(self):
         '''retrieve and return the authenticated user'''
         return self.request.user
+
+    def destroy(self, request, *args, **kwargs):
+        '''deactivate the account now, its data is deleted in the background'''
+        request_deletion(self.get_object())
+        return Response({'detail': 'Account deletion scheduled.'}, status=status.HTTP_202_ACCEPTED)